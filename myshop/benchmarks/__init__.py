@@ -0,0 +1,22 @@
+"""
+Stand-alone benchmarks for the shop.
+
+Run them from the project directory, e.g.::
+
+    python -m benchmarks.recommender
+"""
+import os
+import sys
+from pathlib import Path
+
+
+def setup_django():
+    """
+    Configures Django so the benchmark can import project modules.
+    """
+    base_dir = Path(__file__).resolve().parent.parent
+    if str(base_dir) not in sys.path:
+        sys.path.insert(0, str(base_dir))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myshop.settings')
+    import django
+    django.setup()
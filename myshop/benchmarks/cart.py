@@ -0,0 +1,83 @@
+"""
+Benchmark for add-to-cart with the session and Redis cart storages.
+
+Each add is followed by saving the session, as SessionMiddleware does at
+the end of a request, so the session storage pays for rewriting the
+serialized session row. Runs against a throwaway test database and needs
+a running Redis configured by ``REDIS_*`` settings.
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+from django.test import RequestFactory, override_settings  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+
+from cart.cart import Cart  # noqa: E402
+from shop.models import Category, Product  # noqa: E402
+
+STORAGES = {
+    'session': 'cart.storage.SessionCartStorage',
+    'redis': 'cart.storage.RedisCartStorage',
+}
+
+
+def add_to_cart(products, adds):
+    """
+    Adds ``adds`` products round-robin, saving the session after each add,
+    and returns the adds per second.
+    """
+    request = RequestFactory().get('/')
+    request.session = SessionStore()
+    start = time.perf_counter()
+    for i in range(adds):
+        Cart(request).add(products[i % len(products)])
+        if request.session.modified:
+            request.session.save()
+    elapsed = time.perf_counter() - start
+    Cart(request).clear()
+    return adds / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--adds', type=int, default=2000)
+    parser.add_argument(
+        '--lines', type=int, nargs='+', default=[1, 10, 50]
+    )
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        category = Category.objects.create(name='Bench', slug='bench')
+        products = [
+            Product.objects.create(
+                category=category,
+                name=f'Bench {i}',
+                slug=f'bench-{i}',
+                price=Decimal('10.00'),
+            )
+            for i in range(max(args.lines))
+        ]
+        print(f'{"lines":>6} {"storage":>8} {"adds/s":>10}')
+        for lines in args.lines:
+            for name, storage in STORAGES.items():
+                with override_settings(CART_STORAGE=storage):
+                    rate = add_to_cart(products[:lines], args.adds)
+                print(f'{lines:>6} {name:>8} {rate:>10.0f}')
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark for checkout latency against cart size.
+
+Compares the original order creation, one ``OrderItem.objects.create``
+and one commit per cart line, with ``orders.views.order_create``, which
+saves the order and ``bulk_create``s its items in one transaction.
+Runs against a throwaway test database. With the default SQLite
+settings that database lives in memory, so commits are cheaper than on
+a disk-backed or networked database and the gap is a lower bound.
+"""
+import argparse
+import statistics
+import time
+from decimal import Decimal
+from unittest import mock
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.contrib.sessions.backends.db import SessionStore  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+
+from cart.cart import Cart, get_cart  # noqa: E402
+from orders.forms import OrderCreateForm  # noqa: E402
+from orders.models import OrderItem  # noqa: E402
+from orders.views import order_create  # noqa: E402
+from shop.models import Category, Product  # noqa: E402
+
+DATA = {
+    'first_name': 'Ivan',
+    'last_name': 'Ivanov',
+    'email': 'ivan@example.com',
+    'address': 'Lenina 1',
+    'postal_code': '101000',
+    'city': 'Moscow',
+}
+
+
+def make_request(products):
+    """
+    Returns a checkout POST request whose cart holds ``products``.
+    """
+    request = RequestFactory().post('/orders/create/', DATA)
+    request.session = SessionStore()
+    Cart(request).update([(product, 1, False) for product in products])
+    return request
+
+
+def order_create_per_item(request):
+    """
+    The original order creation: no transaction, one insert per item.
+    """
+    cart = get_cart(request)
+    order = OrderCreateForm(request.POST).save()
+    for item in cart:
+        OrderItem.objects.create(
+            order=order,
+            product=item['product'],
+            price=item['price'],
+            quantity=item['quantity'],
+        )
+    cart.clear()
+
+
+def measure(func, products, repeat):
+    """
+    Returns the mean and p95 checkout latency of ``func`` in ms.
+    """
+    latencies = []
+    for _ in range(repeat):
+        request = make_request(products)
+        start = time.perf_counter()
+        func(request)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.mean(latencies), statistics.quantiles(
+        latencies, n=20
+    )[18]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1, 5, 20, 50, 100]
+    )
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        category = Category.objects.create(name='Bench', slug='bench')
+        products = [
+            Product.objects.create(
+                category=category,
+                name=f'Bench {i}',
+                slug=f'bench-{i}',
+                price=Decimal('10.00'),
+            )
+            for i in range(max(args.sizes))
+        ]
+        print(
+            f'{"lines":>6} {"per-item ms":>12} {"p95":>8} '
+            f'{"bulk ms":>9} {"p95":>8}'
+        )
+        with mock.patch('orders.views.order_created'):
+            for size in args.sizes:
+                old = measure(
+                    order_create_per_item, products[:size], args.repeat
+                )
+                new = measure(order_create, products[:size], args.repeat)
+                print(
+                    f'{size:>6} {old[0]:>12.2f} {old[1]:>8.2f} '
+                    f'{new[0]:>9.2f} {new[1]:>8.2f}'
+                )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark for the memory use of the orders CSV export.
+
+Compares the original ``export_to_csv``, which loads model instances and
+writes every row into an ``HttpResponse`` held in memory, with
+``orders.admin.export_to_csv``, which streams ``values_list`` rows. The
+streamed response is consumed and discarded chunk by chunk, as a WSGI
+server sends it. Prints the time and the peak memory traced by
+``tracemalloc`` for each number of orders. Runs against a throwaway
+test database.
+"""
+import argparse
+import csv
+import datetime
+import time
+import tracemalloc
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.contrib.admin.sites import site  # noqa: E402
+from django.http import HttpResponse  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+from django.utils import timezone  # noqa: E402
+
+from coupons.models import Coupon  # noqa: E402
+from orders.admin import OrderAdmin, export_to_csv  # noqa: E402
+from orders.models import Order  # noqa: E402
+
+
+def export_in_memory(modeladmin, request, queryset):
+    """
+    The original export: instances, getattr per field, one response.
+    """
+    opts = modeladmin.model._meta
+    response = HttpResponse(content_type='text/csv')
+    writer = csv.writer(response)
+    fields = [
+        field
+        for field in opts.get_fields()
+        if not field.many_to_many and not field.one_to_many
+    ]
+    writer.writerow([field.verbose_name for field in fields])
+    for obj in queryset:
+        data_row = []
+        for field in fields:
+            value = getattr(obj, field.name)
+            if isinstance(value, datetime.datetime):
+                value = value.strftime('%d/%m/%Y')
+            data_row.append(value)
+        writer.writerow(data_row)
+    return response
+
+
+def measure(func, queryset):
+    """
+    Runs an export of ``queryset``, consumes the response and returns
+    the time in s and the peak traced memory in MB.
+    """
+    modeladmin = OrderAdmin(Order, site)
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = func(modeladmin, None, queryset)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    else:
+        response.content
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10_000, 50_000, 100_000]
+    )
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code='BENCH', valid_from=now, valid_to=now, discount=10,
+            active=True,
+        )
+        print(
+            f'{"orders":>8} {"in memory s":>12} {"peak MB":>8} '
+            f'{"streamed s":>11} {"peak MB":>8}'
+        )
+        created = 0
+        for size in sorted(args.sizes):
+            orders = [
+                Order(
+                    first_name=f'Ivan {i}',
+                    last_name='Ivanov',
+                    email='ivan@example.com',
+                    address='Lenina 1',
+                    postal_code='101000',
+                    city='Moscow',
+                    coupon=coupon if i % 3 == 0 else None,
+                )
+                for i in range(created, size)
+            ]
+            for order in orders:
+                order.set_folded_names()
+            Order.objects.bulk_create(orders, batch_size=2000)
+            created = size
+            queryset = Order.objects.all()
+            old = measure(export_in_memory, queryset)
+            new = measure(export_to_csv, queryset)
+            print(
+                f'{size:>8} {old[0]:>12.2f} {old[1]:>8.1f} '
+                f'{new[0]:>11.2f} {new[1]:>8.1f}'
+            )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark for co-purchase ingestion with the Redis backend.
+
+Applies the same synthetic orders once per order, as the Stripe webhook
+used to, and in coalesced batches, as ``shop.tasks.ingest_purchases``
+does, and prints Redis round trips and orders per second for each batch
+size. Requires a running Redis configured by ``REDIS_*`` settings.
+"""
+import argparse
+import random
+import time
+from unittest import mock
+
+from benchmarks import setup_django
+
+setup_django()
+
+import redis  # noqa: E402
+
+from shop.recommender.backends.redis import (  # noqa: E402
+    RedisRecommenderBackend,
+)
+
+# ids far away from real catalog ids, the keys are removed afterwards
+BASE_ID = 10_000_000
+
+
+def measure(func, batches):
+    """
+    Calls ``func`` for every batch of orders and returns the number of
+    round trips and orders per second.
+    """
+    sent = mock.patch.object(
+        redis.connection.Connection,
+        'send_packed_command',
+        autospec=True,
+        side_effect=redis.connection.Connection.send_packed_command,
+    )
+    orders = sum(len(batch) for batch in batches)
+    with sent as send:
+        start = time.perf_counter()
+        for batch in batches:
+            func(batch)
+        elapsed = time.perf_counter() - start
+    return send.call_count, orders / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--order-size', type=int, default=4)
+    parser.add_argument(
+        '--batch-sizes', type=int, nargs='+', default=[10, 100, 500]
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    orders = [
+        rng.sample(
+            range(BASE_ID, BASE_ID + args.products), args.order_size
+        )
+        for _ in range(args.orders)
+    ]
+    backend = RedisRecommenderBackend()
+
+    def per_order(batch):
+        for product_ids in batch:
+            backend.products_bought(product_ids)
+
+    rows = [('per order', *measure(per_order, [[o] for o in orders]))]
+    for size in args.batch_sizes:
+        batches = [
+            orders[i:i + size] for i in range(0, len(orders), size)
+        ]
+        rows.append(
+            (f'batch {size}', *measure(backend.products_bought_many, batches))
+        )
+    backend.client.delete(
+        *[
+            key
+            for id in range(BASE_ID, BASE_ID + args.products)
+            for key in (
+                backend.get_product_key(id),
+                backend.get_suggestions_key(id),
+            )
+        ]
+    )
+
+    print(f'{"mode":>10} {"round trips":>12} {"orders/s":>10}')
+    for mode, round_trips, rate in rows:
+        print(f'{mode:>10} {round_trips:>12} {rate:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark for invoice PDF rendering throughput and latency.
+
+Renders the same invoice HTML, an order with ``--items`` lines:
+
+- ``per render``: the original way, ``finders.find`` plus a freshly
+  parsed ``weasyprint.CSS`` for every PDF, serially in this process;
+- ``preparsed``: ``orders.rendering.render_with_stylesheet``, serially
+  in this process with the stylesheet and fonts loaded once;
+- ``pool N``: ``orders.rendering.render`` with a pool of N processes,
+  called from ``--concurrency`` threads at once, as concurrent requests
+  would.
+
+Prints renders per second and the p50 and p95 latency of one render,
+and the time the first render of a pool waits for it to start. Runs
+against a throwaway test database. Needs WeasyPrint with its system
+libraries; the numbers only mean something with the real renderer.
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+setup_django()
+
+import weasyprint  # noqa: E402
+from django.contrib.staticfiles import finders  # noqa: E402
+from django.test import override_settings  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+
+from orders import rendering  # noqa: E402
+from orders.invoices import (  # noqa: E402
+    INVOICE_STYLESHEET,
+    get_invoice_data,
+    render_invoice_html,
+)
+from orders.models import Order, OrderItem  # noqa: E402
+from shop.models import Category, Product  # noqa: E402
+
+
+def render_per_call(html, path):
+    """
+    The original rendering: the stylesheet is found and parsed every time.
+    """
+    stylesheets = [weasyprint.CSS(finders.find(INVOICE_STYLESHEET))]
+    return weasyprint.HTML(string=html).write_pdf(stylesheets=stylesheets)
+
+
+def measure(func, html, path, renders, concurrency):
+    """
+    Calls ``func`` ``renders`` times from ``concurrency`` threads and
+    returns renders per second and the p50 and p95 latency in ms.
+    """
+    def timed(_):
+        start = time.perf_counter()
+        func(html, path)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as threads:
+        latencies = list(threads.map(timed, range(renders)))
+    elapsed = time.perf_counter() - start
+    quantiles = statistics.quantiles(latencies, n=20)
+    return renders / elapsed, quantiles[9], quantiles[18]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--renders', type=int, default=50)
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        category = Category.objects.create(name='Bench', slug='bench')
+        order = Order.objects.create(
+            first_name='Ivan',
+            last_name='Ivanov',
+            email='ivan@example.com',
+            address='Lenina 1',
+            postal_code='101000',
+            city='Moscow',
+        )
+        for i in range(args.items):
+            product = Product.objects.create(
+                category=category,
+                name=f'Bench {i}',
+                slug=f'bench-{i}',
+                price=Decimal('10.00'),
+            )
+            OrderItem.objects.create(
+                order=order, product=product, price=product.price, quantity=2
+            )
+        order.update_totals()
+        html = render_invoice_html(get_invoice_data([order])[0])
+        path = finders.find(INVOICE_STYLESHEET)
+
+        print(
+            f'{"mode":>12} {"renders/s":>10} {"p50 ms":>8} {"p95 ms":>8} '
+            f'{"start ms":>9}'
+        )
+        for name, func in [
+            ('per render', render_per_call),
+            ('preparsed', rendering.render_with_stylesheet),
+        ]:
+            func(html, path)
+            rate, p50, p95 = measure(func, html, path, args.renders, 1)
+            print(f'{name:>12} {rate:>10.1f} {p50:>8.1f} {p95:>8.1f}')
+        for workers in args.workers:
+            with override_settings(INVOICE_RENDER_WORKERS=workers):
+                start = time.perf_counter()
+                rendering.render(html, path)
+                started = (time.perf_counter() - start) * 1000
+                rate, p50, p95 = measure(
+                    rendering.render, html, path, args.renders,
+                    args.concurrency,
+                )
+                rendering.shutdown_pool()
+            print(
+                f'{f"pool {workers}":>12} {rate:>10.1f} {p50:>8.1f} '
+                f'{p95:>8.1f} {started:>9.0f}'
+            )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""
+Benchmark for the orders admin changelist on a large table.
+
+Fills a throwaway test database with ``--orders`` orders (1M by
+default) and requests the changelist of the original ``OrderAdmin``
+configuration and of ``orders.admin.OrderAdmin`` for the first page, a
+deep page, a filter and searches. Prints the number of queries, the
+time spent in the database and the response time for each. The
+original configuration is mounted on a separate admin site:
+- exact COUNT(*) pagination plus a second count of all orders;
+- OFFSET pages;
+- reverse() per row;
+- search with icontains over the same fields.
+The new one uses estimated counts, keyset pages after the last ID of the
+previous page, and indexed search.
+
+With the default settings the database is in-memory SQLite, so there is
+no disk I/O and the absolute numbers are optimistic; the growth with the
+table size is what matters.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.contrib import admin  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client, override_settings  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+from django.urls import path, reverse  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from django.utils.safestring import mark_safe  # noqa: E402
+
+from myshop.urls import urlpatterns as project_urlpatterns  # noqa: E402
+from orders.admin import OrderItemInline, export_to_csv  # noqa: E402
+from orders.models import Order  # noqa: E402
+
+FIRST_NAMES = ['Ivan', 'Petr', 'Anna', 'Maria', 'Olga', 'Sergey', 'Elena']
+# about 4000 distinct last names, e.g. Kozlovsky
+LAST_NAMES = [
+    f'{head}{middle}{tail}'
+    for head in ['Ko', 'Pe', 'Si', 'Sm', 'Ku', 'Po', 'Vo', 'Le', 'Mo', 'Ba']
+    for middle in [
+        'zl', 'tr', 'd', 'rn', 'zn', 'p', 'lk', 'b', 'r', 'gd',
+        'sh', 'ch', 'v', 'rs', 'nt', 'lt', 'st', 'kr', 'gr', 'zh',
+    ]
+    for tail in [
+        'ov', 'ev', 'in', 'sky', 'enko', 'uk', 'ich', 'ovsky', 'yan', 'ko',
+        'ovich', 'ak', 'ets', 'ik', 'ovets', 'arev', 'yshev', 'ukov',
+        'anov', 'ikov',
+    ]
+]
+
+
+def order_detail(obj):
+    url = reverse('orders:admin_order_detail', args=[obj.id])
+    return mark_safe(f'<a href="{url}">View Order Details</a>')
+
+
+def order_pdf(obj):
+    url = reverse('orders:admin_order_pdf', args=[obj.id])
+    return mark_safe(f'<a href="{url}">PDF Invoice</a>')
+
+
+def order_payment(obj):
+    url = obj.get_stripe_url()
+    if obj.stripe_id:
+        return mark_safe(f'<a href="{url}" target="_blank">{obj.stripe_id}</a>')
+    return ''
+
+
+class LegacyOrderAdmin(admin.ModelAdmin):
+    """
+    The original changelist configuration, with a plain search added.
+    """
+    list_display = [
+        'id',
+        'first_name',
+        'last_name',
+        'email',
+        'address',
+        'postal_code',
+        'city',
+        'total',
+        'paid',
+        order_payment,
+        'created',
+        'updated',
+        order_detail,
+        order_pdf,
+    ]
+    list_filter = ['paid', 'created', 'updated']
+    search_fields = ['id', 'email', 'first_name', 'last_name']
+    inlines = [OrderItemInline]
+    actions = [export_to_csv]
+
+
+legacy_site = admin.AdminSite(name='legacy')
+legacy_site.register(Order, LegacyOrderAdmin)
+
+urlpatterns = [path('legacy/', legacy_site.urls)] + project_urlpatterns
+
+
+def fill(count):
+    """
+    Inserts ``count`` orders with raw SQL, in batches.
+    """
+    rng = random.Random(42)
+    now = timezone.now()
+    sql = (
+        'INSERT INTO orders_order (first_name, last_name, email, address, '
+        'postal_code, city, created, updated, paid, stripe_id, discount, '
+        'subtotal, discount_amount, total, recommendations_synced, '
+        'stock_reserved, stock_released, first_name_folded, '
+        'last_name_folded) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, '
+        '%s, %s, %s, %s, %s)'
+    )
+    batch = []
+    with connection.cursor() as cursor:
+        for i in range(count):
+            first_name = rng.choice(FIRST_NAMES)
+            last_name = rng.choice(LAST_NAMES)
+            created = now - timezone.timedelta(minutes=count - i)
+            paid = rng.random() < 0.7
+            batch.append((
+                first_name, last_name,
+                f'{first_name}.{last_name}.{i}@example.com'.lower(),
+                'Lenina 1', '101000', 'Moscow', created, created, paid,
+                f'pi_{i}' if paid else '', 0, '25.00', '0.00', '25.00',
+                paid, False, False, first_name.casefold(),
+                last_name.casefold(),
+            ))
+            if len(batch) == 10_000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+def measure(client, url, repeat):
+    """
+    Returns the number of queries, the median time spent in the
+    database and the median response time in ms.
+    """
+    latencies = []
+    db_times = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, (url, response.status_code)
+        db_times.append(
+            sum(float(query['time']) for query in context.captured_queries)
+            * 1000
+        )
+    return (
+        len(context),
+        statistics.median(db_times),
+        statistics.median(latencies),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        with override_settings(
+            ALLOWED_HOSTS=['testserver'],
+            ROOT_URLCONF='benchmarks.order_admin',
+        ):
+            start = time.perf_counter()
+            fill(args.orders)
+            print(
+                f'inserted {args.orders} orders in '
+                f'{time.perf_counter() - start:.0f} s'
+            )
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            client = Client()
+            client.force_login(
+                User.objects.create_superuser('admin', 'a@example.com', 'x')
+            )
+            old = reverse('legacy:orders_order_changelist')
+            new = reverse('admin:orders_order_changelist')
+            deep = args.orders // 2
+            cursor = (
+                Order.objects.order_by('-id')
+                .values_list('id', flat=True)[deep - 1]
+            )
+            email = Order.objects.values_list('email', flat=True).get(
+                id=cursor
+            )
+            cases = [
+                ('first page', old, new),
+                (
+                    f'page {deep // 100 + 1}',
+                    f'{old}?p={deep // 100 + 1}',
+                    f'{new}?after={cursor}',
+                ),
+                ('paid filter', f'{old}?paid__exact=1', f'{new}?paid__exact=1'),
+                ('search id', f'{old}?q={cursor}', f'{new}?q={cursor}'),
+                ('search e-mail', f'{old}?q={email}', f'{new}?q={email}'),
+                ('search name', f'{old}?q=kozlov', f'{new}?q=kozlov'),
+            ]
+            print(
+                f'{"":>14} {"old":>26} {"new":>26}\n'
+                f'{"case":>14} {"queries":>8} {"db ms":>8} {"total ms":>8} '
+                f'{"queries":>8} {"db ms":>8} {"total ms":>8}'
+            )
+            for name, old_url, new_url in cases:
+                old_row = measure(client, old_url, args.repeat)
+                new_row = measure(client, new_url, args.repeat)
+                print(
+                    f'{name:>14} '
+                    + ' '.join(
+                        f'{value:>8.1f}' if isinstance(value, float)
+                        else f'{value:>8}'
+                        for value in old_row + new_row
+                    )
+                )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
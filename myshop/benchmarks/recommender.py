@@ -0,0 +1,97 @@
+"""
+Benchmark for co-purchase updates in ``Recommender.products_bought``
+with the Redis backend.
+
+Compares the old one-command-per-pair update with the pipelined one and
+prints Redis round trips and wall time for growing order sizes.
+Requires a running Redis configured by ``REDIS_*`` settings.
+"""
+import argparse
+import time
+from unittest import mock
+
+from benchmarks import setup_django
+
+setup_django()
+
+import redis  # noqa: E402
+
+from shop.recommender.backends.redis import (  # noqa: E402
+    RedisRecommenderBackend,
+)
+
+# ids far away from real catalog ids, the keys are removed afterwards
+BASE_ID = 10_000_000
+
+
+def products_bought_per_pair(backend, products_ids):
+    """
+    The original update: one ZINCRBY round trip for every ordered pair.
+    """
+    for product_id in products_ids:
+        for with_id in products_ids:
+            if product_id != with_id:
+                backend.client.zincrby(
+                    backend.get_product_key(product_id), 1, with_id
+                )
+
+
+def measure(func, backend, products_ids, repeat):
+    """
+    Runs ``func`` ``repeat`` times and returns round trips per call
+    and mean wall time in milliseconds.
+    """
+    sent = mock.patch.object(
+        redis.connection.Connection,
+        'send_packed_command',
+        autospec=True,
+        side_effect=redis.connection.Connection.send_packed_command,
+    )
+    with sent as send:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(backend, products_ids)
+        elapsed = time.perf_counter() - start
+    return send.call_count // repeat, elapsed / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[1, 2, 5, 10, 20, 50]
+    )
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    backend = RedisRecommenderBackend()
+    rows = []
+    for size in args.sizes:
+        products_ids = [BASE_ID + i for i in range(size)]
+        old = measure(
+            products_bought_per_pair, backend, products_ids, args.repeat
+        )
+        new = measure(
+            RedisRecommenderBackend.products_bought,
+            backend,
+            products_ids,
+            args.repeat,
+        )
+        rows.append((size, *old, *new))
+        backend.client.delete(
+            *[backend.get_product_key(id) for id in products_ids],
+            *[backend.get_suggestions_key(id) for id in products_ids],
+        )
+
+    print(
+        f'{"items":>6} {"per-pair rt":>12} {"per-pair ms":>12} '
+        f'{"pipelined rt":>13} {"pipelined ms":>13}'
+    )
+    for size, old_rt, old_ms, new_rt, new_ms in rows:
+        print(
+            f'{size:>6} {old_rt:>12} {old_ms:>12.2f} '
+            f'{new_rt:>13} {new_ms:>13.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark of the recommender backends.
+
+Measures mean latency of ``products_bought`` and ``suggest_for`` for the
+memory, SQLite and Redis backends on the same synthetic orders. The Redis
+backend uses database 15 and is skipped when Redis is not reachable.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks import setup_django
+
+setup_django()
+
+import redis  # noqa: E402
+
+from shop.recommender.backends.memory import (  # noqa: E402
+    MemoryRecommenderBackend,
+)
+from shop.recommender.backends.redis import (  # noqa: E402
+    RedisRecommenderBackend,
+)
+from shop.recommender.backends.sqlite import (  # noqa: E402
+    SQLiteRecommenderBackend,
+)
+
+
+def get_backends(directory):
+    """
+    Returns the backends to compare by name.
+    """
+    backends = {
+        'memory': MemoryRecommenderBackend(),
+        'sqlite': SQLiteRecommenderBackend(
+            NAME=f'{directory}/benchmark.sqlite3'
+        ),
+    }
+    backend = RedisRecommenderBackend(db=15)
+    try:
+        backend.client.ping()
+    except redis.ConnectionError:
+        print('Redis is not available, skipping the redis backend.')
+    else:
+        backends['redis'] = backend
+    return backends
+
+
+def timed(func, calls):
+    """
+    Calls ``func`` for every argument tuple and returns latencies in ms.
+    """
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--order-size', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    orders = [
+        (rng.sample(range(1, args.products + 1), args.order_size),)
+        for _ in range(args.orders)
+    ]
+    single = [
+        ([rng.randint(1, args.products)], 4) for _ in range(args.lookups)
+    ]
+    many = [
+        (rng.sample(range(1, args.products + 1), 3), 4)
+        for _ in range(args.lookups)
+    ]
+
+    print(
+        f'{"backend":>8} {"bought ms":>10} {"suggest 1 ms":>13} '
+        f'{"suggest 3 ms":>13} {"p99 1 ms":>9}'
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        for name, backend in get_backends(directory).items():
+            backend.clear_purchases()
+            bought = timed(backend.products_bought, orders)
+            suggest_one = timed(backend.suggest_for, single)
+            suggest_many = timed(backend.suggest_for, many)
+            backend.clear_purchases()
+            print(
+                f'{name:>8} {statistics.mean(bought):>10.3f} '
+                f'{statistics.mean(suggest_one):>13.3f} '
+                f'{statistics.mean(suggest_many):>13.3f} '
+                f'{statistics.quantiles(suggest_one, n=100)[98]:>9.3f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Benchmark for stock reservation under concurrent checkouts of one SKU.
+
+Starts many threads at once that each buy one unit of a single product
+and compares a read-check-save reservation (``select_for_update``, then
+``save``) with ``shop.inventory.reserve_stock``, a single conditional
+``UPDATE``. Prints the accepted, rejected and failed purchases, the units
+oversold and the reservation latency for each.
+
+Runs against a throwaway file-backed SQLite test database, so writers
+wait for each other on the busy timeout as they do in production.
+SQLite ignores ``select_for_update`` and locks the whole database, so
+the read-check-save variant can also fail on lock upgrades; on
+PostgreSQL it queues behind the row lock for the whole transaction
+instead.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from benchmarks import setup_django
+
+setup_django()
+
+from django.db import OperationalError, connections, transaction  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+
+from shop.inventory import OutOfStockError, reserve_stock  # noqa: E402
+from shop.models import Category, Product  # noqa: E402
+
+
+def read_check_save(product_id):
+    """
+    Reserves one unit by locking, reading and saving the product.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(id=product_id)
+        if product.stock < 1:
+            raise OutOfStockError([product_id])
+        product.stock -= 1
+        product.save(update_fields=['stock'])
+
+
+def conditional_update(product_id):
+    """
+    Reserves one unit with ``reserve_stock``.
+    """
+    with transaction.atomic():
+        reserve_stock({product_id: 1})
+
+
+def measure(func, product, buyers, stock):
+    """
+    Lets ``buyers`` threads call ``func`` at once for a product with
+    ``stock`` units and returns the outcome counts, the final stock and
+    the latencies in ms.
+    """
+    Product.objects.filter(id=product.id).update(stock=stock)
+    start = threading.Barrier(buyers)
+    outcomes = {'ok': 0, 'rejected': 0, 'failed': 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def buy():
+        start.wait()
+        began = time.perf_counter()
+        try:
+            func(product.id)
+            outcome = 'ok'
+        except OutOfStockError:
+            outcome = 'rejected'
+        except OperationalError:
+            outcome = 'failed'
+        finally:
+            connections.close_all()
+        with lock:
+            outcomes[outcome] += 1
+            latencies.append((time.perf_counter() - began) * 1000)
+
+    threads = [threading.Thread(target=buy) for _ in range(buyers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    product.refresh_from_db()
+    return outcomes, product.stock, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--buyers', type=int, default=50)
+    parser.add_argument('--stock', type=int, default=20)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    connections['default'].settings_dict['TEST']['NAME'] = os.path.join(
+        directory, 'stock.sqlite3'
+    )
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        category = Category.objects.create(name='Bench', slug='bench')
+        product = Product.objects.create(
+            category=category,
+            name='Bench',
+            slug='bench',
+            price=Decimal('10.00'),
+        )
+        print(
+            f'{"mode":>18} {"ok":>5} {"rejected":>9} {"failed":>7} '
+            f'{"oversold":>9} {"p50 ms":>8} {"p99 ms":>8}'
+        )
+        for name, func in [
+            ('read-check-save', read_check_save),
+            ('conditional UPDATE', conditional_update),
+        ]:
+            totals = {'ok': 0, 'rejected': 0, 'failed': 0}
+            oversold = 0
+            latencies = []
+            for _ in range(args.rounds):
+                outcomes, left, round_latencies = measure(
+                    func, product, args.buyers, args.stock
+                )
+                for key, value in outcomes.items():
+                    totals[key] += value
+                # units handed out beyond the stock, or lost updates
+                oversold += max(0, outcomes['ok'] - (args.stock - left))
+                latencies += round_latencies
+            p99 = statistics.quantiles(latencies, n=100)[98]
+            print(
+                f'{name:>18} {totals["ok"]:>5} {totals["rejected"]:>9} '
+                f'{totals["failed"]:>7} {oversold:>9} '
+                f'{statistics.median(latencies):>8.2f} {p99:>8.2f}'
+            )
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == '__main__':
+    main()
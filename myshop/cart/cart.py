@@ -1,9 +1,9 @@
-from decimal import Decimal
-
 from coupons.models import Coupon
-from django.conf import settings
+from myshop.money import from_cents, percent_of, to_cents
 from shop.models import Product
 
+from .storage import get_cart_storage
+
 
 class Cart:
     """
@@ -11,6 +11,7 @@ class Cart:
 
     Attributes:
         session (object): The current session.
+        storage (object): Where the items are kept, chosen by CART_STORAGE.
         cart (dict): The cart items.
         coupon_id (int): The ID of the applied coupon.
     """
@@ -23,37 +24,82 @@ class Cart:
             request (object): The current HTTP request.
         """
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = get_cart_storage(request)
         self.coupon_id = self.session.get('coupon_id')
+        # per-request caches, reset by save()
+        self._cart = None
+        self._items = None
+        self._coupon = None
+        self._coupon_loaded = False
+        self._summary = None
+
+    @property
+    def cart(self):
+        """
+        Returns the cart items, loaded from the storage once per request.
+
+        Returns:
+            dict: {product id (str): {'quantity': int, 'price': str}}
+        """
+        if self._cart is None:
+            self._cart = self.storage.load()
+        return self._cart
 
     def __iter__(self):
         """
         Allows iteration over the cart items.
 
+        Products are fetched with a single query the first time the cart
+        is iterated and reused for the rest of the request.
+
         Yields:
             dict: A dictionary representing a single cart item.
         """
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]['product'] = product
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+        if self._items is None:
+            products = Product.objects.filter(
+                id__in=self.cart.keys()
+            ).prefetch_related('translations')
+            products_by_id = {
+                str(product.id): product for product in products
+            }
+            items = []
+            for product_id, item in self.cart.items():
+                # copy so that products and Decimals stay out of the session
+                item = dict(item)
+                if product_id in products_by_id:
+                    item['product'] = products_by_id[product_id]
+                item['total_price'] = from_cents(
+                    item['price'] * item['quantity']
+                )
+                item['price'] = from_cents(item['price'])
+                items.append(item)
+            self._items = items
+        yield from self._items
 
     def __len__(self):
         """
         Returns the total quantity of items in the cart.
 
+        Read from the stored summary, so the items are not loaded.
+
         Returns:
             int: The total quantity.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        return self.get_summary_counts()[0]
+
+    def get_summary_counts(self):
+        """
+        Returns the item count and total kept next to the cart.
+
+        The storage updates them on every change, so the header badge
+        renders without loading items or products.
+
+        Returns:
+            tuple: The total quantity and the total price in cents.
+        """
+        if self._summary is None:
+            self._summary = self.storage.get_summary()
+        return self._summary
 
     def add(self, product, quantity=1, override_quantity=False):
         """
@@ -64,23 +110,70 @@ class Cart:
             quantity (int, optional): The quantity of the product. Defaults to 1.
             override_quantity (bool, optional): Whether to override the existing quantity. Defaults to False.
         """
-        product_id = str(product.id)
-        if product_id not in self.cart:
-            self.cart[product_id] = {
-                'quantity': 0,
-                'price': str(product.price),
-            }
-        if override_quantity:
-            self.cart[product_id]['quantity'] = quantity
-        else:
-            self.cart[product_id]['quantity'] += quantity
+        self.storage.add(
+            str(product.id),
+            to_cents(product.price),
+            quantity,
+            override_quantity,
+        )
         self.save()
 
+    def update(self, operations):
+        """
+        Applies many add, set and remove operations with one storage write.
+
+        Args:
+            operations (list): (product, quantity, override_quantity) tuples.
+                Setting a quantity of 0 removes the product.
+        """
+        self.storage.update([
+            (
+                str(product.id),
+                to_cents(product.price),
+                quantity,
+                override_quantity,
+            )
+            for product, quantity, override_quantity in operations
+        ])
+        self.save()
+
+    def get_summary(self):
+        """
+        Returns the cart contents and totals in a JSON-serializable form.
+
+        Built from the stored prices, so no products are fetched.
+
+        Returns:
+            dict: The items and totals, with amounts as strings.
+        """
+        items = [
+            {
+                'product_id': int(product_id),
+                'quantity': item['quantity'],
+                'price': str(from_cents(item['price'])),
+                'total_price': str(
+                    from_cents(item['price'] * item['quantity'])
+                ),
+            }
+            for product_id, item in self.cart.items()
+        ]
+        return {
+            'items': items,
+            'total_items': len(self),
+            'total_price': str(self.get_total_price()),
+            'discount': str(self.get_discount()),
+            'total_price_after_discount': str(
+                self.get_total_price_after_discount()
+            ),
+        }
+
     def save(self):
         """
-        Saves the cart session.
+        Drops the per-request caches after the items have changed.
         """
-        self.session.modified = True
+        self._cart = None
+        self._items = None
+        self._summary = None
 
     def remove(self, product):
         """
@@ -89,19 +182,29 @@ class Cart:
         Args:
             product (Product): The product to remove.
         """
-        product_id = str(product.id)
-        if product_id in self.cart:
-            del self.cart[product_id]
-            self.save()
+        self.storage.remove(str(product.id))
+        self.save()
 
     def clear(self):
         """
         Clears the entire cart.
         """
-        del self.session['coupon_id']
-        del self.session[settings.CART_SESSION_ID]
+        self.storage.clear()
+        self.session.pop('coupon_id', None)
+        self.coupon_id = None
+        self._coupon = None
+        self._coupon_loaded = False
         self.save()
 
+    def get_total_cents(self):
+        """
+        Returns the total price of all items in the cart in cents.
+
+        Returns:
+            int: The total price in cents.
+        """
+        return self.get_summary_counts()[1]
+
     def get_total_price(self):
         """
         Returns the total price of all items in the cart.
@@ -109,10 +212,7 @@ class Cart:
         Returns:
             Decimal: The total price.
         """
-        return sum(
-            Decimal(item['price']) * item['quantity']
-            for item in self.cart.values()
-        )
+        return from_cents(self.get_total_cents())
 
     @property
     def coupon(self):
@@ -122,12 +222,26 @@ class Cart:
         Returns:
             Coupon: The applied coupon or None.
         """
-        if self.coupon_id:
-            try:
-                return Coupon.objects.get(id=self.coupon_id)
-            except Coupon.DoesNotExist:
-                pass
-        return None
+        if not self._coupon_loaded:
+            self._coupon_loaded = True
+            if self.coupon_id:
+                try:
+                    self._coupon = Coupon.objects.get(id=self.coupon_id)
+                except Coupon.DoesNotExist:
+                    pass
+        return self._coupon
+
+    def get_discount_cents(self):
+        """
+        Returns the coupon discount in cents, rounded half up.
+
+        Returns:
+            int: The discount amount in cents.
+        """
+        coupon = self.coupon
+        if coupon:
+            return percent_of(self.get_total_cents(), coupon.discount)
+        return 0
 
     def get_discount(self):
         """
@@ -136,11 +250,7 @@ class Cart:
         Returns:
             Decimal: The discount amount.
         """
-        if self.coupon:
-            return (
-                self.coupon.discount / Decimal(100)
-            ) * self.get_total_price()
-        return Decimal(0)
+        return from_cents(self.get_discount_cents())
 
     def get_total_price_after_discount(self):
         """
@@ -149,4 +259,22 @@ class Cart:
         Returns:
             Decimal: The total price after discount.
         """
-        return self.get_total_price() - self.get_discount()
+        return from_cents(self.get_total_cents() - self.get_discount_cents())
+
+
+def get_cart(request):
+    """
+    Returns the cart of the current request, creating it on first use.
+
+    Views and the cart context processor share this instance, so the
+    products, coupon and totals are loaded at most once per request.
+
+    Args:
+        request (object): The current HTTP request.
+
+    Returns:
+        Cart: The cart of the request.
+    """
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
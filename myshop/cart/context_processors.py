@@ -1,4 +1,6 @@
-from .cart import Cart
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
 
 
 def cart(request):
@@ -10,7 +12,7 @@ def cart(request):
 
     Returns:
         dict: A dictionary containing a single key-value pair, where the key is 'cart'
-              and the value is an instance of the Cart class.
+              and the value is the request's Cart, built lazily on first use.
     """
-    # Create a new instance of the Cart class with the given request object
-    return {'cart': Cart(request)}
+    # Share the request's cart with the views, built only if a template uses it
+    return {'cart': SimpleLazyObject(lambda: get_cart(request))}
@@ -36,3 +36,29 @@ class CartAddProductForm(forms.Form):
         # Use a hidden input widget for this field so it won't be displayed in the form.
         widget=forms.HiddenInput
     )
+
+
+class CartUpdateItemForm(forms.Form):
+    """
+    A form class to validate one operation of a bulk cart update.
+
+    Attributes:
+        product_id (forms.IntegerField): The product to change.
+        quantity (forms.IntegerField): The quantity to add or set, 0 removes the product when overriding.
+        override (forms.BooleanField): Whether to set the quantity instead of adding to it.
+    """
+    product_id = forms.IntegerField(min_value=1)
+    quantity = forms.IntegerField(
+        min_value=0, max_value=PRODUCT_QUANTITY_CHOICES[-1][0]
+    )
+    override = forms.BooleanField(required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('quantity') == 0 and not cleaned_data.get(
+            'override'
+        ):
+            raise forms.ValidationError(
+                _('Adding a quantity of 0 has no effect.')
+            )
+        return cleaned_data
@@ -0,0 +1,295 @@
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from myshop.money import to_cents
+from myshop.redis_pool import get_redis
+
+
+class SessionCartStorage:
+    """
+    Keeps the cart as a nested dict inside the Django session.
+
+    Every change marks the whole session as modified, so with the database
+    session engine each add or remove rewrites the serialized session row.
+    The item count and total are kept up to date under
+    CART_SUMMARY_SESSION_ID, next to the cart.
+
+    Attributes:
+        session (object): The current session.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+
+    def _get_cart(self):
+        cart = self.session.get(settings.CART_SESSION_ID)
+        if not cart:
+            cart = self.session[settings.CART_SESSION_ID] = {}
+        return cart
+
+    def load(self):
+        """
+        Returns the cart items.
+
+        Returns:
+            dict: {product id (str): {'quantity': int, 'price': int cents}}
+        """
+        cart = self._get_cart()
+        for item in cart.values():
+            # carts saved before prices were kept in cents hold strings
+            item['price'] = to_cents(item['price'])
+        return cart
+
+    def get_summary(self):
+        """
+        Returns the item count and total without loading the items.
+
+        An empty or missing cart is not created in the session, so
+        browsing without a cart doesn't save a session.
+
+        Returns:
+            tuple: The total quantity and the total price in cents.
+        """
+        summary = self.session.get(settings.CART_SUMMARY_SESSION_ID)
+        if summary is not None:
+            return tuple(summary)
+        cart = self.session.get(settings.CART_SESSION_ID)
+        if not cart:
+            return 0, 0
+        # carts saved before the summary existed
+        return (
+            sum(item['quantity'] for item in cart.values()),
+            sum(
+                to_cents(item['price']) * item['quantity']
+                for item in cart.values()
+            ),
+        )
+
+    def add(self, product_id, price, quantity, override_quantity):
+        """
+        Adds a quantity of a product or sets it.
+
+        Args:
+            product_id (str): The product ID.
+            price (int): The unit price in cents, stored when the product is first added.
+            quantity (int): The quantity to add or set.
+            override_quantity (bool): Whether to set instead of add.
+        """
+        self.update([(product_id, price, quantity, override_quantity)])
+
+    def remove(self, product_id):
+        """
+        Removes a product from the cart.
+
+        Args:
+            product_id (str): The product ID.
+        """
+        self.update([(product_id, None, 0, True)])
+
+    def update(self, operations):
+        """
+        Applies several operations with a single write.
+
+        Setting a quantity of 0 removes the product. The summary is
+        adjusted by the change of every line instead of being recomputed.
+
+        Args:
+            operations (list): (product_id, price, quantity, override_quantity)
+                tuples, applied in order.
+        """
+        count, total = self.get_summary()
+        cart = self._get_cart()
+        for product_id, price, quantity, override_quantity in operations:
+            item = cart.get(product_id)
+            old_quantity = item['quantity'] if item else 0
+            new_quantity = (
+                quantity if override_quantity else old_quantity + quantity
+            )
+            if new_quantity <= 0:
+                if item:
+                    del cart[product_id]
+                    count -= old_quantity
+                    total -= to_cents(item['price']) * old_quantity
+                continue
+            if item is None:
+                item = cart[product_id] = {'quantity': 0, 'price': price}
+            item['quantity'] = new_quantity
+            count += new_quantity - old_quantity
+            total += to_cents(item['price']) * (new_quantity - old_quantity)
+        self.session[settings.CART_SUMMARY_SESSION_ID] = [count, total]
+        self.session.modified = True
+
+    def clear(self):
+        """
+        Removes all items.
+        """
+        self.session.pop(settings.CART_SESSION_ID, None)
+        self.session.pop(settings.CART_SUMMARY_SESSION_ID, None)
+        self.session.modified = True
+
+
+# Lua-script that applies cart operations and adjusts the summary.
+# KEYS[1] - cart hash, ARGV[1] - TTL in seconds, then for every operation
+# ARGV: product id, price in cents, quantity, 1 to set or 0 to add.
+# The summary is kept in the fields _count and _total of the same hash.
+UPDATE_CART_SCRIPT = """
+local key = KEYS[1]
+local count = 0
+local total = 0
+for i = 2, #ARGV, 4 do
+    local id = ARGV[i]
+    local quantity = tonumber(ARGV[i + 2])
+    local old = tonumber(redis.call('HGET', key, id .. ':quantity') or '0')
+    local price = redis.call('HGET', key, id .. ':price')
+    if not price then
+        price = ARGV[i + 1]
+    end
+    price = tonumber(price) or 0
+    local new = quantity
+    if ARGV[i + 3] == '0' then
+        new = old + quantity
+    end
+    if new <= 0 then
+        new = 0
+        redis.call('HDEL', key, id .. ':quantity', id .. ':price')
+    else
+        redis.call('HSET', key, id .. ':quantity', new, id .. ':price', price)
+    end
+    count = count + new - old
+    total = total + (new - old) * price
+end
+redis.call('HINCRBY', key, '_count', count)
+redis.call('HINCRBY', key, '_total', total)
+redis.call('EXPIRE', key, tonumber(ARGV[1]))
+return 1
+"""
+
+
+class RedisCartStorage:
+    """
+    Keeps each cart as a Redis hash, outside the session.
+
+    The hash cart:<cart ID> holds the fields <id>:quantity and
+    <id>:price, and the summary fields _count and _total. A Lua script
+    applies every change and adjusts the summary atomically, so
+    concurrent tabs don't overwrite each other. The random cart ID is
+    stored in the session under CART_REDIS_SESSION_ID when the first
+    item is added, so the cart survives a new session key on login, and
+    the session row is not rewritten afterwards. Every write renews the
+    key's TTL of CART_REDIS_TTL seconds.
+
+    Attributes:
+        session (object): The current session.
+        client (Redis): The pooled Redis client.
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        self.client = get_redis()
+        self.update_script = self.client.register_script(UPDATE_CART_SCRIPT)
+
+    def get_cart_id(self, create=False):
+        """
+        Returns the ID of the cart kept in the session.
+
+        Args:
+            create (bool): Whether to start a cart if the session has none.
+
+        Returns:
+            str: The cart ID, or None if there is no cart.
+        """
+        session_key = self.session.session_key
+        if session_key and settings.CART_REDIS_SESSION_ID not in self.session:
+            # carts started before the ID was kept are keyed by the
+            # session; looked up once per session, None records that
+            # there is no such cart
+            self.session[settings.CART_REDIS_SESSION_ID] = (
+                session_key
+                if self.client.exists(f'cart:{session_key}')
+                else None
+            )
+        cart_id = self.session.get(settings.CART_REDIS_SESSION_ID)
+        if cart_id is None and create:
+            cart_id = uuid.uuid4().hex
+            self.session[settings.CART_REDIS_SESSION_ID] = cart_id
+        return cart_id
+
+    @property
+    def key(self):
+        """
+        Returns the Redis key of the cart, starting a cart if needed.
+
+        Returns:
+            str: The key of the cart hash.
+        """
+        return f'cart:{self.get_cart_id(create=True)}'
+
+    def load(self):
+        if self.get_cart_id() is None:
+            return {}
+        cart = {}
+        for field, value in self.client.hgetall(self.key).items():
+            field = field.decode()
+            if field.startswith('_'):
+                # summary fields
+                continue
+            product_id, name = field.split(':')
+            item = cart.setdefault(product_id, {'quantity': 0, 'price': 0})
+            if name == 'quantity':
+                item['quantity'] = int(value)
+            else:
+                value = value.decode()
+                # prices in cents are ints, older carts hold '12.50'
+                item['price'] = to_cents(
+                    value if '.' in value else int(value)
+                )
+        # a removed line can leave a price without a quantity
+        return {
+            product_id: item
+            for product_id, item in cart.items()
+            if item['quantity'] > 0
+        }
+
+    def get_summary(self):
+        if self.get_cart_id() is None:
+            # no cart yet
+            return 0, 0
+        count, total = self.client.hmget(self.key, '_count', '_total')
+        return int(count or 0), int(total or 0)
+
+    def add(self, product_id, price, quantity, override_quantity):
+        self.update([(product_id, price, quantity, override_quantity)])
+
+    def remove(self, product_id):
+        self.update([(product_id, None, 0, True)])
+
+    def update(self, operations):
+        # all operations are applied by one script call
+        args = [settings.CART_REDIS_TTL]
+        for product_id, price, quantity, override_quantity in operations:
+            args += [
+                product_id,
+                price or 0,
+                quantity,
+                1 if override_quantity else 0,
+            ]
+        self.update_script(keys=[self.key], args=args)
+
+    def clear(self):
+        if self.get_cart_id() is not None:
+            self.client.unlink(self.key)
+
+
+def get_cart_storage(request):
+    """
+    Returns the cart storage selected by the CART_STORAGE setting.
+
+    Args:
+        request (object): The current HTTP request.
+
+    Returns:
+        object: An instance of the configured storage class.
+    """
+    return import_string(settings.CART_STORAGE)(request)
@@ -1,3 +1,346 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import redis
+from coupons.models import Coupon
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from shop.models import Category, Product
+from shop.recommender import Recommender
+
+from .cart import Cart
+from .storage import RedisCartStorage
+
+
+@override_settings(
+    ALLOWED_HOSTS=['testserver'],
+    RECOMMENDER_BACKEND=(
+        'shop.recommender.backends.memory.MemoryRecommenderBackend'
+    ),
+)
+class CartQueriesTests(TestCase):
+    """
+    The cart page and the header badge must render with a constant
+    number of queries regardless of how many products are in the cart.
+    """
+
+    def setUp(self):
+        Recommender().clear_purchases()
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.products = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('10.00'),
+            )
+            for i in range(6)
+        ]
+        # give every cart something to recommend
+        Recommender().products_bought(self.products)
+
+    def add_to_cart(self, products):
+        for product in products:
+            self.client.post(
+                reverse('cart:cart_add', args=[product.id]),
+                {'quantity': 1, 'override': False},
+            )
+
+    def get_cart_detail_queries(self, products):
+        self.add_to_cart(products)
+        url = reverse('cart:cart_detail')
+        self.client.get(url)
+        with self.assertNumQueries(self.cart_detail_queries) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    # session, products, product translations, recommended products
+    cart_detail_queries = 4
+
+    def test_cart_detail_queries_do_not_grow_with_items(self):
+        self.get_cart_detail_queries(self.products[:1])
+        self.get_cart_detail_queries(self.products[1:5])
+
+    def test_coupon_is_fetched_once(self):
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code='TEA10',
+            valid_from=now - timezone.timedelta(days=1),
+            valid_to=now + timezone.timedelta(days=1),
+            discount=10,
+            active=True,
+        )
+        self.add_to_cart(self.products[:2])
+        self.client.post(reverse('coupons:apply'), {'code': coupon.code})
+        # one more query than without a coupon
+        with self.assertNumQueries(self.cart_detail_queries + 1):
+            response = self.client.get(reverse('cart:cart_detail'))
+        self.assertContains(response, '18.00')
+
+
+class CartStorageTests:
+    """
+    Behaviour every cart storage must share.
+    """
+    storage = None
+
+    def setUp(self):
+        self.enterContext(override_settings(CART_STORAGE=self.storage))
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.first, self.second = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('2.50'),
+            )
+            for i in range(2)
+        ]
+        self.request = RequestFactory().get('/')
+        self.request.session = SessionStore()
+
+    def get_cart(self):
+        # a new Cart per call, like a new request with the same session
+        return Cart(self.request)
+
+    def test_add_increments_quantity(self):
+        self.get_cart().add(self.first, 2)
+        self.get_cart().add(self.first, 3)
+        cart = self.get_cart()
+        self.assertEqual(len(cart), 5)
+        self.assertEqual(cart.get_total_price(), Decimal('12.50'))
+
+    def test_override_quantity(self):
+        self.get_cart().add(self.first, 2)
+        self.get_cart().add(self.first, 1, override_quantity=True)
+        self.assertEqual(len(self.get_cart()), 1)
+
+    def test_items_keep_price_when_added(self):
+        self.get_cart().add(self.first)
+        Product.objects.filter(id=self.first.id).update(price='9.00')
+        self.first.refresh_from_db()
+        self.get_cart().add(self.first)
+        item, = list(self.get_cart())
+        self.assertEqual(item['product'], self.first)
+        self.assertEqual(item['price'], Decimal('2.50'))
+        self.assertEqual(item['total_price'], Decimal('5.00'))
+
+    def test_summary_follows_changes(self):
+        cart = self.get_cart()
+        cart.update([
+            (self.first, 3, False),
+            (self.second, 2, False),
+            (self.first, 1, True),
+        ])
+        self.assertEqual(self.get_cart().get_summary_counts(), (3, 750))
+        self.get_cart().remove(self.second)
+        self.assertEqual(self.get_cart().get_summary_counts(), (1, 250))
+        self.get_cart().clear()
+        self.assertEqual(self.get_cart().get_summary_counts(), (0, 0))
+
+    def test_prices_are_stored_in_cents(self):
+        self.get_cart().add(self.first, 3)
+        self.assertEqual(
+            self.get_cart().storage.load(),
+            {str(self.first.id): {'quantity': 3, 'price': 250}},
+        )
+
+    def test_remove_and_clear(self):
+        cart = self.get_cart()
+        cart.add(self.first)
+        cart.add(self.second)
+        cart.remove(self.first)
+        self.assertEqual(
+            [item['product'] for item in self.get_cart()], [self.second]
+        )
+        self.get_cart().clear()
+        self.assertEqual(len(self.get_cart()), 0)
+
+
+class SessionCartStorageTests(CartStorageTests, TestCase):
+    storage = 'cart.storage.SessionCartStorage'
+
+
+class SessionCartStorageLegacyTests(TestCase):
+
+    def test_reads_prices_saved_as_strings(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session[settings.CART_SESSION_ID] = {
+            '1': {'quantity': 3, 'price': '4.15'},
+        }
+        cart = Cart(request)
+        self.assertEqual(cart.get_total_price(), Decimal('12.45'))
+
+
+class RedisCartStorageTests(CartStorageTests, TestCase):
+    storage = 'cart.storage.RedisCartStorage'
+
+    def setUp(self):
+        super().setUp()
+        try:
+            RedisCartStorage(self.request).client.ping()
+        except redis.ConnectionError:
+            self.skipTest(
+                f'Redis is not available at '
+                f'{settings.REDIS_HOST}:{settings.REDIS_PORT}'
+            )
+        self.addCleanup(self.get_cart().clear)
+
+    def test_cart_does_not_touch_session(self):
+        self.get_cart().add(self.first)
+        self.assertNotIn(settings.CART_SESSION_ID, self.request.session)
+
+    def test_cart_survives_new_session_key(self):
+        self.get_cart().add(self.first)
+        self.request.session.save()
+        # login replaces the session key and keeps the session data
+        self.request.session.cycle_key()
+        self.assertEqual(self.get_cart().get_summary_counts(), (1, 250))
+        self.assertIn(
+            str(self.first.id), RedisCartStorage(self.request).load()
+        )
+
+    def test_only_first_item_writes_session(self):
+        self.get_cart().add(self.first)
+        self.request.session.save()
+        self.request.session.modified = False
+        self.get_cart().add(self.second)
+        self.assertFalse(self.request.session.modified)
+
+    def test_cart_started_before_cart_id_is_kept(self):
+        self.request.session.save()
+        storage = RedisCartStorage(self.request)
+        key = f'cart:{self.request.session.session_key}'
+        storage.client.hset(key, mapping={
+            f'{self.first.id}:quantity': 2,
+            f'{self.first.id}:price': 250,
+            '_count': 2,
+            '_total': 500,
+        })
+        self.addCleanup(storage.client.unlink, key)
+        self.assertEqual(self.get_cart().get_summary_counts(), (2, 500))
+        self.assertEqual(RedisCartStorage(self.request).key, key)
+
+    def test_legacy_cart_is_looked_up_once_per_session(self):
+        self.request.session.save()
+        with mock.patch('redis.Redis.exists', return_value=0) as exists:
+            for _ in range(3):
+                self.get_cart().get_summary_counts()
+        exists.assert_called_once()
+
+    def test_cart_expires(self):
+        self.get_cart().add(self.first)
+        storage = RedisCartStorage(self.request)
+        ttl = storage.client.ttl(storage.key)
+        self.assertTrue(0 < ttl <= settings.CART_REDIS_TTL)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CartUpdateTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.first, self.second, self.third = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('2.50'),
+            )
+            for i in range(3)
+        ]
+        self.url = reverse('cart:cart_update')
+
+    def post(self, items):
+        return self.client.post(
+            self.url,
+            json.dumps({'items': items}),
+            content_type='application/json',
+        )
+
+    def test_applies_operations_with_one_product_query(self):
+        self.post([{'product_id': self.third.id, 'quantity': 1}])
+        # products, session, then the session update wrapped in a savepoint
+        with self.assertNumQueries(5):
+            response = self.post([
+                {'product_id': self.first.id, 'quantity': 2},
+                {'product_id': self.first.id, 'quantity': 1},
+                {'product_id': self.second.id, 'quantity': 4},
+                {'product_id': self.second.id, 'quantity': 1,
+                 'override': True},
+                {'product_id': self.third.id, 'quantity': 0,
+                 'override': True},
+            ])
+        self.assertEqual(response.status_code, 200)
+        summary = response.json()
+        self.assertEqual(
+            [(i['product_id'], i['quantity']) for i in summary['items']],
+            [(self.first.id, 3), (self.second.id, 1)],
+        )
+        self.assertEqual(summary['total_items'], 4)
+        self.assertEqual(summary['total_price'], '10.00')
+
+    def test_invalid_operations_change_nothing(self):
+        response = self.post([
+            {'product_id': self.first.id, 'quantity': 2},
+            {'product_id': 999, 'quantity': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['errors'],
+            {
+                '1': {
+                    'product_id': [
+                        {'message': 'Unknown product.', 'code': 'invalid'}
+                    ]
+                }
+            },
+        )
+        response = self.post([{'product_id': self.first.id, 'quantity': 0}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            len(self.client.get(reverse('cart:cart_detail')).context['cart']),
+            0,
+        )
+
+    def test_rejects_malformed_body(self):
+        response = self.client.post(
+            self.url, 'not json', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class CartHeaderTests(TestCase):
+    """
+    The header badge is rendered from the summary kept next to the cart.
+    """
+
+    def setUp(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.product = Product.objects.create(
+            category=category, name='Tea', slug='tea', price=Decimal('2.50')
+        )
+        # a page with the header and nothing else from the database
+        self.url = reverse('payment:canceled')
+
+    def test_header_does_not_fetch_cart_products(self):
+        self.client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'quantity': 3, 'override': False},
+        )
+        # only the session is read
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, '7.50')
+
+    def test_browsing_without_cart_saves_no_session(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
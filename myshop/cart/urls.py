@@ -7,6 +7,7 @@ app_name = 'cart'
 urlpatterns = [
     path('', views.cart_detail, name='cart_detail'),
     path('add/<int:product_id>/', views.cart_add, name='cart_add'),
+    path('update/', views.cart_update, name='cart_update'),
     path(
         'remove/<int:product_id>/',
         views.cart_remove,
@@ -1,11 +1,15 @@
+import json
+
 from coupons.forms import CouponApplyForm
+from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils.translation import gettext as _
 from django.views.decorators.http import require_POST
 from shop.models import Product
 from shop.recommender import Recommender
 
-from .cart import Cart
-from .forms import CartAddProductForm
+from .cart import get_cart
+from .forms import CartAddProductForm, CartUpdateItemForm
 
 
 @require_POST
@@ -20,7 +24,7 @@ def cart_add(request, product_id):
     Returns:
         HttpResponse: A redirect to the cart detail page.
     """
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     form = CartAddProductForm(request.POST)
     if form.is_valid():
@@ -45,12 +49,74 @@ def cart_remove(request, product_id):
     Returns:
         HttpResponse: A redirect to the cart detail page.
     """
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
     return redirect('cart:cart_detail')
 
 
+@require_POST
+def cart_update(request):
+    """
+    Applies many cart operations at once and returns the cart as JSON.
+
+    The body is a JSON object {"items": [{"product_id": 1, "quantity": 2,
+    "override": false}, ...]}. Operations are validated with a single
+    Product query and written to the cart storage in one write. Nothing
+    is applied if any operation is invalid.
+
+    Args:
+        request (HttpRequest): The current HTTP request.
+
+    Returns:
+        JsonResponse: The cart summary, or the errors with status 400.
+    """
+    try:
+        items = json.loads(request.body)['items']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid JSON body.'}, status=400)
+    if not isinstance(items, list):
+        return JsonResponse({'error': 'Invalid JSON body.'}, status=400)
+
+    forms = [
+        CartUpdateItemForm(item if isinstance(item, dict) else {})
+        for item in items
+    ]
+    errors = {
+        index: form.errors.get_json_data()
+        for index, form in enumerate(forms)
+        if not form.is_valid()
+    }
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    products = Product.objects.filter(available=True).in_bulk(
+        {form.cleaned_data['product_id'] for form in forms}
+    )
+    errors = {
+        index: {
+            'product_id': [
+                {'message': _('Unknown product.'), 'code': 'invalid'}
+            ]
+        }
+        for index, form in enumerate(forms)
+        if form.cleaned_data['product_id'] not in products
+    }
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+
+    cart = get_cart(request)
+    cart.update([
+        (
+            products[form.cleaned_data['product_id']],
+            form.cleaned_data['quantity'],
+            form.cleaned_data['override'],
+        )
+        for form in forms
+    ])
+    return JsonResponse(cart.get_summary())
+
+
 def cart_detail(request):
     """
     Displays the user's cart.
@@ -61,7 +127,7 @@ def cart_detail(request):
     Returns:
         HttpResponse: The cart detail page.
     """
-    cart = Cart(request)
+    cart = get_cart(request)
     for item in cart:
         item['update_quantity_form'] = CartAddProductForm(
             initial={'quantity': item['quantity'], 'override': True}
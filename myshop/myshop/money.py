@@ -0,0 +1,55 @@
+"""
+Money helpers based on integer minor units (cents).
+
+Amounts are kept and summed as ints. They are converted to Decimal only
+at the edges: model fields, templates and JSON. Parsing a price once
+into cents replaces re-parsing strings into Decimal on every use.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+CENT = Decimal('0.01')
+
+
+def to_cents(amount):
+    """
+    Converts an amount to integer cents.
+
+    Ints are taken as cents already. Decimals and strings such as '12.50'
+    are rounded half up to the cent.
+
+    Args:
+        amount (int | Decimal | str): The amount.
+
+    Returns:
+        int: The amount in cents.
+    """
+    if isinstance(amount, int):
+        return amount
+    return int(Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+
+
+def from_cents(cents):
+    """
+    Converts integer cents to a Decimal with two decimal places.
+
+    Args:
+        cents (int): The amount in cents.
+
+    Returns:
+        Decimal: The amount, e.g. Decimal('12.50').
+    """
+    return Decimal(cents).scaleb(-2)
+
+
+def percent_of(cents, percent):
+    """
+    Returns a percentage of an amount, rounded half up to the cent.
+
+    Args:
+        cents (int): The amount in cents.
+        percent (int): The percentage, e.g. a coupon discount.
+
+    Returns:
+        int: The percentage of the amount in cents.
+    """
+    return (cents * percent + 50) // 100
@@ -0,0 +1,153 @@
+"""
+Pagination for admin changelists over large tables.
+
+An exact COUNT(*) and OFFSET pagination both read every row before the
+requested page, so their cost grows with the table. EstimatedCountPaginator
+counts exactly only up to a bound and estimates beyond it, and
+KeysetChangeList pages through such lists with WHERE pk < cursor instead
+of OFFSET.
+"""
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+# query string parameter holding the pk of the last row of the previous page
+CURSOR_VAR = 'after'
+
+
+def estimate_count(queryset):
+    """
+    Returns a cheap estimate of the number of rows of a queryset.
+
+    On PostgreSQL the planner's statistics are used: reltuples of the
+    table for an unfiltered queryset, the planned row count otherwise.
+    Elsewhere an unfiltered queryset is estimated by its largest primary
+    key, read from the index.
+
+    Args:
+        queryset (QuerySet): The queryset to estimate.
+
+    Returns:
+        int: The estimate, or None if there is no cheap one.
+    """
+    connection = connections[queryset.db]
+    queryset = queryset.order_by()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+            else:
+                sql, params = queryset.query.get_compiler(
+                    queryset.db
+                ).as_sql()
+                cursor.execute(
+                    f'EXPLAIN (FORMAT JSON) {sql}', params
+                )
+            row = cursor.fetchone()
+        if queryset.query.where:
+            return int(row[0][0]['Plan']['Plan Rows'])
+        # -1 or 0 until the table is analyzed
+        if row and row[0] > 0:
+            return row[0]
+    if not queryset.query.where:
+        return queryset.aggregate(max_pk=Max('pk'))['max_pk']
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that counts exactly only up to exact_count_limit rows.
+
+    The exact count runs over at most exact_count_limit + 1 rows. Longer
+    lists get the larger of that bound and estimate_count(), and
+    estimated is set.
+
+    Attributes:
+        exact_count_limit (int): The largest count that is exact.
+        estimated (bool): Whether count is an estimate.
+    """
+    exact_count_limit = 10_000
+    estimated = False
+
+    @cached_property
+    def count(self):
+        counted = (
+            self.object_list.order_by()[:self.exact_count_limit + 1].count()
+        )
+        if counted <= self.exact_count_limit:
+            return counted
+        self.estimated = True
+        return max(estimate_count(self.object_list) or 0, counted)
+
+
+class KeysetChangeList(ChangeList):
+    """
+    A changelist that pages by primary key once the count is estimated.
+
+    Keyset pagination is used when the model admin's paginator reports an
+    estimated count and the rows are ordered by descending primary key,
+    the default for a model admin with ordering = ['-id']. Each page then
+    is one indexed query, WHERE pk < cursor ORDER BY pk DESC LIMIT n,
+    however deep it is, and links to the next page carry the cursor.
+    Sorting by a column falls back to numbered pages.
+
+    Attributes:
+        cursor (int): The pk after which the page starts, or None.
+        keyset (bool): Whether the page was read by keyset.
+        next_cursor (int): The cursor of the next page, or None.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        try:
+            cursor = request.GET.get(CURSOR_VAR)
+            self.cursor = int(cursor) if cursor else None
+        except ValueError:
+            raise IncorrectLookupParameters
+        self.keyset = False
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def get_results(self, request):
+        super().get_results(request)
+        descending_pk = {f'-{self.opts.pk.name}', '-pk'}
+        # the admin may repeat the pk to make the ordering deterministic
+        ordering = set(self.queryset.query.order_by)
+        self.keyset = (
+            getattr(self.paginator, 'estimated', False)
+            and not self.show_all
+            and ORDER_VAR not in self.params
+            and bool(ordering)
+            and ordering <= descending_pk
+        )
+        if not self.keyset:
+            return
+        queryset = self.queryset
+        if self.cursor is not None:
+            queryset = queryset.filter(pk__lt=self.cursor)
+        rows = list(queryset[:self.list_per_page + 1])
+        if len(rows) > self.list_per_page:
+            rows = rows[:self.list_per_page]
+            self.next_cursor = rows[-1].pk
+        self.result_list = rows
+
+    # the page number is not part of the query string of a changelist
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string({CURSOR_VAR: None})
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor})
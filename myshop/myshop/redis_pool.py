@@ -0,0 +1,45 @@
+import redis
+from django.conf import settings
+
+
+# one pool per process, Redis database and socket timeout
+_pools = {}
+
+
+def get_redis(host=None, port=None, db=None, socket_timeout=None):
+    """
+    Returns a Redis client backed by a shared, per-process connection pool.
+
+    The pool is configured by the REDIS_* settings, including socket and
+    connect timeouts, so a slow or unreachable Redis fails fast instead of
+    blocking the request.
+
+    Args:
+        host (str, optional): Redis host, defaults to REDIS_HOST.
+        port (int, optional): Redis port, defaults to REDIS_PORT.
+        db (int, optional): Redis database, defaults to REDIS_DB.
+        socket_timeout (float, optional): Seconds to wait for a reply,
+            defaults to REDIS_SOCKET_TIMEOUT. Clients with a different
+            timeout get a pool of their own.
+
+    Returns:
+        redis.Redis: A client using the shared pool.
+    """
+    key = (
+        host or settings.REDIS_HOST,
+        port or settings.REDIS_PORT,
+        settings.REDIS_DB if db is None else db,
+        socket_timeout or settings.REDIS_SOCKET_TIMEOUT,
+    )
+    if key not in _pools:
+        _pools[key] = redis.BlockingConnectionPool(
+            host=key[0],
+            port=key[1],
+            db=key[2],
+            max_connections=settings.REDIS_MAX_CONNECTIONS,
+            timeout=settings.REDIS_POOL_TIMEOUT,
+            socket_timeout=key[3],
+            socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+            health_check_interval=30,
+        )
+    return redis.Redis(connection_pool=_pools[key])
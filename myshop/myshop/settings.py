@@ -136,6 +136,15 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 
 CART_SESSION_ID = 'cart'
+# session key of the cart's item count and total, kept next to the cart
+CART_SUMMARY_SESSION_ID = 'cart_summary'
+# where cart items are kept: cart.storage.SessionCartStorage (the session)
+# or cart.storage.RedisCartStorage (one Redis hash per cart)
+CART_STORAGE = 'cart.storage.SessionCartStorage'
+# seconds an idle Redis cart is kept
+CART_REDIS_TTL = 60 * 60 * 24 * 14
+# session key of the Redis cart's ID, which survives a new session key
+CART_REDIS_SESSION_ID = 'cart_id'
 
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -149,6 +158,114 @@ STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET')
 REDIS_HOST = 'localhost'
 REDIS_PORT = 6379
 REDIS_DB = 1
+# connections per process in the shared pool
+REDIS_MAX_CONNECTIONS = 50
+# seconds to wait for a free connection from the pool
+REDIS_POOL_TIMEOUT = 0.2
+# seconds to wait for a reply / to establish a connection
+REDIS_SOCKET_TIMEOUT = 0.25
+REDIS_SOCKET_CONNECT_TIMEOUT = 0.25
+# seconds to wait for a reply to a batch of maintenance commands, as in
+# the bulk load and trimming of recommendations, off the request path
+REDIS_MAINTENANCE_SOCKET_TIMEOUT = 60
+
+# Recommender settings
+# storage of co-purchase scores, one of shop.recommender.backends:
+# redis.RedisRecommenderBackend, memory.MemoryRecommenderBackend
+# or sqlite.SQLiteRecommenderBackend
+RECOMMENDER_BACKEND = (
+    'shop.recommender.backends.redis.RedisRecommenderBackend'
+)
+# keyword arguments of the backend, e.g. {'NAME': ...} for SQLite
+RECOMMENDER_OPTIONS = {}
+# number of neighbours kept in the precomputed per-product list
+RECOMMENDER_TOP_N = 20
+# half-life of co-purchase scores in days, None disables decay
+RECOMMENDER_DECAY_HALF_LIFE = None
+# neighbours kept per product by the periodic trim, None disables the cap
+RECOMMENDER_MAX_NEIGHBOURS = 500
+# neighbours whose decayed score falls below this value are removed
+RECOMMENDER_MIN_SCORE = 0.05
+# consecutive failures that open the circuit breaker
+RECOMMENDER_BREAKER_THRESHOLD = 5
+# seconds the breaker stays open before a trial call
+RECOMMENDER_BREAKER_RESET_TIMEOUT = 30
+# seconds a last known suggestion list is kept as a fallback
+RECOMMENDER_FALLBACK_TIMEOUT = 60 * 60
+# seconds between runs of the trim task
+RECOMMENDER_TRIM_INTERVAL = 60 * 60
+# seconds between runs of the task that counts newly paid orders
+RECOMMENDER_INGEST_INTERVAL = 10
+# paid orders written to the backend in one batch by that task
+RECOMMENDER_INGEST_BATCH_SIZE = 500
+
+# Metrics settings
+# bearer token the Prometheus scraper sends to /metrics/, staff users
+# may read the metrics without it; empty allows staff users only
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Stock settings
+# seconds an unpaid order keeps its products reserved
+STOCK_RESERVATION_TIMEOUT = 30 * 60
+# seconds between runs of the task that releases expired reservations
+STOCK_RELEASE_INTERVAL = 60
+# expired orders released in one transaction by that task
+STOCK_RELEASE_BATCH_SIZE = 500
+
+# Orders export settings
+# seconds the progress of a background export is kept in Redis
+ORDERS_EXPORT_TTL = 60 * 60 * 24
+
+# Invoice settings
+# days a rendered invoice PDF is kept in media storage
+INVOICE_RETENTION_DAYS = 90
+# seconds between runs of the task that removes older invoices
+INVOICE_PURGE_INTERVAL = 60 * 60 * 24
+# processes rendering invoice PDFs for a web process, 0 renders in-process
+INVOICE_RENDER_WORKERS = 2
+# seconds to wait for a PDF from the render pool
+INVOICE_RENDER_TIMEOUT = 30
+
+# Outbox settings
+# messages sent to Celery in one transaction by the relay_outbox command
+OUTBOX_RELAY_BATCH_SIZE = 100
+# seconds the relay waits when no message is due
+OUTBOX_RELAY_INTERVAL = 1
+# seconds a relay has to send the messages it claimed, after which
+# another relay may send them again
+OUTBOX_CLAIM_TIMEOUT = 60
+# seconds before the first retry of a failed send, doubled for every retry
+OUTBOX_RETRY_DELAY = 5
+# longest delay between retries, in seconds
+OUTBOX_RETRY_MAX_DELAY = 10 * 60
+# days a sent message is kept, a repeated message is ignored meanwhile
+OUTBOX_RETENTION_DAYS = 7
+# seconds between runs of the task that removes older messages
+OUTBOX_PURGE_INTERVAL = 60 * 60 * 24
+
+# Celery settings
+CELERY_BEAT_SCHEDULE = {
+    'trim-recommendations': {
+        'task': 'shop.tasks.trim_recommendations',
+        'schedule': RECOMMENDER_TRIM_INTERVAL,
+    },
+    'ingest-purchases': {
+        'task': 'shop.tasks.ingest_purchases',
+        'schedule': RECOMMENDER_INGEST_INTERVAL,
+    },
+    'release-stock-reservations': {
+        'task': 'orders.tasks.release_stock_reservations',
+        'schedule': STOCK_RELEASE_INTERVAL,
+    },
+    'purge-invoices': {
+        'task': 'orders.tasks.purge_invoices',
+        'schedule': INVOICE_PURGE_INTERVAL,
+    },
+    'purge-outbox': {
+        'task': 'orders.tasks.purge_outbox',
+        'schedule': OUTBOX_PURGE_INTERVAL,
+    },
+}
 
 
 LOCALE_PATHS = [
@@ -5,6 +5,7 @@ from django.urls import path, include
 from django.conf.urls.i18n import i18n_patterns
 from django.utils.translation import gettext_lazy as _
 from payment import webhooks
+from shop import views as shop_views
 
 
 urlpatterns = i18n_patterns(
@@ -23,6 +24,7 @@ urlpatterns += [
         webhooks.stripe_webhook,
         name='stripe-webhook'
     ),
+    path('metrics/', shop_views.metrics, name='metrics'),
 ]
 
 if settings.DEBUG:
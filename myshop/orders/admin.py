@@ -1,10 +1,53 @@
 import csv
 import datetime
-from django.http import HttpResponse
+import functools
+import uuid
+import zipfile
+from django.http import StreamingHttpResponse
 from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.shortcuts import redirect
 from django.utils.safestring import mark_safe
-from django.urls import reverse
-from .models import Order, OrderItem
+from django.urls import get_script_prefix, reverse
+from django.utils import translation
+from django.utils.translation import get_language
+from myshop.pagination import EstimatedCountPaginator, KeysetChangeList
+from .exports import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, ExportProgress
+from .invoices import iter_invoices
+from .models import Order, OrderItem, OutboxMessage
+from .tasks import export_orders
+
+
+@functools.lru_cache
+def _order_url_template(name, language, script_prefix):
+    """
+    Reverses an order URL once and returns it with a {} placeholder for
+    the order ID.
+
+    The URLs are translated and prefixed, so one template is kept per
+    language and script prefix.
+    """
+    head, tail = reverse(name, args=[0]).rsplit('/0/', 1)
+    return f'{head}/{{}}/{tail}'
+
+
+def order_url(name, order_id):
+    """
+    Returns the URL of an order view without resolving it for every row.
+
+    Args:
+        name: The URL name, e.g. 'orders:admin_order_pdf'.
+        order_id: The order ID.
+
+    Returns:
+        The URL for the active language.
+    """
+    template = _order_url_template(
+        name, get_language(), get_script_prefix()
+    )
+    return template.format(order_id)
 
 
 def order_pdf(obj):
@@ -17,7 +60,7 @@ def order_pdf(obj):
     Returns:
         A HTML link to the admin_order_pdf view.
     """
-    url = reverse('orders:admin_order_pdf', args=[obj.id])
+    url = order_url('orders:admin_order_pdf', obj.id)
     return mark_safe(f'<a href="{url}">PDF Invoice</a>')
 
 
@@ -34,13 +77,32 @@ def order_detail(obj):
     Returns:
         A HTML link to the admin_order_detail view.
     """
-    url = reverse('orders:admin_order_detail', args=[obj.id])
+    url = order_url('orders:admin_order_detail', obj.id)
     return mark_safe(f'<a href="{url}">View Order Details</a>')
 
 
+# related fields exported by a column of the related model, joined in
+# the same query instead of loaded per row
+EXPORT_RELATED_COLUMNS = {'coupon': 'coupon__code'}
+
+
+class Echo:
+    """
+    A file-like object whose write() returns the value instead of storing it,
+    so csv.writer formats one row at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
 def export_to_csv(modeladmin, request, queryset):
     """
-    Exports the given orders to a CSV file.
+    Streams the given orders as a CSV file.
+
+    Rows are read as tuples in chunks of EXPORT_CHUNK_SIZE and written to
+    the response as they are formatted, so memory use doesn't grow with
+    the number of orders.
 
     Args:
         modeladmin: The admin interface for the Order model.
@@ -48,35 +110,156 @@ def export_to_csv(modeladmin, request, queryset):
         queryset: The list of order objects to export.
 
     Returns:
-        A HttpResponse object containing the exported CSV data.
+        A StreamingHttpResponse object producing the CSV data.
     """
     opts = modeladmin.model._meta
     content_disposition = (
         f'attachment; filename={opts.verbose_name}.csv'
     )
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = content_disposition
-    writer = csv.writer(response)
     fields = [
         field
         for field in opts.get_fields()
         if not field.many_to_many and not field.one_to_many
     ]
-    writer.writerow([field.verbose_name for field in fields])
-    for obj in queryset:
-        data_row = []
-        for field in fields:
-            value = getattr(obj, field.name)
-            if isinstance(value, datetime.datetime):
-                value = value.strftime('%d/%m/%Y')
-            data_row.append(value)
-        writer.writerow(data_row)
+    columns = [
+        EXPORT_RELATED_COLUMNS.get(field.name, field.attname)
+        for field in fields
+    ]
+    writer = csv.writer(Echo())
+
+    def rows():
+        yield writer.writerow([field.verbose_name for field in fields])
+        values = queryset.values_list(*columns).iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        )
+        for values_row in values:
+            yield writer.writerow(
+                [
+                    value.strftime('%d/%m/%Y')
+                    if isinstance(value, datetime.datetime)
+                    else value
+                    for value in values_row
+                ]
+            )
+
+    response = StreamingHttpResponse(rows(), content_type='text/csv')
+    response['Content-Disposition'] = content_disposition
     return response
 
 
 export_to_csv.short_description = 'Export to CSV'
 
 
+class ZipBuffer:
+    """
+    A file-like object that collects what zipfile writes until pop() is
+    called, so an archive is sent in pieces as its entries are added.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_invoices(modeladmin, request, queryset):
+    """
+    Streams the PDF invoices of the given orders as a ZIP archive.
+
+    The orders are read in chunks of EXPORT_CHUNK_SIZE with their
+    coupons, and the items and product names of a chunk with two more
+    queries, see orders.invoices.get_invoice_data. Missing invoices are
+    rendered in parallel in the render pool and stored, see
+    orders.invoices.iter_invoices. Each PDF is added to the archive and
+    sent as soon as it is ready, so only the PDFs being rendered are in
+    memory.
+
+    Args:
+        modeladmin: The admin interface for the Order model.
+        request: The HTTP request object.
+        queryset: The list of order objects to export.
+
+    Returns:
+        A StreamingHttpResponse object producing the ZIP archive.
+    """
+    orders = queryset.select_related('coupon').iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+    # the archive is written after the view returns
+    language = get_language()
+
+    def chunks():
+        buffer = ZipBuffer()
+        with translation.override(language):
+            # PDFs are compressed already, so entries are stored as is
+            with zipfile.ZipFile(buffer, 'w') as archive:
+                for invoice, pdf in iter_invoices(orders):
+                    archive.writestr(f'order_{invoice["id"]}.pdf', pdf)
+                    yield buffer.pop()
+        yield buffer.pop()
+
+    response = StreamingHttpResponse(
+        chunks(), content_type='application/zip'
+    )
+    response['Content-Disposition'] = 'attachment; filename=invoices.zip'
+    return response
+
+
+export_invoices.short_description = 'Download PDF invoices as ZIP'
+
+
+def export_in_background(export_format):
+    """
+    Creates an admin action that exports the selected orders with their
+    items in a Celery task instead of the request.
+
+    The action doesn't read the selected orders. It passes the IDs ticked
+    on the page, or the changelist filters when all matching orders were
+    selected, to orders.tasks.export_orders, see
+    orders.exports.get_selected_orders, and redirects to a page showing
+    the progress and, once finished, a download link.
+
+    Args:
+        export_format: A key of orders.exports.EXPORT_FORMATS.
+
+    Returns:
+        The admin action function.
+    """
+    def action(modeladmin, request, queryset):
+        if request.POST.get('select_across') == '1':
+            selection = {
+                'changelist': request.GET.urlencode(),
+                'user_id': request.user.id,
+            }
+        else:
+            selection = {
+                'ids': [
+                    int(pk)
+                    for pk in request.POST.getlist(ACTION_CHECKBOX_NAME)
+                ],
+            }
+        export_id = uuid.uuid4().hex
+        ExportProgress(export_id).start(export_format)
+        export_orders.delay(export_id, selection, export_format)
+        return redirect('orders:admin_order_export', export_id=export_id)
+
+    action.__name__ = f'export_{export_format}_in_background'
+    action.short_description = (
+        f'Export to {export_format.upper()} in background'
+    )
+    return action
+
+
 def order_payment(obj):
     """
     Generates a link to a Stripe payment page for the given order.
@@ -87,8 +270,8 @@ def order_payment(obj):
     Returns:
         A HTML link to the Stripe payment page.
     """
-    url = obj.get_stripe_url()
     if obj.stripe_id:
+        url = obj.get_stripe_url()
         html = f'<a href="{url}" target="_blank">{obj.stripe_id}</a>'
         return mark_safe(html)
     return ''
@@ -118,6 +301,7 @@ class OrderAdmin(admin.ModelAdmin):
         'address',
         'postal_code',
         'city',
+        'total',
         'paid',
         order_payment,
         'created',
@@ -126,5 +310,82 @@ class OrderAdmin(admin.ModelAdmin):
         order_pdf,
     ]
     list_filter = ['paid', 'created', 'updated']
+    # newest first by the primary key, which keyset pagination pages by
+    ordering = ['-id']
+    search_fields = ['id', 'email', 'first_name', 'last_name']
+    search_help_text = (
+        'Order ID, e-mail, or the beginning of the first or last name.'
+    )
+    # exact counts only up to a bound, no second count of all orders
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ['subtotal', 'discount_amount', 'total']
     inlines = [OrderItemInline]
-    actions = [export_to_csv]
+    actions = [export_to_csv, export_invoices] + [
+        export_in_background(export_format)
+        for export_format in EXPORT_FORMATS
+    ]
+
+    def get_changelist(self, request, **kwargs):
+        """
+        Pages long lists of orders by ID instead of by offset.
+        """
+        return KeysetChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Searches orders with lookups that the indexes on Order can serve.
+
+        A number is looked up as the order ID, a term with @ as the whole
+        e-mail, and other words as the beginning of the first or last
+        name, every word matching one of them. E-mails are compared
+        lowercased with the LOWER() expression index, names as prefixes
+        of the casefolded names stored on Order, so non-ASCII names match
+        on every database and no LIKE '%term%' scan is needed.
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(id=int(term)), False
+        if '@' in term:
+            return (
+                queryset.alias(email_lower=Lower('email'))
+                .filter(email_lower=term.lower()),
+                False,
+            )
+        for word in term.casefold().split():
+            queryset = queryset.filter(
+                Q(first_name_folded__startswith=word)
+                | Q(last_name_folded__startswith=word)
+            )
+        return queryset, False
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Saves the inline items, then recomputes the stored totals.
+        """
+        super().save_related(request, form, formsets, change)
+        form.instance.update_totals()
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    """
+    A read-only admin interface for the messages of the outbox, to watch
+    sends that keep failing.
+    """
+    list_display = [
+        'id', 'task', 'args', 'created', 'attempts', 'available', 'sent'
+    ]
+    list_filter = [('sent', admin.EmptyFieldListFilter)]
+    search_fields = ['key']
+    ordering = ['-id']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
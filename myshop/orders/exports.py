@@ -0,0 +1,344 @@
+"""
+Exports of orders with their items, written in the background.
+
+The admin passes the selection of orders to the Celery task as a small
+dict, see get_selected_orders(), so the web process neither reads the
+selected orders nor sends their IDs through the broker. The worker reads
+them in chunks of EXPORT_CHUNK_SIZE, three queries per chunk, and appends
+every chunk to a temporary file in one of EXPORT_FORMATS. The finished
+file is saved to the default storage under exports/orders/. Progress is
+kept in a Redis hash, so the admin can show it while a Celery worker does
+the work.
+"""
+import csv
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest, QueryDict
+from myshop.redis_pool import get_redis
+from shop.models import Product
+
+from .models import Order, OrderItem
+
+# rows fetched from the database at a time by the exports
+EXPORT_CHUNK_SIZE = 2000
+
+# order fields in the export, coupon is exported by its code
+ORDER_COLUMNS = [
+    'id',
+    'first_name',
+    'last_name',
+    'email',
+    'address',
+    'postal_code',
+    'city',
+    'created',
+    'updated',
+    'paid',
+    'stripe_id',
+    'coupon',
+    'discount',
+    'subtotal',
+    'discount_amount',
+    'total',
+]
+ITEM_COLUMNS = ['product_id', 'product', 'price', 'quantity']
+
+
+def get_selected_orders(selection):
+    """
+    Returns the orders an admin selected for an export.
+
+    The selection is either {'ids': [...]}, the orders ticked on one
+    changelist page, or {'changelist': query string, 'user_id': ID} when
+    all orders matching the changelist filters and search were selected.
+    The latter is resolved by the OrderAdmin changelist, as the admin saw
+    it.
+
+    Args:
+        selection (dict): The selection.
+
+    Returns:
+        QuerySet: The selected orders.
+    """
+    if 'ids' in selection:
+        return Order.objects.filter(id__in=selection['ids'])
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(selection['changelist'])
+    request.user = get_user_model().objects.get(id=selection['user_id'])
+    model_admin = admin.site.get_model_admin(Order)
+    changelist = model_admin.get_changelist_instance(request)
+    return changelist.get_queryset(request)
+
+
+def iter_orders(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the given orders with their items, one chunk at a time.
+
+    Orders are read by ID, each chunk after the last ID of the previous
+    one, so no chunk query reads the rows of the chunks before it.
+
+    Args:
+        orders (QuerySet): The orders.
+        chunk_size (int, optional): The number of orders in a chunk.
+
+    Yields:
+        list: Dicts with the ORDER_COLUMNS of every order of the chunk and
+            its 'items', a list of dicts with the ITEM_COLUMNS.
+    """
+    fields = [
+        'coupon__code' if column == 'coupon' else column
+        for column in ORDER_COLUMNS
+    ]
+    orders = orders.order_by('id')
+    last_id = 0
+    while True:
+        chunk = {
+            values[0]: dict(zip(ORDER_COLUMNS, values), items=[])
+            for values in orders.filter(id__gt=last_id)
+            .values_list(*fields)[:chunk_size]
+        }
+        if not chunk:
+            return
+        last_id = max(chunk)
+        items = list(
+            OrderItem.objects.filter(order_id__in=list(chunk))
+            .order_by('id')
+            .values_list('order_id', 'product_id', 'price', 'quantity')
+        )
+        names = dict(
+            Product.objects.filter(
+                id__in={item[1] for item in items},
+                translations__language_code=settings.LANGUAGE_CODE,
+            ).values_list('id', 'translations__name')
+        )
+        for order_id, product_id, price, quantity in items:
+            chunk[order_id]['items'].append(
+                {
+                    'product_id': product_id,
+                    'product': names.get(product_id, ''),
+                    'price': price,
+                    'quantity': quantity,
+                }
+            )
+        yield list(chunk.values())
+        if len(chunk) < chunk_size:
+            return
+
+
+class CsvExportWriter:
+    """
+    Writes one row per order item, the order columns repeated on each
+    row. Orders without items get one row with empty item columns.
+    """
+    extension = 'csv'
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(
+            ORDER_COLUMNS + [f'item_{column}' for column in ITEM_COLUMNS]
+        )
+
+    def write(self, orders):
+        for order in orders:
+            values = [
+                value.isoformat() if hasattr(value, 'isoformat') else value
+                for value in (order[column] for column in ORDER_COLUMNS)
+            ]
+            for item in order['items'] or [dict.fromkeys(ITEM_COLUMNS)]:
+                self.writer.writerow(
+                    values + [item[column] for column in ITEM_COLUMNS]
+                )
+
+    def close(self):
+        self.file.close()
+
+
+class JsonlExportWriter:
+    """
+    Writes one JSON object per line and order, with its items nested.
+    """
+    extension = 'jsonl'
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+
+    def write(self, orders):
+        for order in orders:
+            self.file.write(json.dumps(order, cls=DjangoJSONEncoder))
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """
+    Writes one Parquet row group per chunk, one row per order, with the
+    items in a nested list column.
+
+    pyarrow is imported here, so only the worker that writes the file
+    loads it.
+    """
+    extension = 'parquet'
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        money = pa.decimal128(10, 2)
+        timestamp = pa.timestamp('us', tz='UTC')
+        self.pa = pa
+        self.schema = pa.schema(
+            [
+                ('id', pa.int64()),
+                ('first_name', pa.string()),
+                ('last_name', pa.string()),
+                ('email', pa.string()),
+                ('address', pa.string()),
+                ('postal_code', pa.string()),
+                ('city', pa.string()),
+                ('created', timestamp),
+                ('updated', timestamp),
+                ('paid', pa.bool_()),
+                ('stripe_id', pa.string()),
+                ('coupon', pa.string()),
+                ('discount', pa.int32()),
+                ('subtotal', money),
+                ('discount_amount', money),
+                ('total', money),
+                (
+                    'items',
+                    pa.list_(
+                        pa.struct(
+                            [
+                                ('product_id', pa.int64()),
+                                ('product', pa.string()),
+                                ('price', money),
+                                ('quantity', pa.int64()),
+                            ]
+                        )
+                    ),
+                ),
+            ]
+        )
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, orders):
+        self.writer.write_table(
+            self.pa.Table.from_pylist(orders, schema=self.schema)
+        )
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_FORMATS = {
+    writer.extension: writer
+    for writer in [CsvExportWriter, JsonlExportWriter, ParquetExportWriter]
+}
+
+
+class ExportProgress:
+    """
+    The state of an export, kept in the Redis hash orders:export:<id>
+    for ORDERS_EXPORT_TTL seconds.
+
+    The hash holds the fields status (pending, running, done or failed),
+    format, total and done order counts, and name, the storage name of the
+    finished file, or error.
+
+    Attributes:
+        key (str): The Redis key of the export.
+        client (Redis): The pooled Redis client.
+    """
+
+    def __init__(self, export_id):
+        self.key = f'orders:export:{export_id}'
+        self.client = get_redis()
+
+    def _set(self, **fields):
+        pipe = self.client.pipeline()
+        pipe.hset(self.key, mapping=fields)
+        pipe.expire(self.key, settings.ORDERS_EXPORT_TTL)
+        pipe.execute()
+
+    def start(self, export_format):
+        self._set(status='pending', format=export_format, total=0, done=0)
+
+    def run(self, total):
+        self._set(status='running', total=total)
+
+    def advance(self, count):
+        self.client.hincrby(self.key, 'done', count)
+
+    def finish(self, name):
+        self._set(status='done', name=name)
+
+    def fail(self, error):
+        self._set(status='failed', error=error)
+
+    def get(self):
+        """
+        Returns the state of the export.
+
+        Returns:
+            dict: The fields of the hash, with total and done as ints, or
+                None if the export is unknown or expired.
+        """
+        state = {
+            field.decode(): value.decode()
+            for field, value in self.client.hgetall(self.key).items()
+        }
+        if not state:
+            return None
+        state['total'] = int(state['total'])
+        state['done'] = int(state['done'])
+        return state
+
+
+def write_export(export_id, orders, export_format, progress=None):
+    """
+    Writes an export of the given orders to the default storage.
+
+    The storage API has no appends, so the chunks are written to a
+    local temporary file, which is saved to the storage in one call once
+    complete. The worker needs disk space for the whole export.
+
+    Args:
+        export_id (str): The ID of the export, used in the file name.
+        orders (QuerySet): The orders, exported by ascending ID.
+        export_format (str): A key of EXPORT_FORMATS.
+        progress (ExportProgress, optional): Advanced after every chunk.
+
+    Returns:
+        str: The storage name of the file.
+    """
+    writer_class = EXPORT_FORMATS[export_format]
+    fd, path = tempfile.mkstemp(suffix=f'.{writer_class.extension}')
+    os.close(fd)
+    try:
+        writer = writer_class(path)
+        try:
+            for chunk in iter_orders(orders):
+                writer.write(chunk)
+                if progress:
+                    progress.advance(len(chunk))
+        finally:
+            writer.close()
+        with open(path, 'rb') as file:
+            return default_storage.save(
+                f'exports/orders/{export_id}.{writer_class.extension}',
+                File(file),
+            )
+    finally:
+        os.remove(path)
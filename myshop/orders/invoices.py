@@ -0,0 +1,314 @@
+"""
+Invoice PDFs, rendered once and kept in the default storage.
+
+A PDF is stored as invoices/<order id>/<language>/<digest>.pdf, where
+the digest is the SHA-256 of the invoice HTML and of the PDF
+stylesheet. The HTML is rendered by the invoice template in the active
+language from the data get_invoice_data() collects with a fixed number
+of queries, so any change of the order, its items, the template, the
+translations or the stylesheet gives a new name and the stale file of
+the order in that language is removed. Rendering the HTML is cheap;
+only a missing PDF runs WeasyPrint. iter_invoices() renders the
+invoices of many orders in parallel in the render pool. Stored invoices
+older than INVOICE_RETENTION_DAYS are removed by
+orders.tasks.purge_invoices, so a name returned by get_invoice() may be
+gone when it is opened; open_invoice() renders the PDF again then.
+"""
+import hashlib
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, wait
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.translation import get_language
+from parler.utils.i18n import get_active_language_choices
+
+from shop.models import Product
+
+from . import rendering
+from .exports import EXPORT_CHUNK_SIZE
+from .models import OrderItem
+
+INVOICE_TEMPLATE = 'orders/order/pdf.html'
+INVOICE_STYLESHEET = 'css/pdf.css'
+INVOICE_DIR = 'invoices'
+
+
+def get_invoice_data(orders):
+    """
+    Collects what the invoice templates show of the given orders.
+
+    The items of all orders are read with one query and the names of
+    their products in the active language, or the fallback language,
+    with another, whatever the number of orders and items. The coupons
+    are expected to be read with the orders.
+
+    Args:
+        orders (list): The orders, with select_related('coupon').
+
+    Returns:
+        list: A dict per order, in the same order, with the order's
+            fields, its totals, 'coupon' (a dict or None) and 'items',
+            a list of dicts with 'name', 'price', 'quantity' and 'cost'.
+    """
+    items = list(
+        OrderItem.objects.filter(order__in=orders)
+        .only('order_id', 'product_id', 'price', 'quantity')
+        .order_by('id')
+    )
+    languages = get_active_language_choices()
+    names = {}
+    translations = Product.objects.filter(
+        id__in={item.product_id for item in items},
+        translations__language_code__in=languages,
+    ).values_list('id', 'translations__language_code', 'translations__name')
+    for product_id, language, name in translations:
+        names.setdefault(product_id, {})[language] = name
+    order_items = {}
+    for item in items:
+        translated = names.get(item.product_id, {})
+        order_items.setdefault(item.order_id, []).append({
+            'name': next(
+                (translated[lang] for lang in languages if lang in translated),
+                '',
+            ),
+            'price': item.price,
+            'quantity': item.quantity,
+            'cost': item.get_cost(),
+        })
+    return [
+        {
+            'id': order.id,
+            'created': order.created,
+            'first_name': order.first_name,
+            'last_name': order.last_name,
+            'email': order.email,
+            'address': order.address,
+            'postal_code': order.postal_code,
+            'city': order.city,
+            'paid': order.paid,
+            'stripe_id': order.stripe_id,
+            'stripe_url': order.get_stripe_url(),
+            'items': order_items.get(order.id, []),
+            'coupon': {
+                'code': order.coupon.code,
+                'discount': order.discount,
+            } if order.coupon else None,
+            'subtotal': order.subtotal,
+            'discount_amount': order.discount_amount,
+            'total': order.total,
+        }
+        for order in orders
+    ]
+
+
+def render_invoice_html(invoice):
+    """
+    Renders the invoice template.
+
+    Args:
+        invoice (dict): The invoice data from get_invoice_data().
+
+    Returns:
+        str: The invoice HTML.
+    """
+    return render_to_string(INVOICE_TEMPLATE, {'order': invoice})
+
+
+def render_pdf(html):
+    """
+    Renders invoice HTML to PDF with WeasyPrint in the render pool, see
+    orders.rendering.
+
+    Args:
+        html (str): The invoice HTML.
+
+    Returns:
+        bytes: The PDF.
+    """
+    return rendering.render(html, finders.find(INVOICE_STYLESHEET))
+
+
+def get_invoice_name(invoice, html=None):
+    """
+    Returns the storage name of the invoice of an order in its current
+    state and in the active language.
+
+    Args:
+        invoice (dict): The invoice data from get_invoice_data().
+        html (str, optional): The invoice HTML, if already rendered.
+
+    Returns:
+        str: The name, whether or not the file exists.
+    """
+    if html is None:
+        html = render_invoice_html(invoice)
+    digest = hashlib.sha256(html.encode())
+    with open(finders.find(INVOICE_STYLESHEET), 'rb') as stylesheet:
+        digest.update(stylesheet.read())
+    language = get_language() or settings.LANGUAGE_CODE
+    return (
+        f'{INVOICE_DIR}/{invoice["id"]}/{language}/{digest.hexdigest()}.pdf'
+    )
+
+
+def store_invoice(invoice, name, pdf):
+    """
+    Stores a rendered invoice and removes the earlier versions of the
+    invoice of the order in the same language.
+
+    Args:
+        invoice (dict): The invoice data from get_invoice_data().
+        name (str): The name from get_invoice_name().
+        pdf (bytes): The PDF.
+    """
+    saved = default_storage.save(name, ContentFile(pdf))
+    if saved != name:
+        # another process stored the same invoice meanwhile
+        default_storage.delete(saved)
+    # earlier versions of the invoice are stale, the invoices in
+    # other languages are kept
+    directory = name.rsplit('/', 1)[0]
+    for file_name in default_storage.listdir(directory)[1]:
+        if f'{directory}/{file_name}' != name:
+            default_storage.delete(f'{directory}/{file_name}')
+
+
+def get_invoice(order):
+    """
+    Returns the stored invoice PDF of an order, rendering it if needed.
+
+    Args:
+        order (Order): The order.
+
+    Returns:
+        str: The storage name of the PDF.
+    """
+    invoice = get_invoice_data([order])[0]
+    html = render_invoice_html(invoice)
+    name = get_invoice_name(invoice, html)
+    if not default_storage.exists(name):
+        store_invoice(invoice, name, render_pdf(html))
+    return name
+
+
+def open_invoice(order):
+    """
+    Opens the stored invoice PDF of an order, rendering it if needed.
+
+    The file may be removed between get_invoice() and opening it, by a
+    newer version stored concurrently or by purge_invoices(). Then the
+    PDF is rendered again and returned without storing it.
+
+    Args:
+        order (Order): The order.
+
+    Returns:
+        File: The PDF, open for reading.
+    """
+    name = get_invoice(order)
+    try:
+        return default_storage.open(name)
+    except FileNotFoundError:
+        invoice = get_invoice_data([order])[0]
+        pdf = render_pdf(render_invoice_html(invoice))
+        return ContentFile(pdf, name=name.rsplit('/', 1)[-1])
+
+
+def iter_invoices(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the invoice PDFs of many orders, rendered in parallel.
+
+    The invoice data is collected for chunk_size orders at a time.
+    Stored invoices are read from the storage. The others are rendered
+    in the render pool, at most two per pool process at a time so that
+    few PDFs wait in memory, and stored. Every PDF is yielded as soon as
+    it is ready, so the order differs from that of orders.
+
+    Args:
+        orders (iterable): The orders, with select_related('coupon').
+        chunk_size (int, optional): The number of orders whose data is
+            collected at once.
+
+    Yields:
+        tuple: The invoice data of an order and its PDF as bytes.
+
+    Raises:
+        TimeoutError: No PDF was ready within INVOICE_RENDER_TIMEOUT.
+    """
+    path = finders.find(INVOICE_STYLESHEET)
+    limit = 2 * max(settings.INVOICE_RENDER_WORKERS, 1)
+    pending = {}
+
+    def finished(return_when):
+        done, _ = wait(
+            pending,
+            timeout=settings.INVOICE_RENDER_TIMEOUT,
+            return_when=return_when,
+        )
+        if not done:
+            raise TimeoutError('No invoice was rendered in time.')
+        for future in done:
+            invoice, name, html = pending.pop(future)
+            pdf = rendering.result(future, html, path)
+            store_invoice(invoice, name, pdf)
+            yield invoice, pdf
+
+    orders = iter(orders)
+    while chunk := list(islice(orders, chunk_size)):
+        for invoice in get_invoice_data(chunk):
+            html = render_invoice_html(invoice)
+            name = get_invoice_name(invoice, html)
+            if default_storage.exists(name):
+                try:
+                    with default_storage.open(name) as pdf:
+                        stored = pdf.read()
+                except FileNotFoundError:
+                    # removed meanwhile, rendered again below
+                    pass
+                else:
+                    yield invoice, stored
+                    continue
+            pending[rendering.submit(html, path)] = (invoice, name, html)
+            if len(pending) >= limit:
+                yield from finished(FIRST_COMPLETED)
+    while pending:
+        yield from finished(ALL_COMPLETED)
+
+
+def purge_invoices(retention_days=None):
+    """
+    Removes stored invoices rendered more than retention_days ago.
+
+    Args:
+        retention_days (int, optional): Defaults to INVOICE_RETENTION_DAYS.
+
+    Returns:
+        int: The number of removed files.
+    """
+    if retention_days is None:
+        retention_days = settings.INVOICE_RETENTION_DAYS
+    expired = timezone.now() - timedelta(days=retention_days)
+    removed = 0
+    if not default_storage.exists(INVOICE_DIR):
+        return removed
+    directories = [INVOICE_DIR]
+    # invoices/<order id>/<language>/, and files stored by order ID
+    # only before invoices were kept per language
+    while directories:
+        directory = directories.pop()
+        subdirectories, file_names = default_storage.listdir(directory)
+        directories.extend(
+            f'{directory}/{subdirectory}' for subdirectory in subdirectories
+        )
+        for file_name in file_names:
+            name = f'{directory}/{file_name}'
+            if default_storage.get_modified_time(name) < expired:
+                default_storage.delete(name)
+                removed += 1
+    return removed
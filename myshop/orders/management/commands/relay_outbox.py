@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from orders import outbox
+
+
+class Command(BaseCommand):
+    """
+    Sends the messages of the outbox to Celery, see orders.outbox.
+
+    Runs until stopped, waiting OUTBOX_RELAY_INTERVAL seconds whenever no
+    message is due. Several relays may run at once, each skips the
+    messages another one is sending.
+    """
+    help = 'Sends the Celery tasks written to the outbox to the broker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.OUTBOX_RELAY_BATCH_SIZE,
+            help='Number of messages claimed and sent at once.',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=settings.OUTBOX_RELAY_INTERVAL,
+            help='Seconds to wait when no message is due.',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Send the messages that are due and exit.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # the connection of a long-running process may go stale
+            close_old_connections()
+            sent = outbox.relay(options['batch_size'])
+            if sent:
+                self.stdout.write(f'Sent {sent} messages.')
+            if options['once']:
+                return
+            if not sent:
+                time.sleep(options['interval'])
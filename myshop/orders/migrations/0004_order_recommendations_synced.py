@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+def mark_paid_orders_synced(apps, schema_editor):
+    # orders paid so far were counted by the webhook synchronously
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(paid=True).update(recommendations_synced=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_coupon_order_discount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='recommendations_synced',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(
+            mark_paid_orders_synced, migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('paid', True), ('recommendations_synced', False)), fields=['id'], name='orders_unsynced_idx'),
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.0.7 on 2026-10-17 11:40
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+CENT = Decimal('0.01')
+
+
+def backfill_totals(apps, schema_editor):
+    # same arithmetic as Order.set_totals: integer cents, discount
+    # rounded half up to the cent
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    batch_size = 500
+    last_id = 0
+    while True:
+        orders = list(
+            Order.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .only('id', 'discount')[:batch_size]
+        )
+        if not orders:
+            break
+        subtotals = dict.fromkeys((order.id for order in orders), 0)
+        items = OrderItem.objects.filter(order__in=orders).values_list(
+            'order_id', 'price', 'quantity'
+        )
+        for order_id, price, quantity in items:
+            cents = int(price.quantize(CENT, rounding=ROUND_HALF_UP) * 100)
+            subtotals[order_id] += cents * quantity
+        for order in orders:
+            subtotal = subtotals[order.id]
+            discount = (
+                (subtotal * order.discount + 50) // 100
+                if order.discount else 0
+            )
+            order.subtotal = Decimal(subtotal).scaleb(-2)
+            order.discount_amount = Decimal(discount).scaleb(-2)
+            order.total = Decimal(subtotal - discount).scaleb(-2)
+        Order.objects.bulk_update(
+            orders, ['subtotal', 'discount_amount', 'total']
+        )
+        last_id = orders[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_recommendations_synced'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
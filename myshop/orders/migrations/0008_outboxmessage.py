@@ -0,0 +1,31 @@
+# Generated by Django 5.0.7 on 2026-10-17 18:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=250, unique=True)),
+                ('task', models.CharField(max_length=250)),
+                ('args', models.JSONField(default=list)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('available', models.DateTimeField(default=django.utils.timezone.now)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('sent__isnull', True)), fields=['available'], name='orders_outbox_pending_idx'), models.Index(fields=['sent'], name='orders_outbox_sent_idx')],
+            },
+        ),
+    ]
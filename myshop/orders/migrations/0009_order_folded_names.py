@@ -0,0 +1,58 @@
+# Generated by Django 5.0.7 on 2026-10-17 21:40
+
+from django.db import migrations, models
+
+
+def fold_names(apps, schema_editor):
+    Order = apps.get_model('orders', 'Order')
+    orders = Order.objects.only('first_name', 'last_name').order_by('id')
+    batch = []
+    for order in orders.iterator(chunk_size=2000):
+        order.first_name_folded = order.first_name.casefold()
+        order.last_name_folded = order.last_name.casefold()
+        batch.append(order)
+        if len(batch) == 2000:
+            Order.objects.bulk_update(
+                batch, ['first_name_folded', 'last_name_folded']
+            )
+            batch = []
+    Order.objects.bulk_update(
+        batch, ['first_name_folded', 'last_name_folded']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='first_name_folded',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='last_name_folded',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+        migrations.RunPython(fold_names, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='orders_first_name_lower_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='orders_last_name_lower_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['first_name_folded'], name='orders_first_name_folded_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['last_name_folded'], name='orders_last_name_folded_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
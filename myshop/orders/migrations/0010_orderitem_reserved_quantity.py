@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-17 22:10
+
+from django.db import migrations, models
+
+
+def set_reserved_quantity(apps, schema_editor):
+    # the reservations made before the field existed, assuming the
+    # tracking of their products has not changed since
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    OrderItem.objects.filter(
+        order__stock_reserved=True, product__stock__isnull=False
+    ).update(reserved_quantity=models.F('quantity'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_folded_names'),
+        ('shop', '0003_product_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_reserved_quantity, migrations.RunPython.noop),
+    ]
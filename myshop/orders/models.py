@@ -1,10 +1,11 @@
-from decimal import Decimal
-
 from coupons.models import Coupon
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from myshop.money import from_cents, percent_of, to_cents
 
 
 class Order(models.Model):
@@ -24,8 +25,23 @@ class Order(models.Model):
         stripe_id (str): The ID of the Stripe payment associated with this order, if any.
         coupon (Coupon): The coupon used for this order, if any.
         discount (int): The percentage discount applied to this order.
+        subtotal (Decimal): The total cost of the items before the discount, stored when the order is created.
+        discount_amount (Decimal): The discount applied to the subtotal.
+        total (Decimal): The subtotal minus the discount.
+        recommendations_synced (bool): Whether the order's products have been
+            counted by the recommender. Paid orders that are not synced yet
+            are the ingestion queue of shop.tasks.ingest_purchases.
+        stock_reserved (bool): Whether the order holds a reservation of product stock.
+        stock_released (bool): Whether the reservation was released because the order
+            was not paid in time, see orders.tasks.release_stock_reservations.
+        first_name_folded (str): The casefolded first name, for the admin search.
+        last_name_folded (str): The casefolded last name, for the admin search.
 
     Methods:
+        set_folded_names(): Sets first_name_folded and last_name_folded from the names.
+        set_totals(items=None): Computes and sets subtotal, discount_amount and total without saving.
+        update_totals(): Recomputes and saves the stored totals from the saved items.
+        get_stock_quantities(): Returns the quantity ordered of every product with stock tracking.
         get_total_cost_before_discount(): Returns the total cost of the items in this order before any discounts are applied.
         get_discount(): Returns the amount of the discount applied to this order.
         get_total_cost(): Returns the total cost of the items in this order, taking into account any discounts.
@@ -53,6 +69,23 @@ class Order(models.Model):
         default=0,
         validators=[MinValueValidator(0), MaxValueValidator(100)],
     )
+    subtotal = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0
+    )
+    discount_amount = models.DecimalField(
+        max_digits=10, decimal_places=2, default=0
+    )
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    recommendations_synced = models.BooleanField(default=False)
+    stock_reserved = models.BooleanField(default=False)
+    stock_released = models.BooleanField(default=False)
+    # casefolded in Python: SQLite's LOWER() only folds ASCII letters
+    first_name_folded = models.CharField(
+        max_length=50, blank=True, editable=False
+    )
+    last_name_folded = models.CharField(
+        max_length=50, blank=True, editable=False
+    )
 
     class Meta:
         """
@@ -66,44 +99,130 @@ class Order(models.Model):
         ordering = ['-created']
         indexes = [
             models.Index(fields=['-created']),
+            # small partial index over the ingestion queue
+            models.Index(
+                fields=['id'],
+                condition=models.Q(paid=True, recommendations_synced=False),
+                name='orders_unsynced_idx',
+            ),
+            # unpaid orders holding stock, scanned by creation time
+            models.Index(
+                fields=['created'],
+                condition=models.Q(paid=False, stock_reserved=True),
+                name='orders_reserved_idx',
+            ),
+            # admin search compares lowercased e-mails and looks up
+            # the beginning of casefolded names, the pattern operator
+            # class lets PostgreSQL use the index for LIKE 'word%' under
+            # any collation, other databases ignore it
+            models.Index(Lower('email'), name='orders_email_lower_idx'),
+            models.Index(
+                fields=['first_name_folded'],
+                name='orders_first_name_folded_idx',
+                opclasses=['varchar_pattern_ops'],
+            ),
+            models.Index(
+                fields=['last_name_folded'],
+                name='orders_last_name_folded_idx',
+                opclasses=['varchar_pattern_ops'],
+            ),
         ]
 
     def __str__(self):
         return f'Order {self.id}'
 
+    def save(self, *args, **kwargs):
+        self.set_folded_names()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {
+            'first_name', 'last_name'
+        } & set(update_fields):
+            kwargs['update_fields'] = {
+                *update_fields, 'first_name_folded', 'last_name_folded'
+            }
+        super().save(*args, **kwargs)
+
+    def set_folded_names(self):
+        """
+        Sets first_name_folded and last_name_folded from the names.
+
+        save() calls it, orders written with bulk_create() must call it
+        themselves.
+
+        """
+        self.first_name_folded = self.first_name.casefold()
+        self.last_name_folded = self.last_name.casefold()
+
+    def get_stock_quantities(self):
+        """
+        Returns the quantity ordered of every product with stock tracking.
+
+        Returns:
+            dict: {product id: quantity}
+
+        """
+        quantities = {}
+        items = self.items.filter(product__stock__isnull=False)
+        for product_id, quantity in items.values_list(
+            'product_id', 'quantity'
+        ):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+        return quantities
+
+    def set_totals(self, items=None):
+        """
+        Computes and sets subtotal, discount_amount and total without saving.
+
+        Args:
+            items (iterable, optional): The order's items, if already at hand.
+                Defaults to the items saved in the database.
+
+        """
+        if items is None:
+            items = self.items.all()
+        subtotal = sum(item.get_cost_cents() for item in items)
+        discount = percent_of(subtotal, self.discount) if self.discount else 0
+        self.subtotal = from_cents(subtotal)
+        self.discount_amount = from_cents(discount)
+        self.total = from_cents(subtotal - discount)
+
+    def update_totals(self):
+        """
+        Recomputes the stored totals from the saved items, e.g. after the items were edited.
+
+        """
+        self.set_totals()
+        self.save(update_fields=['subtotal', 'discount_amount', 'total'])
+
     def get_total_cost_before_discount(self):
         """
         Returns the total cost of the items in this order before any discounts are applied.
 
         Returns:
-            float: The total cost of the items in this order.
+            Decimal: The stored subtotal of this order.
 
         """
-        return sum(item.get_cost() for item in self.items.all())
+        return self.subtotal
 
     def get_discount(self):
         """
         Returns the amount of the discount applied to this order.
 
         Returns:
-            float: The amount of the discount applied to this order.
+            Decimal: The stored discount amount of this order.
 
         """
-        total_cost = self.get_total_cost_before_discount()
-        if self.discount:
-            return total_cost * (self.discount / Decimal(100))
-        return Decimal(0)
+        return self.discount_amount
 
     def get_total_cost(self):
         """
         Returns the total cost of the items in this order, taking into account any discounts.
 
         Returns:
-            float: The total cost of the items in this order.
+            Decimal: The stored total of this order.
 
         """
-        total_cost = self.get_total_cost_before_discount()
-        return total_cost - self.get_discount()
+        return self.total
 
     def get_stripe_url(self):
         """
@@ -133,9 +252,12 @@ class OrderItem(models.Model):
         order (Order): The order that this item is part of.
         product (Product): The product being ordered.
         quantity (int): The number of units of the product being ordered.
+        reserved_quantity (int): The units of product stock the item holds,
+            0 if the product had no stock tracking when it was reserved.
 
     Methods:
         get_cost(): Returns the cost of this item in the order.
+        get_cost_cents(): Returns the cost of this item in cents.
 
     """
     order = models.ForeignKey(
@@ -150,6 +272,8 @@ class OrderItem(models.Model):
     )
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
+    # what reserve_stock took, given back as is on release
+    reserved_quantity = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return str(self.id)
@@ -162,4 +286,64 @@ class OrderItem(models.Model):
             float: The cost of this item in the order.
 
         """
-        return self.price * self.quantity
+        return from_cents(self.get_cost_cents())
+
+    def get_cost_cents(self):
+        """
+        Returns the cost of this item in the order in cents.
+
+        Returns:
+            int: The cost of this item in cents.
+
+        """
+        return to_cents(self.price) * self.quantity
+
+
+class OutboxMessage(models.Model):
+    """
+    A Celery task to send once the transaction that created it commits.
+
+    Messages are written by orders.outbox.enqueue() in the transaction of
+    the change they announce and sent by the relay_outbox command.
+
+    Attributes:
+        key (str): Identifies the message; a second message with the same key
+            is not stored. Also the Celery task ID.
+        task (str): The name of the Celery task.
+        args (list): The positional arguments of the task.
+        created (datetime): When the message was written.
+        available (datetime): When the relay may try to send it next.
+        attempts (int): The number of failed sends.
+        last_error (str): The error of the last failed send.
+        sent (datetime): When the message was sent, or None.
+
+    """
+    key = models.CharField(max_length=250, unique=True)
+    task = models.CharField(max_length=250)
+    args = models.JSONField(default=list)
+    created = models.DateTimeField(auto_now_add=True)
+    available = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        """
+        Metadata for the OutboxMessage model.
+
+        Attributes:
+            indexes: Indexes used to improve query performance.
+
+        """
+        indexes = [
+            # small partial index over the messages waiting for the relay
+            models.Index(
+                fields=['available'],
+                condition=models.Q(sent__isnull=True),
+                name='orders_outbox_pending_idx',
+            ),
+            models.Index(fields=['sent'], name='orders_outbox_sent_idx'),
+        ]
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,166 @@
+"""
+A transactional outbox for the Celery tasks announcing order changes.
+
+A task queued with .delay() inside a transaction may run before the
+transaction commits and not find the order, and a slow broker holds up
+the request. enqueue() instead writes an OutboxMessage in the same
+transaction as the change, so the message exists if and only if the
+change was committed. The relay_outbox command sends the messages to
+Celery in batches, in the order they were written, and retries failed
+sends with an exponential backoff.
+
+Messages are sent at least once. A relay claims a batch in a short
+transaction by moving it OUTBOX_CLAIM_TIMEOUT seconds into the future,
+so concurrent relays skip it, sends it to the broker outside any
+transaction, and marks the messages sent in a second short transaction.
+A slow broker holds no row locks. A message is sent again only if the
+relay dies or stalls past the claim before marking it. The Celery task
+ID is the message key, so such a duplicate can be recognized. Sent
+messages are kept OUTBOX_RETENTION_DAYS, during
+which a message with the same key is not stored again, e.g. when Stripe
+repeats a webhook.
+"""
+import logging
+from datetime import timedelta
+
+from celery import current_app
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(task, *args, key=None):
+    """
+    Writes a message to run a Celery task once the current transaction
+    commits.
+
+    Args:
+        task (Task): The Celery task.
+        *args: Its positional arguments, serializable to JSON.
+        key (str, optional): Identifies the message, defaults to the task
+            name and the arguments. If a message with this key is stored
+            already, nothing is written.
+    """
+    if key is None:
+        key = ':'.join([task.name, *map(str, args)])
+    OutboxMessage.objects.bulk_create(
+        [OutboxMessage(key=key, task=task.name, args=list(args))],
+        ignore_conflicts=True,
+    )
+
+
+def get_retry_delay(attempts):
+    """
+    Returns the delay before the next send of a message.
+
+    Args:
+        attempts (int): The number of failed sends.
+
+    Returns:
+        timedelta: OUTBOX_RETRY_DELAY doubled for every further attempt,
+            at most OUTBOX_RETRY_MAX_DELAY.
+    """
+    return timedelta(seconds=min(
+        settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1),
+        settings.OUTBOX_RETRY_MAX_DELAY,
+    ))
+
+
+def claim(batch_size):
+    """
+    Claims the next messages that are due for this relay.
+
+    The messages are locked only while their next attempt is moved
+    OUTBOX_CLAIM_TIMEOUT seconds ahead, then the transaction commits.
+
+    Args:
+        batch_size (int): The number of messages to claim.
+
+    Returns:
+        list: The claimed messages, oldest first.
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(sent__isnull=True, available__lte=now)
+            .order_by('id')[:batch_size]
+        )
+        OutboxMessage.objects.filter(
+            id__in=[message.id for message in messages]
+        ).update(
+            available=now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+        )
+    return messages
+
+
+def relay(batch_size=None):
+    """
+    Sends the messages that are due to Celery.
+
+    Messages are taken in batches of OUTBOX_RELAY_BATCH_SIZE. A batch is
+    claimed, sent with no transaction open and then updated in one short
+    transaction. The relay stops early when no message of a batch could
+    be sent, as when the broker is down.
+
+    Args:
+        batch_size (int, optional): The number of messages in one batch.
+
+    Returns:
+        int: The number of sent messages.
+    """
+    batch_size = batch_size or settings.OUTBOX_RELAY_BATCH_SIZE
+    sent = 0
+    while True:
+        batch_sent = 0
+        messages = claim(batch_size)
+        if not messages:
+            return sent
+        for message in messages:
+            try:
+                current_app.send_task(
+                    message.task, args=message.args, task_id=message.key
+                )
+            except Exception as e:
+                message.attempts += 1
+                message.last_error = repr(e)
+                message.available = timezone.now() + get_retry_delay(
+                    message.attempts
+                )
+                logger.warning(
+                    'Outbox message %s not sent, attempt %s: %r',
+                    message.key,
+                    message.attempts,
+                    e,
+                )
+            else:
+                message.sent = timezone.now()
+                batch_sent += 1
+        with transaction.atomic():
+            OutboxMessage.objects.bulk_update(
+                messages, ['sent', 'attempts', 'last_error', 'available']
+            )
+        sent += batch_sent
+        if len(messages) < batch_size or not batch_sent:
+            return sent
+
+
+def purge(retention_days=None):
+    """
+    Removes messages sent more than retention_days ago.
+
+    Args:
+        retention_days (int, optional): Defaults to OUTBOX_RETENTION_DAYS.
+
+    Returns:
+        int: The number of removed messages.
+    """
+    if retention_days is None:
+        retention_days = settings.OUTBOX_RETENTION_DAYS
+    expired = timezone.now() - timedelta(days=retention_days)
+    removed, _ = OutboxMessage.objects.filter(sent__lt=expired).delete()
+    return removed
@@ -0,0 +1,181 @@
+"""
+A pool of long-lived processes that render invoice PDFs.
+
+WeasyPrint parses the stylesheet and loads fonts on first use, and a
+render keeps a CPU busy for its whole duration. Each pool process parses
+the stylesheet and loads its fonts once, when it starts, and then takes
+render jobs until the pool shuts down, so a web process only renders
+the template and waits for the PDF.
+
+The pool is started on the first render in a process and holds
+INVOICE_RENDER_WORKERS processes. Daemonic processes, such as Celery's
+prefork workers, cannot start children; they render in-process with the
+same parsed stylesheet, kept for the life of the process. Setting
+INVOICE_RENDER_WORKERS to 0 renders in-process everywhere.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import weasyprint
+from django.conf import settings
+from weasyprint.text.fonts import FontConfiguration
+
+# the parsed stylesheet of this process:
+# (path, modification time, stylesheets, font configuration)
+_stylesheet = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def load_stylesheet(path):
+    """
+    Parses the stylesheet and loads its fonts, once per process and
+    modification of the file.
+
+    Args:
+        path (str): The path of the stylesheet.
+
+    Returns:
+        tuple: The stylesheets and the font configuration to render with.
+    """
+    global _stylesheet
+    mtime = os.path.getmtime(path)
+    if _stylesheet is None or _stylesheet[:2] != (path, mtime):
+        font_config = FontConfiguration()
+        stylesheets = [
+            weasyprint.CSS(filename=path, font_config=font_config)
+        ]
+        # a first render loads the fonts the stylesheet uses
+        weasyprint.HTML(string='<p>0</p>').write_pdf(
+            stylesheets=stylesheets, font_config=font_config
+        )
+        _stylesheet = (path, mtime, stylesheets, font_config)
+    return _stylesheet[2:]
+
+
+def render_with_stylesheet(html, path):
+    """
+    Renders HTML to PDF with the parsed stylesheet of this process.
+
+    Args:
+        html (str): The HTML.
+        path (str): The path of the stylesheet.
+
+    Returns:
+        bytes: The PDF.
+    """
+    stylesheets, font_config = load_stylesheet(path)
+    return weasyprint.HTML(string=html).write_pdf(
+        stylesheets=stylesheets, font_config=font_config
+    )
+
+
+def get_pool(path):
+    """
+    Returns the render pool of this process, starting it if needed.
+
+    The processes are spawned rather than forked, so they don't inherit
+    the caller's threads and database connections, and each loads the
+    stylesheet as it starts.
+
+    Args:
+        path (str): The path of the stylesheet.
+
+    Returns:
+        ProcessPoolExecutor: The pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.INVOICE_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=load_stylesheet,
+                initargs=(path,),
+            )
+        return _pool
+
+
+def shutdown_pool():
+    """
+    Stops the render pool of this process, if it was started.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def submit(html, path):
+    """
+    Starts rendering HTML to PDF in the pool, or renders it in-process
+    where there is none.
+
+    Args:
+        html (str): The HTML.
+        path (str): The path of the stylesheet.
+
+    Returns:
+        Future: The future PDF, already done if rendered in-process.
+    """
+    if (
+        settings.INVOICE_RENDER_WORKERS
+        and not multiprocessing.current_process().daemon
+    ):
+        try:
+            return get_pool(path).submit(render_with_stylesheet, html, path)
+        except BrokenProcessPool:
+            shutdown_pool()
+    future = Future()
+    try:
+        future.set_result(render_with_stylesheet(html, path))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def result(future, html, path):
+    """
+    Waits for a PDF started by submit().
+
+    A pool broken by a crashed process is replaced on the next render;
+    the PDF is rendered in-process instead.
+
+    Args:
+        future (Future): The future returned by submit().
+        html (str): The HTML it renders.
+        path (str): The path of the stylesheet.
+
+    Returns:
+        bytes: The PDF.
+
+    Raises:
+        TimeoutError: The pool took longer than INVOICE_RENDER_TIMEOUT.
+    """
+    try:
+        return future.result(timeout=settings.INVOICE_RENDER_TIMEOUT)
+    except BrokenProcessPool:
+        shutdown_pool()
+    return render_with_stylesheet(html, path)
+
+
+def render(html, path):
+    """
+    Renders HTML to PDF in the pool, or in-process where there is none.
+
+    Args:
+        html (str): The HTML.
+        path (str): The path of the stylesheet.
+
+    Returns:
+        bytes: The PDF.
+
+    Raises:
+        TimeoutError: The pool took longer than INVOICE_RENDER_TIMEOUT.
+    """
+    return result(submit(html, path), html, path)
@@ -1,7 +1,16 @@
+from datetime import timedelta
+
 from celery import shared_task
+from django.conf import settings
 from django.core.mail import send_mail
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
 
-from .models import Order
+from shop.inventory import release_stock
+from . import invoices, outbox
+from .exports import ExportProgress, get_selected_orders, write_export
+from .models import Order, OrderItem
 
 
 @shared_task
@@ -21,3 +30,98 @@ def order_created(order_id):
         subject, message, 'admin@myshop.com', [order.email]
     )
     return mail_sent
+
+
+@shared_task
+def release_stock_reservations(batch_size=None):
+    """
+    Periodic task that returns the stock reserved by unpaid orders
+    older than STOCK_RESERVATION_TIMEOUT.
+
+    Orders are taken in batches of STOCK_RELEASE_BATCH_SIZE. The reserved
+    quantities of a whole batch are summed per product and given back
+    with one UPDATE, then the orders are marked released and can no
+    longer be paid. Orders locked by the Stripe webhook are skipped and
+    picked up by the next run if they are still unpaid.
+
+    Args:
+        batch_size (int, optional): The number of orders in one batch.
+
+    Returns:
+        int: The number of released orders.
+    """
+    batch_size = batch_size or settings.STOCK_RELEASE_BATCH_SIZE
+    expired = timezone.now() - timedelta(
+        seconds=settings.STOCK_RESERVATION_TIMEOUT
+    )
+    released = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(paid=False, stock_reserved=True, created__lt=expired)
+                .order_by('created')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return released
+            # only what was reserved, not what is tracked now
+            items = OrderItem.objects.filter(
+                order_id__in=order_ids, reserved_quantity__gt=0
+            )
+            quantities = dict(
+                items.values_list('product_id')
+                .annotate(Sum('reserved_quantity'))
+                .order_by()
+            )
+            release_stock(quantities)
+            items.update(reserved_quantity=0)
+            Order.objects.filter(id__in=order_ids).update(
+                stock_reserved=False, stock_released=True
+            )
+        released += len(order_ids)
+
+
+@shared_task
+def export_orders(export_id, selection, export_format):
+    """
+    Task to write an export of orders with their items to the default
+    storage, recording its progress in Redis.
+
+    Args:
+        export_id (str): The ID of the export.
+        selection (dict): The orders to export, see
+            orders.exports.get_selected_orders.
+        export_format (str): A key of orders.exports.EXPORT_FORMATS.
+
+    Returns:
+        str: The storage name of the file.
+    """
+    progress = ExportProgress(export_id)
+    try:
+        orders = get_selected_orders(selection)
+        progress.run(orders.count())
+        name = write_export(export_id, orders, export_format, progress)
+    except Exception as e:
+        progress.fail(str(e))
+        raise
+    progress.finish(name)
+    return name
+
+
+@shared_task
+def purge_invoices():
+    """
+    Periodic task that removes stored invoice PDFs older than
+    INVOICE_RETENTION_DAYS. They are rendered again when requested.
+    """
+    return invoices.purge_invoices()
+
+
+@shared_task
+def purge_outbox():
+    """
+    Periodic task that removes outbox messages sent more than
+    OUTBOX_RETENTION_DAYS ago.
+    """
+    return outbox.purge()
@@ -1,3 +1,1182 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import zipfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from concurrent.futures.process import BrokenProcessPool
+
+import pyarrow.parquet as pq
+import redis
+from coupons.models import Coupon
+from django.conf import settings
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core import mail
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.db import connection, connections, transaction
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone, translation
+from myshop.money import from_cents, percent_of, to_cents
+from shop.inventory import OutOfStockError, release_stock, reserve_stock
+from shop.models import Category, Product
+
+from myshop.pagination import EstimatedCountPaginator
+from payment.tasks import payment_completed
+
+from . import outbox, rendering
+from .admin import OrderAdmin, export_to_csv, order_url
+from .exports import (
+    ExportProgress,
+    get_selected_orders,
+    iter_orders,
+    write_export,
+)
+from .invoices import (
+    get_invoice,
+    get_invoice_data,
+    open_invoice,
+    purge_invoices,
+)
+from .models import Order, OrderItem, OutboxMessage
+from .tasks import (
+    export_orders,
+    order_created,
+    release_stock_reservations,
+)
+
+
+class MoneyTests(SimpleTestCase):
+
+    def test_to_cents(self):
+        self.assertEqual(to_cents(Decimal('12.50')), 1250)
+        self.assertEqual(to_cents('0.10'), 10)
+        self.assertEqual(to_cents('1.005'), 101)
+        # ints are already cents
+        self.assertEqual(to_cents(1250), 1250)
+
+    def test_from_cents(self):
+        self.assertEqual(from_cents(1250), Decimal('12.50'))
+        self.assertEqual(str(from_cents(5)), '0.05')
+
+    def test_percent_of_rounds_half_up(self):
+        self.assertEqual(percent_of(1235, 10), 124)
+        self.assertEqual(percent_of(1000, 15), 150)
+
+
+class OrderCostTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        product = Product.objects.create(
+            category=category, name='Tea', slug='tea', price=Decimal('4.15')
+        )
+        self.order = Order.objects.create(
+            first_name='Ivan',
+            last_name='Ivanov',
+            email='ivan@example.com',
+            address='Lenina 1',
+            postal_code='101000',
+            city='Moscow',
+            discount=10,
+        )
+        OrderItem.objects.create(
+            order=self.order, product=product, price=product.price, quantity=3
+        )
+        self.order.update_totals()
+
+    def test_costs_are_rounded_to_cents(self):
+        self.assertEqual(
+            self.order.get_total_cost_before_discount(), Decimal('12.45')
+        )
+        # 10% of 12.45 is 1.245, rounded half up
+        self.assertEqual(self.order.get_discount(), Decimal('1.25'))
+        self.assertEqual(self.order.get_total_cost(), Decimal('11.20'))
+
+    def test_totals_are_read_without_item_queries(self):
+        order = Order.objects.get(id=self.order.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(order.get_total_cost(), Decimal('11.20'))
+            self.assertEqual(order.get_discount(), Decimal('1.25'))
+
+
+class ExportToCsvTests(TestCase):
+
+    def setUp(self):
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code='SUMMER',
+            valid_from=now,
+            valid_to=now,
+            discount=10,
+            active=True,
+        )
+        for i in range(3):
+            Order.objects.create(
+                first_name=f'Ivan {i}',
+                last_name='Ivanov',
+                email='ivan@example.com',
+                address='Lenina 1',
+                postal_code='101000',
+                city='Moscow',
+                coupon=coupon if i == 1 else None,
+                discount=10 if i == 1 else 0,
+            )
+
+    def test_streams_the_same_rows_with_one_query(self):
+        queryset = Order.objects.order_by('id')
+        response = export_to_csv(OrderAdmin(Order, site), None, queryset)
+        self.assertTrue(response.streaming)
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content).decode()
+        fields = [
+            field for field in Order._meta.get_fields()
+            if not field.many_to_many and not field.one_to_many
+        ]
+        expected = [[str(field.verbose_name) for field in fields]]
+        for order in queryset:
+            row = []
+            for field in fields:
+                value = getattr(order, field.name)
+                if isinstance(value, datetime):
+                    value = value.strftime('%d/%m/%Y')
+                row.append('' if value is None else str(value))
+            expected.append(row)
+        self.assertEqual(list(csv.reader(io.StringIO(content))), expected)
+        self.assertIn('SUMMER', content)
+
+
+class BackgroundExportTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        now = timezone.now()
+        coupon = Coupon.objects.create(
+            code='SUMMER',
+            valid_from=now,
+            valid_to=now,
+            discount=10,
+            active=True,
+        )
+        category = Category.objects.create(name='Tea', slug='tea')
+        products = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('2.50'),
+            )
+            for i in range(2)
+        ]
+        self.orders = []
+        for i in range(3):
+            order = Order.objects.create(
+                first_name=f'Ivan {i}',
+                last_name='Ivanov',
+                email='ivan@example.com',
+                address='Lenina 1',
+                postal_code='101000',
+                city='Moscow',
+                coupon=coupon if i == 0 else None,
+            )
+            # the last order has no items
+            for product in products[:2 - i]:
+                OrderItem.objects.create(
+                    order=order,
+                    product=product,
+                    price=product.price,
+                    quantity=2,
+                )
+            order.update_totals()
+            self.orders.append(order)
+        self.order_ids = [order.id for order in self.orders]
+
+    def read(self, name):
+        with default_storage.open(name) as file:
+            return file.read().decode()
+
+    def test_csv_has_a_row_per_item(self):
+        with self.assertNumQueries(3):
+            name = write_export('test', Order.objects.all(), 'csv')
+        self.assertEqual(name, 'exports/orders/test.csv')
+        rows = list(csv.DictReader(io.StringIO(self.read(name))))
+        self.assertEqual(
+            [(row['id'], row['item_product']) for row in rows],
+            [
+                (str(self.order_ids[0]), 'Tea 0'),
+                (str(self.order_ids[0]), 'Tea 1'),
+                (str(self.order_ids[1]), 'Tea 0'),
+                (str(self.order_ids[2]), ''),
+            ],
+        )
+        self.assertEqual(rows[0]['coupon'], 'SUMMER')
+        self.assertEqual(rows[0]['total'], '10.00')
+
+    def test_jsonl_has_a_line_per_order(self):
+        name = write_export('test', Order.objects.all(), 'jsonl')
+        orders = [json.loads(line) for line in self.read(name).splitlines()]
+        self.assertEqual([order['id'] for order in orders], self.order_ids)
+        self.assertEqual(
+            orders[0]['items'][1],
+            {
+                'product_id': self.orders[0].items.all()[1].product_id,
+                'product': 'Tea 1',
+                'price': '2.50',
+                'quantity': 2,
+            },
+        )
+        self.assertEqual(orders[2]['items'], [])
+
+    def test_parquet_nests_items(self):
+        name = write_export('test', Order.objects.all(), 'parquet')
+        table = pq.read_table(default_storage.path(name))
+        self.assertEqual(table.column('id').to_pylist(), self.order_ids)
+        self.assertEqual(
+            [len(items) for items in table.column('items').to_pylist()],
+            [2, 1, 0],
+        )
+        self.assertEqual(table.column('total').to_pylist()[0], Decimal('10.00'))
+
+    def test_orders_are_read_in_chunks_by_id(self):
+        # orders, items and product names per chunk, the last chunk has
+        # no items and so no names to read
+        with self.assertNumQueries(5):
+            chunks = list(iter_orders(Order.objects.all(), chunk_size=2))
+        self.assertEqual(
+            [[order['id'] for order in chunk] for chunk in chunks],
+            [self.order_ids[:2], self.order_ids[2:]],
+        )
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_selecting_all_passes_the_changelist_filters(self):
+        Order.objects.filter(id=self.order_ids[1]).update(paid=True)
+        user = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'x'
+        )
+        self.client.force_login(user)
+        with mock.patch.object(
+            export_orders, 'delay'
+        ) as delay, mock.patch.object(ExportProgress, 'start'):
+            self.client.post(
+                reverse('admin:orders_order_changelist') + '?paid__exact=1',
+                {
+                    'action': 'export_csv_in_background',
+                    'select_across': '1',
+                    '_selected_action': self.order_ids[1:2],
+                },
+            )
+        selection = delay.call_args.args[1]
+        self.assertEqual(
+            selection, {'changelist': 'paid__exact=1', 'user_id': user.id}
+        )
+        self.assertEqual(
+            list(
+                get_selected_orders(selection).values_list('id', flat=True)
+            ),
+            self.order_ids[1:2],
+        )
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_admin_action_enqueues_export_and_links_the_file(self):
+        try:
+            client = ExportProgress('test').client
+            client.ping()
+        except redis.ConnectionError:
+            self.skipTest(
+                f'Redis is not available at '
+                f'{settings.REDIS_HOST}:{settings.REDIS_PORT}'
+            )
+        self.client.force_login(
+            User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        )
+        with mock.patch.object(export_orders, 'delay') as delay:
+            response = self.client.post(
+                reverse('admin:orders_order_changelist'),
+                {
+                    'action': 'export_jsonl_in_background',
+                    '_selected_action': self.order_ids,
+                },
+            )
+        export_id, selection, export_format = delay.call_args.args
+        self.addCleanup(client.delete, ExportProgress(export_id).key)
+        self.assertEqual(
+            (selection, export_format), ({'ids': self.order_ids}, 'jsonl')
+        )
+        status_url = reverse('orders:admin_order_export', args=[export_id])
+        self.assertRedirects(response, status_url)
+        response = self.client.get(status_url)
+        self.assertEqual(response.context['export']['status'], 'pending')
+        self.assertNotContains(response, 'Download')
+
+        export_orders(export_id, selection, export_format)
+        response = self.client.get(status_url)
+        self.assertEqual(response.context['percent'], 100)
+        download_url = reverse(
+            'orders:admin_order_export_download', args=[export_id]
+        )
+        self.assertContains(response, download_url)
+        response = self.client.get(download_url)
+        self.assertEqual(
+            len(b''.join(response.streaming_content).splitlines()), 3
+        )
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class OrderChangelistTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        )
+        self.url = reverse('admin:orders_order_changelist')
+
+    def create_orders(self, names):
+        orders = [
+            Order(
+                first_name=first_name,
+                last_name=last_name,
+                email=f'{first_name}.{last_name}@Example.com',
+                address='Lenina 1',
+                postal_code='101000',
+                city='Moscow',
+            )
+            for first_name, last_name in names
+        ]
+        for order in orders:
+            order.set_folded_names()
+        Order.objects.bulk_create(orders)
+        return list(Order.objects.order_by('-id').values_list('id', flat=True))
+
+    def get_ids(self, response):
+        return [order.id for order in response.context['cl'].result_list]
+
+    def test_queries_do_not_grow_with_rows(self):
+        self.create_orders([('Ivan', 'Ivanov')] * 3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        self.create_orders([('Ivan', 'Ivanov')] * 30)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertEqual(len(many), len(few))
+        self.assertFalse(response.context['cl'].keyset)
+        self.assertContains(
+            response, reverse('orders:admin_order_pdf', args=[1])
+        )
+
+    def test_order_url_matches_reverse(self):
+        for name in ['orders:admin_order_detail', 'orders:admin_order_pdf']:
+            self.assertEqual(
+                order_url(name, 1234), reverse(name, args=[1234])
+            )
+
+    def test_long_lists_are_paged_by_keyset(self):
+        ids = self.create_orders([('Ivan', 'Ivanov')] * 5)
+        with mock.patch.object(
+            EstimatedCountPaginator, 'exact_count_limit', 3
+        ), mock.patch.object(OrderAdmin, 'list_per_page', 2):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(self.url)
+            cl = response.context['cl']
+            self.assertTrue(cl.keyset)
+            self.assertEqual(self.get_ids(response), ids[:2])
+            self.assertContains(response, 'Next page')
+            response = self.client.get(self.url + cl.next_page_url)
+            self.assertEqual(self.get_ids(response), ids[2:4])
+            # filters are kept across pages
+            response = self.client.get(
+                self.url + cl.next_page_url + '&paid__exact=0'
+            )
+            self.assertIn(
+                'paid__exact=0', response.context['cl'].next_page_url
+            )
+            response = self.client.get(
+                self.url + response.context['cl'].next_page_url
+            )
+            self.assertEqual(self.get_ids(response), ids[4:])
+            self.assertNotContains(response, 'Next page')
+            # sorting by a column falls back to numbered pages
+            response = self.client.get(self.url, {'o': '2'})
+            self.assertFalse(response.context['cl'].keyset)
+        self.assertFalse(
+            any('OFFSET' in query['sql'] for query in context.captured_queries)
+        )
+
+    def test_search(self):
+        ids = self.create_orders(
+            [('Ivan', 'Ivanov'), ('Petr', 'Ivanenko'), ('Anna', 'Petrova')]
+        )
+        anna, petr, ivan = ids
+        for term, expected in [
+            (str(petr), [petr]),
+            ('ivan.IVANOV@example.com', [ivan]),
+            ('ivan', [petr, ivan]),
+            ('PETR', [anna, petr]),
+            ('petr ivan', [petr]),
+            ('van', []),
+        ]:
+            with self.subTest(term=term):
+                response = self.client.get(self.url, {'q': term})
+                self.assertEqual(self.get_ids(response), expected)
+
+    def test_search_non_ascii_names(self):
+        ids = self.create_orders(
+            [('Иван', 'Иванов'), ('Пётр', 'Straße'), ('ANNA', 'ПЕТРОВА')]
+        )
+        anna, petr, ivan = ids
+        for term, expected in [
+            ('иван', [ivan]),
+            ('ИВАНОВ', [ivan]),
+            ('пётр', [petr]),
+            ('strasse', [petr]),
+            ('петр', [anna]),
+            ('anna петрова', [anna]),
+        ]:
+            with self.subTest(term=term):
+                response = self.client.get(self.url, {'q': term})
+                self.assertEqual(self.get_ids(response), expected)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class InvoiceTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.render_pdf = self.enterContext(
+            mock.patch.object(
+                rendering, 'render', return_value=b'%PDF-1.7 invoice'
+            )
+        )
+        category = Category.objects.create(name='Tea', slug='tea')
+        product = Product.objects.create(
+            category=category, name='Tea', slug='tea', price=Decimal('4.15')
+        )
+        self.order = Order.objects.create(
+            first_name='Ivan',
+            last_name='Ivanov',
+            email='ivan@example.com',
+            address='Lenina 1',
+            postal_code='101000',
+            city='Moscow',
+        )
+        OrderItem.objects.create(
+            order=self.order, product=product, price=product.price, quantity=3
+        )
+        self.order.update_totals()
+
+    def test_invoice_is_rendered_once(self):
+        name = get_invoice(self.order)
+        self.assertEqual(get_invoice(Order.objects.get()), name)
+        self.assertEqual(self.render_pdf.call_count, 1)
+        self.assertTrue(default_storage.exists(name))
+
+    def test_changed_order_replaces_the_invoice(self):
+        old_name = get_invoice(self.order)
+        self.order.paid = True
+        self.order.save()
+        name = get_invoice(self.order)
+        self.assertNotEqual(name, old_name)
+        self.assertEqual(self.render_pdf.call_count, 2)
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(default_storage.exists(name))
+
+    def test_admin_and_email_share_the_invoice(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        )
+        response = self.client.get(
+            reverse('orders:admin_order_pdf', args=[self.order.id])
+        )
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        pdf = b''.join(response.streaming_content)
+        payment_completed(self.order.id)
+        self.assertEqual(self.render_pdf.call_count, 1)
+        self.assertEqual(
+            mail.outbox[0].attachments,
+            [(f'order_{self.order.id}.pdf', pdf, 'application/pdf')],
+        )
+
+    def test_invoice_data_takes_a_fixed_number_of_queries(self):
+        category = Category.objects.get()
+        for i in range(5):
+            product = Product.objects.create(
+                category=category, name=f'Tea {i}', slug=f'tea-{i}',
+                price=Decimal('1.00'),
+            )
+            OrderItem.objects.create(
+                order=self.order, product=product, price=product.price
+            )
+        with self.assertNumQueries(2):
+            invoice = get_invoice_data([self.order])[0]
+        self.assertEqual(len(invoice['items']), 6)
+        self.assertEqual(invoice['total'], self.order.total)
+        self.assertIsNone(invoice['coupon'])
+
+    def test_invoice_data_names_products_in_the_active_language(self):
+        product = Product.objects.get()
+        product.set_current_language('ru')
+        product.name = 'Чай'
+        product.save()
+        other = Product.objects.create(
+            category=product.category, name='Coffee', slug='coffee',
+            price=Decimal('2.00'),
+        )
+        OrderItem.objects.create(
+            order=self.order, product=other, price=other.price
+        )
+        with translation.override('ru'):
+            invoice = get_invoice_data([self.order])[0]
+        # without a Russian name the fallback language is used
+        self.assertEqual(
+            [item['name'] for item in invoice['items']], ['Чай', 'Coffee']
+        )
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def test_admin_detail_shows_the_invoice_data(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        )
+        response = self.client.get(
+            reverse('orders:admin_order_detail', args=[self.order.id])
+        )
+        self.assertEqual(
+            response.context['order'], get_invoice_data([self.order])[0]
+        )
+        self.assertContains(response, '<td>Tea</td>')
+        self.assertContains(response, '$12.45')
+
+    def test_languages_keep_their_own_invoice(self):
+        name = get_invoice(self.order)
+        with translation.override('ru'):
+            ru_name = get_invoice(self.order)
+        self.assertEqual(get_invoice(self.order), name)
+        self.assertNotEqual(ru_name, name)
+        self.assertEqual(self.render_pdf.call_count, 2)
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(default_storage.exists(ru_name))
+
+    def test_invoice_removed_before_opening_is_rendered_again(self):
+        with mock.patch(
+            'orders.invoices.get_invoice',
+            return_value=f'invoices/{self.order.id}/en/removed.pdf',
+        ):
+            with open_invoice(self.order) as pdf:
+                self.assertEqual(pdf.read(), b'%PDF-1.7 invoice')
+        self.assertEqual(self.render_pdf.call_count, 1)
+
+    def test_purge_removes_old_invoices(self):
+        name = get_invoice(self.order)
+        # stored before invoices were kept per language
+        legacy_name = default_storage.save(
+            f'invoices/{self.order.id}/legacy.pdf', io.BytesIO(b'%PDF')
+        )
+        self.assertEqual(purge_invoices(retention_days=1), 0)
+        with mock.patch(
+            'orders.invoices.timezone.now',
+            return_value=timezone.now() + timedelta(days=2),
+        ):
+            self.assertEqual(purge_invoices(retention_days=1), 2)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(legacy_name))
+
+
+class RenderPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.path = finders.find('css/pdf.css')
+        self.addCleanup(rendering.shutdown_pool)
+
+    @mock.patch.object(rendering, '_stylesheet', None)
+    def test_stylesheet_is_parsed_once_per_process(self):
+        with mock.patch.object(
+            rendering.weasyprint, 'CSS'
+        ) as css, mock.patch.object(
+            rendering.weasyprint, 'HTML'
+        ) as html:
+            html.return_value.write_pdf.return_value = b'%PDF'
+            for _ in range(3):
+                self.assertEqual(
+                    rendering.render_with_stylesheet('<p>1</p>', self.path),
+                    b'%PDF',
+                )
+        css.assert_called_once()
+
+    @override_settings(INVOICE_RENDER_WORKERS=1)
+    def test_pool_renders_in_another_process(self):
+        pool = rendering.get_pool(self.path)
+        self.assertNotEqual(pool.submit(os.getpid).result(), os.getpid())
+        self.assertTrue(
+            rendering.render('<p>1</p>', self.path).startswith(b'%PDF')
+        )
+        self.assertIs(rendering.get_pool(self.path), pool)
+
+    @override_settings(INVOICE_RENDER_WORKERS=1)
+    def test_daemonic_process_renders_in_process(self):
+        with mock.patch.object(
+            rendering.multiprocessing, 'current_process'
+        ) as current_process, mock.patch.object(
+            rendering, 'get_pool'
+        ) as get_pool, mock.patch.object(
+            rendering, 'render_with_stylesheet', return_value=b'%PDF'
+        ):
+            current_process.return_value.daemon = True
+            self.assertEqual(rendering.render('<p>1</p>', self.path), b'%PDF')
+        get_pool.assert_not_called()
+
+    @override_settings(INVOICE_RENDER_WORKERS=1)
+    def test_broken_pool_is_replaced(self):
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool
+        with mock.patch.object(
+            rendering, '_pool', broken
+        ), mock.patch.object(
+            rendering, 'render_with_stylesheet', return_value=b'%PDF'
+        ):
+            self.assertEqual(rendering.render('<p>1</p>', self.path), b'%PDF')
+            self.assertIsNone(rendering._pool)
+        broken.shutdown.assert_called_once()
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], INVOICE_RENDER_WORKERS=0)
+class InvoiceArchiveTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.render_pdf = self.enterContext(
+            mock.patch.object(
+                rendering,
+                'render_with_stylesheet',
+                side_effect=lambda html, path: html.encode(),
+            )
+        )
+        self.category = Category.objects.create(name='Tea', slug='tea')
+        now = timezone.now()
+        self.coupon = Coupon.objects.create(
+            code='SUMMER',
+            valid_from=now,
+            valid_to=now,
+            discount=10,
+            active=True,
+        )
+        self.client.force_login(
+            User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        )
+
+    def create_orders(self, count):
+        for i in range(count):
+            order = Order.objects.create(
+                first_name='Ivan',
+                last_name='Ivanov',
+                email='ivan@example.com',
+                address='Lenina 1',
+                postal_code='101000',
+                city='Moscow',
+                coupon=self.coupon,
+                discount=10,
+            )
+            for j in range(2):
+                product = Product.objects.create(
+                    category=self.category,
+                    name=f'Tea {i}-{j}',
+                    slug=f'tea-{i}-{j}',
+                    price=Decimal('4.15'),
+                )
+                OrderItem.objects.create(
+                    order=order, product=product, price=product.price,
+                    quantity=1,
+                )
+            order.update_totals()
+
+    def download(self):
+        response = self.client.post(
+            reverse('admin:orders_order_changelist'),
+            {
+                'action': 'export_invoices',
+                '_selected_action': list(
+                    Order.objects.values_list('id', flat=True)
+                ),
+            },
+        )
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        with CaptureQueriesContext(connection) as queries:
+            content = b''.join(response.streaming_content)
+        return zipfile.ZipFile(io.BytesIO(content)), len(queries)
+
+    def test_archive_holds_the_invoice_of_every_order(self):
+        self.create_orders(3)
+        archive, _ = self.download()
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted(f'order_{order.id}.pdf' for order in Order.objects.all()),
+        )
+        order = Order.objects.earliest('id')
+        pdf = archive.read(f'order_{order.id}.pdf')
+        self.assertIn(b'Tea 0-1', pdf)
+        self.assertIn(b'SUMMER', pdf)
+        self.assertEqual(self.render_pdf.call_count, 3)
+
+    def test_queries_do_not_grow_with_the_orders(self):
+        self.create_orders(2)
+        _, queries = self.download()
+        self.create_orders(4)
+        shutil.rmtree(settings.MEDIA_ROOT)
+        _, more_queries = self.download()
+        self.assertEqual(more_queries, queries)
+
+    def test_stored_invoices_are_reused(self):
+        self.create_orders(2)
+        order = Order.objects.first()
+        with default_storage.open(get_invoice(order)) as stored:
+            pdf = stored.read()
+        archive, _ = self.download()
+        self.assertEqual(archive.read(f'order_{order.id}.pdf'), pdf)
+        self.assertEqual(self.render_pdf.call_count, 2)
+        # the invoices rendered for the archive are stored as well
+        self.download()
+        self.assertEqual(self.render_pdf.call_count, 2)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class OrderCreateTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.products = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('2.50'),
+            )
+            for i in range(5)
+        ]
+        for product in self.products:
+            self.client.post(
+                reverse('cart:cart_add', args=[product.id]),
+                {'quantity': 2, 'override': False},
+            )
+        self.data = {
+            'first_name': 'Ivan',
+            'last_name': 'Ivanov',
+            'email': 'ivan@example.com',
+            'address': 'Lenina 1',
+            'postal_code': '101000',
+            'city': 'Moscow',
+        }
+
+    def test_items_are_inserted_at_once_with_an_outbox_message(self):
+        with mock.patch.object(order_created, 'delay') as delay:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(
+                    reverse('orders:order_create'), self.data
+                )
+        delay.assert_not_called()
+        self.assertRedirects(
+            response, reverse('payment:process'), fetch_redirect_response=False
+        )
+        inserts = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('INSERT INTO "orders_orderitem"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 5)
+        self.assertEqual(order.total, Decimal('25.00'))
+        message = OutboxMessage.objects.get()
+        self.assertEqual(
+            (message.task, message.args),
+            ('orders.tasks.order_created', [order.id]),
+        )
+
+    def test_failed_items_leave_no_order_and_keep_cart(self):
+        with mock.patch.object(
+            OrderItem.objects, 'bulk_create', side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            self.client.post(reverse('orders:order_create'), self.data)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OutboxMessage.objects.exists())
+        response = self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(len(response.context['cart']), 10)
+
+
+@override_settings(OUTBOX_RETRY_DELAY=5, OUTBOX_RETRY_MAX_DELAY=60)
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.app = self.enterContext(
+            mock.patch.object(outbox, 'current_app')
+        )
+
+    def test_relay_sends_due_messages_in_order(self):
+        outbox.enqueue(order_created, 2)
+        outbox.enqueue(payment_completed, 1)
+        # the claim, a SELECT ... FOR UPDATE and an UPDATE, and one
+        # UPDATE marking the batch, each in a savepoint here
+        with self.assertNumQueries(7):
+            self.assertEqual(outbox.relay(batch_size=10), 2)
+        self.assertEqual(
+            self.app.send_task.call_args_list,
+            [
+                mock.call(
+                    'orders.tasks.order_created',
+                    args=[2],
+                    task_id='orders.tasks.order_created:2',
+                ),
+                mock.call(
+                    'payment.tasks.payment_completed',
+                    args=[1],
+                    task_id='payment.tasks.payment_completed:1',
+                ),
+            ],
+        )
+        self.assertFalse(
+            OutboxMessage.objects.filter(sent__isnull=True).exists()
+        )
+        self.assertEqual(outbox.relay(), 0)
+
+    def test_relay_sends_in_batches(self):
+        for order_id in range(5):
+            outbox.enqueue(order_created, order_id)
+        self.assertEqual(outbox.relay(batch_size=2), 5)
+        self.assertEqual(self.app.send_task.call_count, 5)
+
+    def test_messages_are_sent_outside_the_transaction(self):
+        depth = len(connection.atomic_blocks)
+        depths = []
+        self.app.send_task.side_effect = (
+            lambda *args, **kwargs: depths.append(
+                len(connection.atomic_blocks)
+            )
+        )
+        outbox.enqueue(order_created, 1)
+        self.assertEqual(outbox.relay(), 1)
+        self.assertEqual(depths, [depth])
+
+    def test_claimed_messages_are_sent_again_after_the_claim(self):
+        outbox.enqueue(order_created, 1)
+        # a relay claimed the message and died before sending it
+        self.assertEqual(len(outbox.claim(10)), 1)
+        self.assertEqual(outbox.relay(), 0)
+        OutboxMessage.objects.update(available=timezone.now())
+        self.assertEqual(outbox.relay(), 1)
+
+    def test_repeated_message_is_stored_once(self):
+        for _ in range(2):
+            with transaction.atomic():
+                outbox.enqueue(payment_completed, 1)
+        outbox.relay()
+        outbox.enqueue(payment_completed, 1)
+        self.assertEqual(outbox.relay(), 0)
+        self.assertEqual(self.app.send_task.call_count, 1)
+
+    def test_messages_are_rolled_back_with_the_transaction(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.enqueue(order_created, 1)
+            raise RuntimeError
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_failed_send_is_retried_with_backoff(self):
+        self.app.send_task.side_effect = ConnectionError('broker is down')
+        outbox.enqueue(order_created, 1)
+        outbox.enqueue(order_created, 2)
+        # nothing sent, the relay stops after the first batch
+        with self.assertLogs('orders.outbox', 'WARNING'):
+            self.assertEqual(outbox.relay(batch_size=1), 0)
+        message = OutboxMessage.objects.get(args=[1])
+        self.assertEqual(message.attempts, 1)
+        self.assertIn('broker is down', message.last_error)
+        self.assertGreater(message.available, timezone.now())
+        self.assertEqual(outbox.get_retry_delay(2), timedelta(seconds=10))
+        self.assertEqual(outbox.get_retry_delay(10), timedelta(seconds=60))
+
+        self.app.send_task.side_effect = None
+        self.assertEqual(outbox.relay(), 1)
+        OutboxMessage.objects.update(available=timezone.now())
+        self.assertEqual(outbox.relay(), 1)
+        self.assertEqual(
+            OutboxMessage.objects.filter(sent__isnull=False).count(), 2
+        )
+
+    def test_purge_removes_old_sent_messages(self):
+        outbox.enqueue(order_created, 1)
+        outbox.enqueue(order_created, 2)
+        outbox.relay(batch_size=1)
+        OutboxMessage.objects.filter(args=[1]).update(
+            sent=timezone.now() - timedelta(days=2)
+        )
+        self.assertEqual(outbox.purge(retention_days=1), 1)
+        self.assertEqual(
+            list(OutboxMessage.objects.values_list('args', flat=True)),
+            [[2]],
+        )
+
+    def test_command_relays_once(self):
+        outbox.enqueue(order_created, 1)
+        stdout = io.StringIO()
+        # closing the connection would end the test transaction
+        with mock.patch(
+            'orders.management.commands.relay_outbox.close_old_connections'
+        ):
+            call_command('relay_outbox', once=True, stdout=stdout)
+        self.assertEqual(stdout.getvalue(), 'Sent 1 messages.\n')
+        self.app.send_task.assert_called_once()
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class StockReservationTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.products = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('2.50'),
+                stock=stock,
+            )
+            for i, stock in enumerate([5, 3, None])
+        ]
+        for product in self.products:
+            self.client.post(
+                reverse('cart:cart_add', args=[product.id]),
+                {'quantity': 2, 'override': False},
+            )
+        self.data = {
+            'first_name': 'Ivan',
+            'last_name': 'Ivanov',
+            'email': 'ivan@example.com',
+            'address': 'Lenina 1',
+            'postal_code': '101000',
+            'city': 'Moscow',
+        }
+
+    def get_stock(self):
+        return list(
+            Product.objects.order_by('id').values_list('stock', flat=True)
+        )
+
+    def test_order_reserves_stock_with_one_update(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                reverse('orders:order_create'), self.data
+            )
+        self.assertRedirects(
+            response, reverse('payment:process'), fetch_redirect_response=False
+        )
+        updates = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('UPDATE "shop_product"')
+        ]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.get_stock(), [3, 1, None])
+        self.assertTrue(Order.objects.get().stock_reserved)
+
+    def test_stock_is_reserved_last_in_the_transaction(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.post(reverse('orders:order_create'), self.data)
+        statements = [query['sql'] for query in context.captured_queries]
+        update = next(
+            i for i, sql in enumerate(statements)
+            if sql.startswith('UPDATE "shop_product"')
+        )
+        self.assertTrue(
+            any(sql.startswith('INSERT') for sql in statements[:update])
+        )
+        # the product rows are locked by the UPDATE, nothing else runs
+        # until the transaction ends
+        self.assertTrue(
+            all(
+                sql.startswith('RELEASE SAVEPOINT')
+                for sql in statements[update + 1:update + 3]
+            )
+        )
+
+    def test_out_of_stock_saves_nothing(self):
+        Product.objects.filter(id=self.products[1].id).update(stock=1)
+        response = self.client.post(reverse('orders:order_create'), self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.context['form'].non_field_errors(),
+            ['Not enough in stock: Tea 1.'],
+        )
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self.get_stock(), [5, 1, None])
+        self.assertEqual(len(response.context['cart']), 6)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_reserve_reports_every_short_product(self):
+        first, second, untracked = self.products
+        with self.assertRaises(OutOfStockError) as cm, transaction.atomic():
+            reserve_stock({first.id: 6, second.id: 3, untracked.id: 1})
+        self.assertEqual(cm.exception.product_ids, [first.id, untracked.id])
+        self.assertEqual(self.get_stock(), [5, 3, None])
+
+    def test_release_skips_untracked_products(self):
+        first, second, untracked = self.products
+        release_stock({first.id: 2, untracked.id: 2})
+        self.assertEqual(self.get_stock(), [7, 3, None])
+
+    def test_expired_reservations_are_released(self):
+        for _ in range(2):
+            self.client.post(reverse('orders:order_create'), self.data)
+            for product in self.products[:2]:
+                self.client.post(
+                    reverse('cart:cart_add', args=[product.id]),
+                    {'quantity': 1, 'override': False},
+                )
+        self.assertEqual(self.get_stock(), [2, 0, None])
+        expired, fresh = Order.objects.order_by('id')
+        paid = Order.objects.create(
+            paid=True, stock_reserved=True, **self.data
+        )
+        Order.objects.filter(id__in=[expired.id, paid.id]).update(
+            created=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(release_stock_reservations(), 1)
+        self.assertEqual(self.get_stock(), [4, 2, None])
+        expired.refresh_from_db()
+        self.assertFalse(expired.stock_reserved)
+        self.assertTrue(expired.stock_released)
+        self.assertEqual(release_stock_reservations(), 0)
+        self.assertFalse(
+            OrderItem.objects.filter(
+                order=expired, reserved_quantity__gt=0
+            ).exists()
+        )
+        # a released order can no longer be paid
+        session = self.client.session
+        session['order_id'] = expired.id
+        session.save()
+        response = self.client.get(reverse('payment:process'))
+        self.assertRedirects(
+            response, reverse('payment:canceled'), fetch_redirect_response=False
+        )
+
+    def test_release_returns_only_what_was_reserved(self):
+        first, second, untracked = self.products
+        self.client.post(reverse('orders:order_create'), self.data)
+        order = Order.objects.get()
+        self.assertEqual(
+            dict(order.items.values_list('product_id', 'reserved_quantity')),
+            {first.id: 2, second.id: 2, untracked.id: 0},
+        )
+        # stock tracking starts after the order was placed
+        Product.objects.filter(id=untracked.id).update(stock=10)
+        Order.objects.filter(id=order.id).update(
+            created=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(release_stock_reservations(), 1)
+        self.assertEqual(self.get_stock(), [5, 3, 10])
+
+
+class StockConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        self.connect = lambda: None
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.use_file_database()
+
+    def use_file_database(self):
+        # writers to in-memory SQLite fail instead of waiting for the
+        # lock, the test runs on a copy of the test database in a file
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings_dict = {
+            **connection.settings_dict,
+            'NAME': os.path.join(directory, 'db.sqlite3'),
+        }
+        connection.ensure_connection()
+        with sqlite3.connect(settings_dict['NAME']) as target:
+            connection.connection.backup(target)
+        target.close()
+        memory = connections['default']
+
+        def connect():
+            # per thread, the in-memory database stays open meanwhile
+            connections['default'] = type(memory)(settings_dict, 'default')
+
+        def restore():
+            connections['default'].close()
+            connections['default'] = memory
+
+        self.connect = connect
+        connect()
+        self.addCleanup(restore)
+
+    def test_concurrent_orders_never_oversell(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        product = Product.objects.create(
+            category=category,
+            name='Tea',
+            slug='tea',
+            price=Decimal('2.50'),
+            stock=20,
+        )
+        buyers = 50
+        start = threading.Barrier(buyers)
+        results = []
+
+        # statements run while a buyer holds the lock on the product
+        under_lock = []
+
+        def buy():
+            self.connect()
+            start.wait()
+            try:
+                with CaptureQueriesContext(
+                    connections['default']
+                ) as context, transaction.atomic():
+                    reserve_stock({product.id: 1})
+            except OutOfStockError:
+                results.append(False)
+            else:
+                results.append(True)
+                statements = [query['sql'] for query in context]
+                update = next(
+                    i for i, sql in enumerate(statements)
+                    if sql.startswith('UPDATE "shop_product"')
+                )
+                under_lock.append(statements[update + 1:])
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=buy) for _ in range(buyers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        product.refresh_from_db()
+        self.assertEqual(len(results), buyers)
+        self.assertEqual(results.count(True), 20)
+        self.assertEqual(product.stock, 0)
+        # no lock convoy: a buyer holds the row for one UPDATE and
+        # commits, the others queue on that statement only
+        for statements in under_lock:
+            self.assertFalse(
+                [
+                    sql for sql in statements
+                    if not sql.startswith(('RELEASE SAVEPOINT', 'COMMIT'))
+                ]
+            )
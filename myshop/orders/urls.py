@@ -18,4 +18,14 @@ urlpatterns = [
         views.admin_order_pdf,
         name='admin_order_pdf'
     ),
+    path(
+        'admin/export/<str:export_id>/',
+        views.admin_order_export,
+        name='admin_order_export'
+    ),
+    path(
+        'admin/export/<str:export_id>/download/',
+        views.admin_order_export_download,
+        name='admin_order_export_download'
+    ),
 ]
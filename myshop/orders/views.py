@@ -1,12 +1,16 @@
-import weasyprint
 from django.contrib.admin.views.decorators import staff_member_required
-from django.contrib.staticfiles import finders
-from django.http import HttpResponse
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404, redirect, render
-from django.template.loader import render_to_string
+from django.utils.translation import gettext as _
 
-from cart.cart import Cart
+from cart.cart import get_cart
+from shop.inventory import OutOfStockError, reserve_stock
+from . import outbox
+from .exports import ExportProgress
 from .forms import OrderCreateForm
+from .invoices import get_invoice_data, open_invoice
 from .models import Order, OrderItem
 from .tasks import order_created
 
@@ -16,7 +20,9 @@ def order_create(request):
     Handles the creation of a new order.
 
     If the request method is POST and the form is valid, creates an order with its items,
-    clears the cart, launches an asynchronous task to create the order, and redirects to the payment process.
+    reserves their stock and writes an outbox message for an asynchronous task in one
+    transaction, clears the cart, and redirects to the payment process. If a product
+    is out of stock, nothing is saved and the form is shown again with an error.
     Otherwise, renders the 'orders/order/create.html' template.
 
     Args:
@@ -25,7 +31,7 @@ def order_create(request):
     Returns:
         HttpResponse: A response containing either a rendered template or a redirect.
     """
-    cart = Cart(request)
+    cart = get_cart(request)
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
         if form.is_valid():
@@ -33,22 +39,58 @@ def order_create(request):
             if cart.coupon:
                 order.coupon = cart.coupon
                 order.discount = cart.coupon.discount
-            order.save()
-            for item in cart:
-                OrderItem.objects.create(
+            items = [
+                OrderItem(
                     order=order,
                     product=item['product'],
                     price=item['price'],
                     quantity=item['quantity'],
+                    # products without stock tracking are not reserved
+                    reserved_quantity=(
+                        item['quantity']
+                        if item['product'].stock is not None
+                        else 0
+                    ),
                 )
-            # clear the cart
-            cart.clear()
-            # launch asynchronous task
-            order_created.delay(order.id)
-            # set the order in the session
-            request.session['order_id'] = order.id
-            # redirect for payment
-            return redirect('payment:process')
+                for item in cart
+            ]
+            # totals are stored with the order, read later without items
+            order.set_totals(items)
+            quantities = {
+                item.product.id: item.reserved_quantity
+                for item in items
+                if item.reserved_quantity
+            }
+            order.stock_reserved = bool(quantities)
+            try:
+                # the order and all its items are saved together or not at all
+                with transaction.atomic():
+                    order.save()
+                    OrderItem.objects.bulk_create(items)
+                    # the task is sent by the outbox relay once the
+                    # order is committed
+                    outbox.enqueue(order_created, order.id)
+                    # reserved last, the product rows stay locked
+                    # only until the commit
+                    reserve_stock(quantities)
+            except OutOfStockError as e:
+                names = ', '.join(
+                    str(item.product)
+                    for item in items
+                    if item.product.id in e.product_ids
+                )
+                form.add_error(
+                    None, _('Not enough in stock: %(products)s.') % {
+                        'products': names
+                    }
+                )
+            else:
+                # clear the cart
+                cart.clear()
+                # set the order in the session
+                request.session['order_id'] = order.id
+                # redirect for payment
+                return redirect('payment:process')
     else:
         form = OrderCreateForm()
     return render(
@@ -70,9 +112,13 @@ def admin_order_detail(request, order_id):
     Returns:
         HttpResponse: A response containing a rendered template with order details.
     """
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(
+        Order.objects.select_related('coupon'), id=order_id
+    )
     return render(
-        request, 'admin/orders/order/detail.html', {'order': order}
+        request,
+        'admin/orders/order/detail.html',
+        {'order': get_invoice_data([order])[0]},
     )
 
 
@@ -81,19 +127,72 @@ def admin_order_pdf(request, order_id):
     """
     Generates a PDF report for an existing order.
 
+    The PDF is served from the invoice store and rendered only if the
+    order changed since it was stored.
+
     Args:
         request (HttpRequest): The current HTTP request.
         order_id (int): The ID of the order to generate the report for.
 
     Returns:
-        HttpResponse: A response containing a generated PDF report.
+        FileResponse: A response streaming the PDF report.
+    """
+    order = get_object_or_404(
+        Order.objects.select_related('coupon'), id=order_id
+    )
+    return FileResponse(
+        open_invoice(order),
+        content_type='application/pdf',
+        filename=f'order_{order.id}.pdf',
+    )
+
+
+@staff_member_required
+def admin_order_export(request, export_id):
+    """
+    Displays the progress of a background export of orders.
+
+    Args:
+        request (HttpRequest): The current HTTP request.
+        export_id (str): The ID of the export.
+
+    Returns:
+        HttpResponse: A response containing a rendered template with the
+            progress and, once finished, a download link.
+    """
+    export = ExportProgress(export_id).get()
+    if export is None:
+        raise Http404('Export not found or expired.')
+    if export['total']:
+        percent = 100 * export['done'] // export['total']
+    else:
+        # the total is counted by the worker once it starts
+        percent = 100 if export['status'] == 'done' else 0
+    return render(
+        request,
+        'admin/orders/order/export.html',
+        {'export_id': export_id, 'export': export, 'percent': percent},
+    )
+
+
+@staff_member_required
+def admin_order_export_download(request, export_id):
+    """
+    Sends the file of a finished background export.
+
+    Args:
+        request (HttpRequest): The current HTTP request.
+        export_id (str): The ID of the export.
+
+    Returns:
+        FileResponse: A response streaming the file from the storage.
     """
-    order = get_object_or_404(Order, id=order_id)
-    html = render_to_string('orders/order/pdf.html', {'order': order})
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'filename=order_{order.id}.pdf'
-    weasyprint.HTML(string=html).write_pdf(
-        response,
-        stylesheets=[weasyprint.CSS(finders.find('css/pdf.css'))],
+    export = ExportProgress(export_id).get()
+    if export is None or export['status'] != 'done':
+        raise Http404('Export not found or not finished.')
+    name = export['name']
+    return FileResponse(
+        default_storage.open(name),
+        as_attachment=True,
+        filename=name.rsplit('/', 1)[-1],
     )
-    return response
@@ -1,9 +1,6 @@
-from io import BytesIO
-import weasyprint
 from celery import shared_task
-from django.contrib.staticfiles import finders
 from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
+from orders.invoices import open_invoice
 from orders.models import Order
 
 
@@ -14,7 +11,7 @@ def payment_completed(order_id):
     по электронной почте при успешной оплате заказа.
     '''
 
-    order = Order.objects.get(id=order_id)
+    order = Order.objects.select_related('coupon').get(id=order_id)
     # создать счет по электронной почте
     subject = f'My Shop - Invoice no. {order.id}'
     message = (
@@ -23,14 +20,11 @@ def payment_completed(order_id):
     email = EmailMessage(
         subject, message, 'admin@myshop.com', [order.email]
     )
-    # Создание PDF
-    html = render_to_string('orders/order/pdf.html', {'order': order})
-    out = BytesIO()
-    stylesheets = [weasyprint.CSS(finders.find('css/pdf.css'))]
-    weasyprint.HTML(string=html).write_pdf(out, stylesheets=stylesheets)
-    # вложить PDF-файл
-    email.attach(
-        f'order_{order.id}.pdf', out.getvalue(), 'application/pdf'
-    )
+    # PDF из хранилища счетов, рендерится, только если его там нет
+    with open_invoice(order) as pdf:
+        # вложить PDF-файл
+        email.attach(
+            f'order_{order.id}.pdf', pdf.read(), 'application/pdf'
+        )
     # отправить электронное письмо
     email.send()
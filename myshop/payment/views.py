@@ -1,8 +1,8 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from decimal import Decimal
 import stripe
 from django.conf import settings
 from django.urls import reverse
+from myshop.money import to_cents
 from orders.models import Order
 
 
@@ -16,6 +16,7 @@ def payment_process(request):
     """
     Обрабатывает процесс оплаты заказа.
 
+    Заказ, резерв товаров которого снят по таймауту, оплатить нельзя.
     Если метод запроса POST и форма валидна, создаёт сессию оплаты Stripe,
     добавляет элементы заказа в сессию, создаёт купон для скидки (если есть),
     перенаправляет на форму оплаты Stripe.
@@ -31,6 +32,9 @@ def payment_process(request):
     order_id = request.session.get('order_id')  # Получает ID заказа из сессии
     # Ищет заказ по ID и обрабатывает ошибку
     order = get_object_or_404(Order, id=order_id)
+    if order.stock_released:
+        # Заказ не оплачен вовремя, резерв товаров снят
+        return redirect('payment:canceled')
 
     if request.method == 'POST':
         # URL-адрес для перенаправления после успешной оплаты
@@ -51,8 +55,8 @@ def payment_process(request):
             session_data['line_items'].append(
                 {
                     'price_data': {  # Данные о цене
-                        # Цена без десятичной точки
-                        'unit_amount': int(item.price * Decimal('100')),
+                        # Цена в центах
+                        'unit_amount': to_cents(item.price),
                         'currency': 'usd',  # Валюта
                         'product_data': {  # Данные о товаре
                             'name': item.product.name,  # Название товара
@@ -1,11 +1,17 @@
+import logging
+
 import stripe
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from orders import outbox
 from orders.models import Order
+from shop.inventory import OutOfStockError, reserve_stock
 from .tasks import payment_completed
-from shop.models import Product
-from shop.recommender import Recommender
+
+logger = logging.getLogger(__name__)
 
 # CSRF-отказано
 
@@ -49,25 +55,46 @@ def stripe_webhook(request):
             session.mode == 'payment'
             and session.payment_status == 'paid'
         ):
-            try:
-                # Получение заказа по client_reference_id
-                order = Order.objects.get(
-                    id=session.client_reference_id
-                )
-            except Order.DoesNotExist:
-                # Заказ не найден
-                return HttpResponse(status=404)
-            # Помечает заказ как оплаченный
-            order.paid = True
-            # Сохранение идентификатора платежа Stripe
-            order.stripe_id = session.payment_intent
-            order.save()
-            # Сохраняет купленные товары для рекомендаций
-            product_ids = order.items.values_list('product_id')
-            products = Product.objects.filter(id__in=product_ids)
-            r = Recommender()
-            r.products_bought(products)
-            # Запуск асинхронной задачи
-            payment_completed.delay(order.id)
+            with transaction.atomic():
+                try:
+                    # Получение заказа по client_reference_id, задача
+                    # снятия резервов пропускает заблокированный заказ
+                    order = Order.objects.select_for_update().get(
+                        id=session.client_reference_id
+                    )
+                except Order.DoesNotExist:
+                    # Заказ не найден
+                    return HttpResponse(status=404)
+                if order.stock_released:
+                    # Резерв уже снят по таймауту, но деньги получены:
+                    # товар резервируется заново, если он еще есть
+                    quantities = order.get_stock_quantities()
+                    try:
+                        with transaction.atomic():
+                            reserve_stock(quantities)
+                            # Резерв запоминается в позициях заказа
+                            order.items.filter(
+                                product_id__in=quantities
+                            ).update(reserved_quantity=F('quantity'))
+                    except OutOfStockError as e:
+                        logger.error(
+                            'Order %s was paid after its reservation '
+                            'expired, products out of stock: %s.',
+                            order.id,
+                            e.product_ids,
+                        )
+                    else:
+                        order.stock_reserved = True
+                        order.stock_released = False
+                # Помечает заказ как оплаченный
+                order.paid = True
+                # Сохранение идентификатора платежа Stripe
+                order.stripe_id = session.payment_intent
+                # Купленные товары учитываются в рекомендациях задачей
+                # shop.tasks.ingest_purchases, вебхук не ждет хранилище
+                order.save()
+                # Асинхронная задача отправляется ретранслятором outbox
+                # после фиксации транзакции, повтор вебхука ее не дублирует
+                outbox.enqueue(payment_completed, order.id)
 
     return HttpResponse(status=200)
@@ -45,14 +45,40 @@ class ProductAdmin(TranslatableAdmin):
         'slug',
         'price',
         'available',
+        'stock',
         'created',
         'updated'
     ]
     # Фильтры для списка продуктов
     list_filter = ['available', 'created', 'updated']
     # Поля которые доступны к редактированию в списке
-    list_editable = ['price', 'available']
+    list_editable = ['price', 'available', 'stock']
 
     # Поля для автозаполнения слага из имени
     def get_prepopulated_fields(self, request, obj=None):
         return {'slug': ('name',)}
+
+    def save_model(self, request, obj, form, change):
+        """
+        Сохраняет продукт, не перезаписывая остаток без необходимости.
+
+        Пока форма была открыта, заказы могли зарезервировать товар,
+        поэтому остаток из формы пишется, только если его изменили.
+        Args:
+            request (HttpRequest): Текущий HTTP-запрос
+            obj (Product): Сохраняемый продукт
+            form (ModelForm): Форма продукта
+            change (bool): Изменение существующего продукта
+        Returns:
+            None
+        """
+        if change and 'stock' not in form.changed_data:
+            obj.save(
+                update_fields=[
+                    field.name
+                    for field in obj._meta.concrete_fields
+                    if not field.primary_key and field.name != 'stock'
+                ]
+            )
+        else:
+            super().save_model(request, obj, form, change)
@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+
+from .models import Product
+
+
+class OutOfStockError(Exception):
+    """
+    Исключение: остатка части товаров не хватает для резервирования.
+    Args:
+        product_ids (list): ID товаров, которых не хватило
+    """
+
+    def __init__(self, product_ids):
+        super().__init__(product_ids)
+        self.product_ids = product_ids
+
+
+def _per_product(quantities):
+    """
+    Выражение CASE с количеством для каждого товара.
+    Args:
+        quantities (dict): {ID товара: количество}
+    Returns:
+        Case: Количество товара строки
+    """
+    return Case(
+        *[
+            When(id=product_id, then=Value(quantity))
+            for product_id, quantity in quantities.items()
+        ],
+        output_field=PositiveIntegerField(),
+    )
+
+
+def reserve_stock(quantities):
+    """
+    Резервирует остаток товаров одним условным UPDATE.
+
+    Остаток уменьшается только у строк, где его хватает, поэтому
+    параллельные заказы не могут увести его в минус: проверка и
+    списание выполняются базой атомарно, без SELECT ... FOR UPDATE.
+    Если обновлено меньше строк, чем товаров, вызывается исключение,
+    и транзакция вызывающего кода откатывает списание целиком.
+    Вызывать внутри transaction.atomic() и как можно ближе к концу
+    транзакции: блокировки строк держатся до ее завершения.
+    Args:
+        quantities (dict): {ID товара: количество}, только товары
+            с учетом остатка
+    Returns:
+        None
+    Raises:
+        OutOfStockError: Остатка хватило не всем товарам
+    """
+    if not quantities:
+        return
+    amount = _per_product(quantities)
+    try:
+        # точка сохранения: при нехватке списание отменяется сразу,
+        # чтобы прочитать остатки до него
+        with transaction.atomic():
+            updated = (
+                Product.objects.filter(id__in=quantities, stock__gte=amount)
+                .update(stock=F('stock') - amount)
+            )
+            if updated != len(quantities):
+                raise OutOfStockError([])
+    except OutOfStockError:
+        stock = dict(
+            Product.objects.filter(id__in=quantities)
+            .values_list('id', 'stock')
+        )
+        raise OutOfStockError(
+            [
+                product_id
+                for product_id, quantity in quantities.items()
+                if stock.get(product_id) is None
+                or stock[product_id] < quantity
+            ]
+        )
+
+
+def release_stock(quantities):
+    """
+    Возвращает зарезервированный остаток одним UPDATE.
+    Args:
+        quantities (dict): {ID товара: количество}
+    Returns:
+        int: Число обновленных товаров
+    """
+    if not quantities:
+        return 0
+    amount = _per_product(quantities)
+    # товары, с которых сняли учет остатка, не трогаются
+    return Product.objects.filter(
+        id__in=quantities, stock__isnull=False
+    ).update(stock=F('stock') + amount)
@@ -0,0 +1,234 @@
+import time
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from scipy import sparse
+
+from orders.models import Order, OrderItem
+from shop.recommender import Recommender
+
+
+class Command(BaseCommand):
+    """
+    Пересобирает оценки совместных покупок из истории оплаченных заказов.
+
+    Позиции заказов читаются частями, из них строится разреженная матрица
+    заказ x продукт, матрица совместных покупок считается одним умножением,
+    после чего оценки пакетами загружаются в хранилище рекомендаций
+    (RECOMMENDER_BACKEND). Если задан
+    RECOMMENDER_DECAY_HALF_LIFE, вклад заказа затухает с его возрастом.
+
+    Режим загруженных оценок запоминается хранилищем. К оценкам cosine
+    и lift нельзя прибавлять число покупок, поэтому до следующей
+    пересборки в режиме count ingest_purchases их не дополняет, а
+    trim_recommendations не трогает; число соседей ограничивается
+    RECOMMENDER_MAX_NEIGHBOURS при загрузке.
+    """
+    help = (
+        'Rebuilds co-purchase recommendations from paid orders '
+        'and bulk-loads them into the recommender backend. '
+        'Cosine and lift scores are not counts: until the next count '
+        'rebuild, newly paid orders are not added to them and '
+        'trim_recommendations skips them, so rerun this command '
+        'to keep them current.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            choices=['count', 'cosine', 'lift'],
+            default='count',
+            help='Scoring mode: raw co-purchase count (default), '
+                 'cosine similarity or lift. Only count scores are '
+                 'updated by newly paid orders between rebuilds.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of order items read from the database at once.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products written to the recommender backend '
+                 'per batch.',
+        )
+
+    def handle(self, *args, **options):
+        order_ids, product_ids = self.read_order_items(options['chunk_size'])
+        if not len(order_ids):
+            self.stdout.write('No paid orders found.')
+            Recommender().clear_purchases()
+            return
+        orders = np.unique(order_ids)
+        pending = self.read_pending_orders(orders)
+        products, scores = self.build_scores(
+            order_ids,
+            product_ids,
+            options['mode'],
+            half_life=settings.RECOMMENDER_DECAY_HALF_LIFE,
+            chunk_size=options['chunk_size'],
+        )
+        loaded = Recommender().load_purchases(
+            self.iter_neighbours(
+                products, scores, settings.RECOMMENDER_MAX_NEIGHBOURS
+            ),
+            batch_size=options['batch_size'],
+            mode=options['mode'],
+        )
+        Order.objects.filter(id__in=pending).update(
+            recommendations_synced=True
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Loaded {options["mode"]} scores for {loaded} products '
+                f'from {len(orders)} paid orders.'
+            )
+        )
+
+    def read_order_items(self, chunk_size):
+        """
+        Читает пары (заказ, продукт) оплаченных заказов частями.
+        Args:
+            chunk_size (int): Размер части
+        Returns:
+            tuple: Массивы id заказов и id продуктов
+        """
+        rows = (
+            OrderItem.objects.filter(order__paid=True)
+            .order_by()
+            .values_list('order_id', 'product_id')
+            .iterator(chunk_size=chunk_size)
+        )
+        chunks = []
+        while chunk := list(islice(rows, chunk_size)):
+            chunks.append(np.array(chunk, dtype=np.int64))
+        if not chunks:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        pairs = np.concatenate(chunks)
+        return pairs[:, 0], pairs[:, 1]
+
+    def read_pending_orders(self, orders):
+        """
+        Возвращает заказы из очереди ingest_purchases, которые вошли
+        в пересборку. После загрузки оценок они помечаются учтенными.
+        Заказ, оплаченный после чтения позиций, в пересборку не попал
+        и остается в очереди.
+        Args:
+            orders (ndarray): Отсортированные id прочитанных заказов
+        Returns:
+            list: Id заказов
+        """
+        pending = np.fromiter(
+            Order.objects.filter(
+                paid=True,
+                recommendations_synced=False,
+                id__lte=orders[-1],
+            ).values_list('id', flat=True),
+            dtype=np.int64,
+        )
+        return pending[np.isin(pending, orders)].tolist()
+
+    def read_order_weights(self, orders, half_life, chunk_size):
+        """
+        Возвращает вес каждого заказа с учетом затухания по возрасту.
+        Args:
+            orders (ndarray): Отсортированные id заказов
+            half_life (float): Период полураспада оценок в днях
+            chunk_size (int): Размер части
+        Returns:
+            ndarray: Веса заказов в порядке orders
+        """
+        rows = (
+            Order.objects.filter(paid=True)
+            .order_by()
+            .values_list('id', 'created')
+            .iterator(chunk_size=chunk_size)
+        )
+        weights = np.zeros(len(orders), dtype=np.float64)
+        now = time.time()
+        while chunk := list(islice(rows, chunk_size)):
+            ids = np.array([id for id, _ in chunk], dtype=np.int64)
+            ages = np.array(
+                [now - created.timestamp() for _, created in chunk]
+            ) / (24 * 60 * 60)
+            positions = np.searchsorted(orders, ids)
+            # заказы без позиций в выборку не попали
+            found = positions < len(orders)
+            found[found] = orders[positions[found]] == ids[found]
+            weights[positions[found]] = 0.5 ** (
+                np.maximum(ages[found], 0) / half_life
+            )
+        return weights
+
+    def build_scores(
+        self, order_ids, product_ids, mode, half_life=None, chunk_size=5000
+    ):
+        """
+        Строит разреженную матрицу оценок продукт x продукт.
+        Args:
+            order_ids (ndarray): Id заказов
+            product_ids (ndarray): Id продуктов
+            mode (str): Режим оценки: count, cosine или lift
+            half_life (float, optional): Период полураспада оценок в днях
+            chunk_size (int): Размер части при чтении заказов
+        Returns:
+            tuple: Id продуктов по индексам матрицы и матрица оценок (CSR)
+        """
+        orders, rows = np.unique(order_ids, return_inverse=True)
+        products, cols = np.unique(product_ids, return_inverse=True)
+        # матрица заказ x продукт, повторные строки продукта в заказе
+        # считаются одной покупкой, как и в Recommender.products_bought
+        purchases = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, cols)),
+            shape=(len(orders), len(products)),
+        )
+        purchases.data[:] = 1
+        if half_life:
+            weights = self.read_order_weights(orders, half_life, chunk_size)
+            co_purchases = purchases.T @ sparse.diags(weights) @ purchases
+            total = weights.sum()
+        else:
+            co_purchases = purchases.T @ purchases
+            total = len(orders)
+        co_purchases = co_purchases.tocsr()
+        # на диагонали - (взвешенное) число заказов с продуктом
+        counts = co_purchases.diagonal()
+        co_purchases.setdiag(0)
+        co_purchases.eliminate_zeros()
+
+        if mode == 'cosine':
+            norm = sparse.diags(1 / np.sqrt(counts))
+            scores = norm @ co_purchases @ norm
+        elif mode == 'lift':
+            norm = sparse.diags(1 / counts)
+            scores = (norm @ co_purchases @ norm) * total
+        else:
+            scores = co_purchases
+        return products, sparse.csr_matrix(scores)
+
+    def iter_neighbours(self, products, scores, max_neighbours=None):
+        """
+        Перебирает строки матрицы оценок в формате Recommender.load_purchases.
+        Args:
+            products (ndarray): Id продуктов по индексам матрицы
+            scores (csr_matrix): Матрица оценок
+            max_neighbours (int, optional): Число лучших соседей продукта
+        Yields:
+            tuple: Id продукта и словарь {id соседа: оценка}
+        """
+        for index, product_id in enumerate(products):
+            start, end = scores.indptr[index], scores.indptr[index + 1]
+            neighbours = products[scores.indices[start:end]]
+            values = scores.data[start:end]
+            if max_neighbours and len(values) > max_neighbours:
+                best = np.argsort(-values, kind='stable')[:max_neighbours]
+                neighbours, values = neighbours[best], values[best]
+            yield int(product_id), dict(
+                zip(neighbours.tolist(), values.tolist())
+            )
@@ -80,6 +80,8 @@ class Product(TranslatableModel):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     # Флаг доступности продукта
     available = models.BooleanField(default=True)
+    # Остаток на складе, NULL - остаток не учитывается
+    stock = models.PositiveIntegerField(null=True, blank=True)
     # Дата создания продукта
     created = models.DateTimeField(auto_now_add=True)
     # Дата последнего обновления продукта
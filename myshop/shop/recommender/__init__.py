@@ -0,0 +1,298 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from ..models import Product
+from .backends.base import COUNT_MODE
+from .breaker import LATENCY, REQUESTS, CircuitOpenError
+
+
+logger = logging.getLogger(__name__)
+
+
+# хранилища создаются один раз на процесс
+_backends = {}
+
+
+def get_backend():
+    """
+    Возвращает хранилище оценок, выбранное настройками
+    RECOMMENDER_BACKEND и RECOMMENDER_OPTIONS.
+    Returns:
+        BaseRecommenderBackend: Хранилище оценок
+    """
+    path = settings.RECOMMENDER_BACKEND
+    if path not in _backends:
+        backend_class = import_string(path)
+        _backends[path] = backend_class(**settings.RECOMMENDER_OPTIONS)
+    return _backends[path]
+
+
+@receiver(setting_changed)
+def reset_backends(*, setting, **kwargs):
+    """
+    Сбрасывает созданные хранилища при изменении настроек в тестах.
+    """
+    if setting in ('RECOMMENDER_BACKEND', 'RECOMMENDER_OPTIONS'):
+        _backends.clear()
+
+
+class Recommender:
+    """
+    Класс для рекомендации продуктов на основе покупок пользователя.
+
+    Оценки совместных покупок хранятся в подключаемом хранилище
+    (Redis, память процесса или SQLite), см. shop.recommender.backends.
+    Вызовы хранилища со страниц магазина идут через предохранитель:
+    если хранилище недоступно, рекомендации берутся из кэша последних
+    известных списков или не показываются.
+
+    Покупки прибавляются к оценкам и оценки затухают, только если
+    загружены оценки в режиме count: нормированные оценки cosine и lift
+    нельзя дополнить числом покупок, они обновляются только пересборкой
+    командой rebuild_recommendations.
+    Attributes:
+        backend (BaseRecommenderBackend): Хранилище оценок
+    Methods:
+        products_bought(products): Обновляет оценки продуктов, купленных вместе с заданными продуктами.
+        products_bought_many(orders): Обновляет оценки по нескольким заказам одним пакетом.
+        suggest_products_for(products, max_results=6): Возвращает список рекомендуемых продуктов на основе покупок пользователя.
+        suggest_products_for_each(products, max_results=4): Возвращает рекомендации для каждого продукта списка.
+        refresh_suggestions(product_ids=None): Пересчитывает готовые списки рекомендаций.
+        load_purchases(scores, mode='count'): Заменяет данные о покупках заранее посчитанными оценками.
+        trim_purchases(): Применяет затухание оценок и ограничивает число соседей.
+        clear_purchases(): Удаляет все данные о покупках.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+
+    def _call(self, operation, *args):
+        """
+        Вызывает метод хранилища через предохранитель и пишет метрики.
+        Args:
+            operation (str): Имя метода хранилища
+        Returns:
+            Результат метода
+        Raises:
+            CircuitOpenError: Предохранитель разомкнут
+            Exception: Ошибка хранилища из backend.errors
+        """
+        start = time.perf_counter()
+        try:
+            result = self.backend.breaker.call(
+                getattr(self.backend, operation),
+                *args,
+                errors=self.backend.errors,
+            )
+        except CircuitOpenError:
+            REQUESTS.labels(operation, 'rejected').inc()
+            raise
+        except self.backend.errors:
+            REQUESTS.labels(operation, 'error').inc()
+            LATENCY.labels(operation).observe(time.perf_counter() - start)
+            raise
+        REQUESTS.labels(operation, 'ok').inc()
+        LATENCY.labels(operation).observe(time.perf_counter() - start)
+        return result
+
+    def products_bought(self, products):
+        """
+        Обновляет оценки продуктов, купленных вместе с заданными продуктами,
+        и списки рекомендаций затронутых продуктов. Если хранилище
+        недоступно, покупка не учитывается, оценки можно восстановить
+        командой rebuild_recommendations.
+        Args:
+            products (list): Список продуктов
+        Returns:
+            bool: True, если оценки обновлены
+        """
+        try:
+            if self._call('get_mode') != COUNT_MODE:
+                return False
+            self._call('products_bought', [p.id for p in products])
+        except (CircuitOpenError, *self.backend.errors):
+            logger.warning('Recommender is unavailable, purchase skipped.')
+            return False
+        return True
+
+    def products_bought_many(self, orders):
+        """
+        Обновляет оценки по нескольким заказам одним пакетом записи.
+        В отличие от products_bought ошибки хранилища не скрываются,
+        чтобы заказы остались в очереди до следующей попытки. Если
+        загружены оценки не в режиме count, заказы пропускаются: они
+        войдут в следующую пересборку.
+        Args:
+            orders (iterable): Списки id продуктов, по одному на заказ
+        Returns:
+            bool: True, если оценки обновлены
+        Raises:
+            CircuitOpenError: Предохранитель разомкнут
+            Exception: Ошибка хранилища из backend.errors
+        """
+        if self._call('get_mode') != COUNT_MODE:
+            return False
+        self._call('products_bought_many', list(orders))
+        return True
+
+    def suggest_products_for(self, products, max_results=6):
+        """
+        Возвращает список рекомендуемых продуктов на основе покупок пользователя.
+        Args:
+            products (list): Список продуктов
+            max_results (int): Максимальное число рекомендаций
+        Returns:
+            list: Список рекомендуемых продуктов
+        """
+        product_ids = [p.id for p in products]
+        fallback_key = self.get_fallback_key(product_ids, max_results)
+        try:
+            suggested_products_ids = self._call(
+                'suggest_for', product_ids, max_results
+            )
+        except (CircuitOpenError, *self.backend.errors):
+            # последний известный список или никаких рекомендаций
+            REQUESTS.labels('suggest_for', 'fallback').inc()
+            suggested_products_ids = cache.get(fallback_key, [])
+        else:
+            cache.set(
+                fallback_key,
+                suggested_products_ids,
+                settings.RECOMMENDER_FALLBACK_TIMEOUT,
+            )
+        products_by_id = self.get_products(suggested_products_ids)
+        return [
+            products_by_id[id]
+            for id in suggested_products_ids
+            if id in products_by_id
+        ]
+
+    def suggest_products_for_each(self, products, max_results=4):
+        """
+        Возвращает рекомендации для каждого продукта списка, например
+        для страницы каталога. Списки всех продуктов читаются из хранилища
+        за один запрос, рекомендуемые продукты загружаются одним запросом
+        к базе.
+        Args:
+            products (list): Список продуктов
+            max_results (int): Максимальное число рекомендаций на продукт
+        Returns:
+            dict: {id продукта: список рекомендуемых продуктов}
+        """
+        product_ids = [p.id for p in products]
+        fallback_keys = {
+            id: self.get_fallback_key([id], max_results) for id in product_ids
+        }
+        try:
+            suggestions = self._call(
+                'suggest_for_each', product_ids, max_results
+            )
+        except (CircuitOpenError, *self.backend.errors):
+            REQUESTS.labels('suggest_for_each', 'fallback').inc()
+            cached = cache.get_many(fallback_keys.values())
+            suggestions = {
+                id: cached.get(key, []) for id, key in fallback_keys.items()
+            }
+        else:
+            cache.set_many(
+                {
+                    fallback_keys[id]: suggested_ids
+                    for id, suggested_ids in suggestions.items()
+                },
+                settings.RECOMMENDER_FALLBACK_TIMEOUT,
+            )
+        products_by_id = self.get_products({
+            id
+            for suggested_ids in suggestions.values()
+            for id in suggested_ids
+        })
+        return {
+            product_id: [
+                products_by_id[id]
+                for id in suggested_ids
+                if id in products_by_id
+            ]
+            for product_id, suggested_ids in suggestions.items()
+        }
+
+    def get_fallback_key(self, product_ids, max_results):
+        """
+        Возвращает ключ кэша последнего известного списка рекомендаций.
+        Args:
+            product_ids (list): Id продуктов
+            max_results (int): Максимальное число рекомендаций
+        Returns:
+            str: Ключ кэша
+        """
+        return f'recommender:{",".join(map(str, product_ids))}:{max_results}'
+
+    def get_products(self, product_ids):
+        """
+        Загружает продукты с заданными id одним запросом.
+        Порядок рекомендаций восстанавливается по словарю, а не поиском
+        каждого id в списке.
+        Args:
+            product_ids (iterable): Id продуктов
+        Returns:
+            dict: {id продукта: продукт}
+        """
+        if not product_ids:
+            return {}
+        return Product.objects.in_bulk(product_ids)
+
+    def refresh_suggestions(self, product_ids=None):
+        """
+        Пересчитывает готовые списки рекомендаций.
+        Нужен после изменения RECOMMENDER_TOP_N или переноса данных.
+        Args:
+            product_ids (iterable, optional): Id продуктов, по умолчанию все
+        Returns:
+            None
+        """
+        if product_ids is None:
+            product_ids = Product.objects.values_list('id', flat=True)
+        self.backend.refresh_suggestions(product_ids)
+
+    def load_purchases(self, scores, batch_size=500, mode=COUNT_MODE):
+        """
+        Заменяет все данные о покупках заранее посчитанными оценками.
+        Args:
+            scores (iterable): Пары (id продукта, {id соседа: оценка})
+            batch_size (int): Число продуктов в одной пачке записи
+            mode (str): Режим оценок: count, cosine или lift
+        Returns:
+            int: Число загруженных продуктов
+        """
+        return self.backend.load_purchases(
+            scores, batch_size=batch_size, mode=mode
+        )
+
+    def trim_purchases(self, batch_size=500):
+        """
+        Применяет экспоненциальное затухание оценок, удаляет соседей
+        с оценкой ниже RECOMMENDER_MIN_SCORE и оставляет не более
+        RECOMMENDER_MAX_NEIGHBOURS лучших соседей каждого продукта.
+        Оценки не в режиме count не трогаются, число их соседей
+        ограничивает rebuild_recommendations при загрузке.
+        Args:
+            batch_size (int): Число продуктов в одной пачке записи
+        Returns:
+            int: Число обработанных продуктов
+        """
+        if self.backend.get_mode() != COUNT_MODE:
+            return 0
+        return self.backend.trim_purchases(batch_size=batch_size)
+
+    def clear_purchases(self):
+        """
+        Удаляет все данные о покупках.
+        Returns:
+            None
+        """
+        self.backend.clear_purchases()
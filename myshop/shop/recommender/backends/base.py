@@ -0,0 +1,219 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from ..breaker import CircuitBreaker
+
+
+# режим оценок - число совместных покупок; только к таким оценкам
+# прибавляются покупки новых заказов, к ним применяется затухание
+# и RECOMMENDER_MIN_SCORE
+COUNT_MODE = 'count'
+
+
+class BaseRecommenderBackend:
+    """
+    Базовый класс хранилища оценок совместных покупок.
+
+    Хранилище работает только с id продуктов. Загрузка объектов Product
+    и порядок их вывода остаются в shop.recommender.Recommender.
+    Attributes:
+        errors (tuple): Исключения, которые означают недоступность хранилища
+        breaker (CircuitBreaker): Предохранитель вызовов хранилища
+    Methods:
+        products_bought(product_ids): Обновляет оценки продуктов, купленных вместе.
+        products_bought_many(orders): Обновляет оценки по нескольким заказам сразу.
+        suggest_for(product_ids, max_results): Возвращает id рекомендуемых продуктов.
+        suggest_for_each(product_ids, max_results): Возвращает рекомендации для каждого продукта.
+        refresh_suggestions(product_ids): Пересчитывает готовые списки рекомендаций.
+        load_purchases(scores, batch_size, mode): Заменяет все оценки заранее посчитанными.
+        get_mode(): Возвращает режим загруженных оценок.
+        trim_purchases(batch_size): Применяет затухание и ограничивает число соседей.
+        clear_purchases(): Удаляет все оценки.
+    """
+
+    # исключения, которые означают недоступность хранилища
+    errors = ()
+
+    def __init__(self, **options):
+        self.options = options
+        self.breaker = CircuitBreaker(
+            type(self).__name__,
+            settings.RECOMMENDER_BREAKER_THRESHOLD,
+            settings.RECOMMENDER_BREAKER_RESET_TIMEOUT,
+        )
+
+    def products_bought(self, product_ids):
+        """
+        Обновляет оценки продуктов, купленных вместе.
+        Args:
+            product_ids (list): Id продуктов одного заказа
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    def products_bought_many(self, orders):
+        """
+        Обновляет оценки продуктов по нескольким заказам сразу.
+        Хранилища переопределяют метод, чтобы записать приросты
+        всех заказов одним пакетом.
+        Args:
+            orders (iterable): Списки id продуктов, по одному на заказ
+        Returns:
+            None
+        """
+        for product_ids in orders:
+            self.products_bought(product_ids)
+
+    def suggest_for(self, product_ids, max_results):
+        """
+        Возвращает id рекомендуемых продуктов, лучшие первыми.
+        При равных оценках первым идет продукт с большим id в строковом
+        сравнении, как в сортировке Redis.
+        Args:
+            product_ids (list): Id продуктов, для которых нужны рекомендации
+            max_results (int): Максимальное число рекомендаций
+        Returns:
+            list: Id рекомендуемых продуктов
+        """
+        raise NotImplementedError
+
+    def suggest_for_each(self, product_ids, max_results):
+        """
+        Возвращает рекомендации для каждого продукта отдельно.
+        Хранилища переопределяют метод, чтобы читать все списки
+        за один запрос.
+        Args:
+            product_ids (list): Id продуктов
+            max_results (int): Максимальное число рекомендаций на продукт
+        Returns:
+            dict: {id продукта: список id рекомендуемых продуктов}
+        """
+        return {
+            product_id: self.suggest_for([product_id], max_results)
+            for product_id in product_ids
+        }
+
+    def refresh_suggestions(self, product_ids):
+        """
+        Пересчитывает готовые списки рекомендаций заданных продуктов.
+        Args:
+            product_ids (iterable): Id продуктов
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    def load_purchases(self, scores, batch_size=500, mode=COUNT_MODE):
+        """
+        Заменяет все оценки заранее посчитанными и запоминает их режим.
+        Args:
+            scores (iterable): Пары (id продукта, {id соседа: оценка})
+            batch_size (int): Число продуктов в одной пачке записи
+            mode (str): Режим оценок: count, cosine или lift
+        Returns:
+            int: Число загруженных продуктов
+        """
+        raise NotImplementedError
+
+    def get_mode(self):
+        """
+        Возвращает режим оценок, загруженных load_purchases.
+        После clear_purchases и до первой загрузки - COUNT_MODE.
+        Returns:
+            str: Режим оценок
+        """
+        raise NotImplementedError
+
+    def trim_purchases(self, batch_size=500):
+        """
+        Применяет затухание оценок, удаляет соседей с оценкой ниже
+        RECOMMENDER_MIN_SCORE и оставляет не более
+        RECOMMENDER_MAX_NEIGHBOURS лучших соседей каждого продукта.
+        Args:
+            batch_size (int): Число продуктов в одной пачке записи
+        Returns:
+            int: Число обработанных продуктов
+        """
+        raise NotImplementedError
+
+    def clear_purchases(self):
+        """
+        Удаляет все оценки и возвращает режим COUNT_MODE.
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    def get_decayed_at(self):
+        """
+        Возвращает время прошлого затухания оценок.
+        Returns:
+            float: Время прошлого затухания (unix time) или None
+        """
+        raise NotImplementedError
+
+    def set_decayed_at(self, now):
+        """
+        Запоминает время затухания оценок. Вызывается только после того,
+        как оценки записаны целиком, иначе прерванное затухание
+        не повторится.
+        Args:
+            now (float): Время затухания (unix time)
+        Returns:
+            None
+        """
+        raise NotImplementedError
+
+    def get_decay_factor(self, now=None):
+        """
+        Возвращает множитель затухания оценок с прошлого затухания.
+        Время затухания не меняется, его записывает set_decayed_at.
+        Без RECOMMENDER_DECAY_HALF_LIFE оценки не затухают.
+        Args:
+            now (float, optional): Текущее время (unix time)
+        Returns:
+            float: Множитель оценок от 0 до 1
+        """
+        half_life = settings.RECOMMENDER_DECAY_HALF_LIFE
+        if not half_life:
+            return 1
+        now = time.time() if now is None else now
+        decayed_at = self.get_decayed_at()
+        if decayed_at is None:
+            return 1
+        elapsed = max(now - float(decayed_at), 0)
+        return 0.5 ** (elapsed / (half_life * 24 * 60 * 60))
+
+    def rank_key(self, item):
+        """
+        Ключ сортировки пары (id, оценка) по убыванию, общий для всех
+        хранилищ: сначала оценка, затем id в строковом сравнении.
+        Args:
+            item (tuple): Id продукта и оценка
+        Returns:
+            tuple: Ключ сортировки
+        """
+        return item[1], str(item[0])
+
+    def count_pairs(self, orders):
+        """
+        Складывает приросты оценок пар продуктов нескольких заказов.
+        Повторы продукта в заказе считаются одной покупкой.
+        Args:
+            orders (iterable): Списки id продуктов, по одному на заказ
+        Returns:
+            Counter: {(id продукта, id соседа): прирост}
+        """
+        increments = Counter()
+        for product_ids in orders:
+            product_ids = set(product_ids)
+            increments.update(
+                (product_id, with_id)
+                for product_id in product_ids
+                for with_id in product_ids
+                if product_id != with_id
+            )
+        return increments
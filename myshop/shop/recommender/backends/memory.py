@@ -0,0 +1,136 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .base import COUNT_MODE, BaseRecommenderBackend
+
+
+class MemoryRecommenderBackend(BaseRecommenderBackend):
+    """
+    Хранилище оценок в памяти процесса.
+
+    Оценки хранятся в словаре {id продукта: {id соседа: оценка}}, готовые
+    списки рекомендаций считаются через heapq.nlargest. Данные не переживают
+    перезапуск и не разделяются между процессами, поэтому хранилище
+    подходит для тестов и локального запуска без Redis.
+    """
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.scores = defaultdict(dict)
+        self.suggestions = {}
+        self.decayed_at = None
+        self.mode = COUNT_MODE
+        self.lock = threading.Lock()
+
+    def _refresh(self, product_ids):
+        """
+        Пересчитывает готовые списки рекомендаций, вызывается под блокировкой.
+        Args:
+            product_ids (iterable): Id продуктов
+        Returns:
+            None
+        """
+        for product_id in product_ids:
+            neighbours = self.scores.get(product_id)
+            if neighbours:
+                self.suggestions[product_id] = heapq.nlargest(
+                    settings.RECOMMENDER_TOP_N,
+                    neighbours.items(),
+                    key=self.rank_key,
+                )
+            else:
+                self.scores.pop(product_id, None)
+                self.suggestions.pop(product_id, None)
+
+    def products_bought(self, product_ids):
+        self.products_bought_many([product_ids])
+
+    def products_bought_many(self, orders):
+        increments = self.count_pairs(orders)
+        with self.lock:
+            for (product_id, with_id), amount in increments.items():
+                neighbours = self.scores[product_id]
+                neighbours[with_id] = neighbours.get(with_id, 0) + amount
+            self._refresh({product_id for product_id, _ in increments})
+
+    def suggest_for(self, product_ids, max_results):
+        exclude = set(product_ids)
+        totals = defaultdict(float)
+        for product_id in exclude:
+            for with_id, score in self.suggestions.get(product_id, []):
+                if with_id not in exclude:
+                    totals[with_id] += score
+        best = heapq.nlargest(max_results, totals.items(), key=self.rank_key)
+        return [with_id for with_id, _ in best]
+
+    def suggest_for_each(self, product_ids, max_results):
+        return {
+            product_id: [
+                with_id
+                for with_id, _ in self.suggestions.get(product_id, [])[
+                    :max_results
+                ]
+            ]
+            for product_id in product_ids
+        }
+
+    def refresh_suggestions(self, product_ids):
+        with self.lock:
+            self._refresh([int(id) for id in product_ids])
+
+    def load_purchases(self, scores, batch_size=500, mode=COUNT_MODE):
+        loaded = 0
+        with self.lock:
+            self.scores.clear()
+            self.suggestions.clear()
+            for product_id, neighbours in scores:
+                if neighbours:
+                    self.scores[int(product_id)] = {
+                        int(id): score for id, score in neighbours.items()
+                    }
+                    loaded += 1
+            self._refresh(list(self.scores))
+            self.mode = mode
+        self.set_decayed_at(time.time())
+        return loaded
+
+    def get_mode(self):
+        return self.mode
+
+    def get_decayed_at(self):
+        return self.decayed_at
+
+    def set_decayed_at(self, now):
+        self.decayed_at = now
+
+    def trim_purchases(self, batch_size=500):
+        now = time.time()
+        factor = self.get_decay_factor(now)
+        max_neighbours = settings.RECOMMENDER_MAX_NEIGHBOURS
+        min_score = settings.RECOMMENDER_MIN_SCORE
+        with self.lock:
+            for product_id, neighbours in self.scores.items():
+                kept = [
+                    (id, score * factor)
+                    for id, score in neighbours.items()
+                    if score * factor >= min_score
+                ]
+                if max_neighbours:
+                    kept = heapq.nlargest(
+                        max_neighbours, kept, key=self.rank_key
+                    )
+                self.scores[product_id] = dict(kept)
+            trimmed = len(self.scores)
+            self._refresh(list(self.scores))
+        self.set_decayed_at(now)
+        return trimmed
+
+    def clear_purchases(self):
+        with self.lock:
+            self.scores.clear()
+            self.suggestions.clear()
+            self.mode = COUNT_MODE
@@ -0,0 +1,400 @@
+import time
+
+import redis
+from django.conf import settings
+
+from myshop.redis_pool import get_redis
+from .base import COUNT_MODE, BaseRecommenderBackend
+
+
+# время последнего затухания оценок (unix time)
+DECAYED_AT_KEY = 'recommender:decayed_at'
+# время затухания оценок каждого продукта, {id продукта: unix time};
+# продукт без поля затухает с DECAYED_AT_KEY
+PRODUCT_DECAYED_AT_KEY = 'recommender:decayed_at:products'
+# режим загруженных оценок, без ключа - COUNT_MODE
+MODE_KEY = 'recommender:mode'
+# префикс ключей, в которые load_purchases загружает оценки
+# до их подмены
+STAGING_PREFIX = 'staging:'
+
+# Lua-скрипт пересчета готового списка рекомендаций продукта.
+# KEYS[1] - отсортированный набор покупок, KEYS[2] - список рекомендаций,
+# ARGV[1] - длина списка. Элементы списка хранятся как "id:оценка".
+REFRESH_SUGGESTIONS_SCRIPT = """
+local items = redis.call(
+    'ZREVRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1, 'WITHSCORES'
+)
+redis.call('DEL', KEYS[2])
+if #items == 0 then
+    return 0
+end
+local entries = {}
+for i = 1, #items, 2 do
+    table.insert(entries, items[i] .. ':' .. items[i + 1])
+end
+return redis.call('RPUSH', KEYS[2], unpack(entries))
+"""
+
+# Lua-скрипт затухания и обрезки оценок одного продукта. Время затухания
+# продукта записывается вместе с оценками, поэтому повторный запуск после
+# сбоя не применит затухание к продукту дважды.
+# KEYS[1] - отсортированный набор покупок, KEYS[2] - хеш времени затухания
+# продуктов, ARGV[1] - id продукта, ARGV[2] - текущее время,
+# ARGV[3] - период полураспада в секундах (0 - без затухания),
+# ARGV[4] - время затухания по умолчанию или пустая строка,
+# ARGV[5] - минимальная оценка, ARGV[6] - число соседей (0 - без ограничения).
+TRIM_SCRIPT = """
+local half_life = tonumber(ARGV[3])
+local since = redis.call('HGET', KEYS[2], ARGV[1]) or ARGV[4]
+if half_life > 0 and since ~= '' then
+    local elapsed = math.max(tonumber(ARGV[2]) - tonumber(since), 0)
+    local factor = 0.5 ^ (elapsed / half_life)
+    if factor < 1 then
+        redis.call('ZUNIONSTORE', KEYS[1], 1, KEYS[1], 'WEIGHTS', factor)
+    end
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[5])
+local max_neighbours = tonumber(ARGV[6])
+if max_neighbours > 0 then
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -(max_neighbours + 1))
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+else
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return 1
+"""
+
+# Lua-скрипт объединения оценок нескольких продуктов на стороне сервера.
+# KEYS - ключи списков рекомендаций, ARGV[1] - число результатов,
+# ARGV[2..] - id продуктов, которые нужно исключить из результата.
+# Возвращает только top-K id, не создавая временных ключей.
+SUGGEST_FOR_MANY_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local exclude = {}
+for i = 2, #ARGV do
+    exclude[ARGV[i]] = true
+end
+local scores = {}
+local ids = {}
+for _, key in ipairs(KEYS) do
+    local entries = redis.call('LRANGE', key, 0, -1)
+    for _, entry in ipairs(entries) do
+        local sep = string.find(entry, ':', 1, true)
+        local id = string.sub(entry, 1, sep - 1)
+        if not exclude[id] then
+            if scores[id] == nil then
+                scores[id] = 0
+                table.insert(ids, id)
+            end
+            scores[id] = scores[id] + tonumber(string.sub(entry, sep + 1))
+        end
+    end
+end
+table.sort(ids, function(a, b)
+    if scores[a] == scores[b] then
+        return a > b
+    end
+    return scores[a] > scores[b]
+end)
+local result = {}
+for i = 1, math.min(limit, #ids) do
+    result[i] = ids[i]
+end
+return result
+"""
+
+
+class RedisRecommenderBackend(BaseRecommenderBackend):
+    """
+    Хранилище оценок в Redis.
+
+    Для каждого продукта хранится отсортированный набор покупок
+    product:<id>:purchased_with и готовый список из RECOMMENDER_TOP_N
+    лучших соседей product:<id>:suggestions, поэтому страница продукта
+    читает один короткий список независимо от популярности продукта.
+    Options:
+        host, port, db: Параметры подключения, по умолчанию REDIS_*
+
+    Загрузка, затухание и удаление оценок идут через отдельный клиент
+    с таймаутом REDIS_MAINTENANCE_SOCKET_TIMEOUT: пакет из сотен команд
+    не укладывается в короткий таймаут запросов страниц.
+    """
+    errors = (redis.RedisError,)
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        # подключение к redis через общий пул с таймаутами
+        self.client = get_redis(
+            host=options.get('host'),
+            port=options.get('port'),
+            db=options.get('db'),
+        )
+        # клиент обслуживания для пакетной записи вне запросов
+        self.maintenance_client = get_redis(
+            host=options.get('host'),
+            port=options.get('port'),
+            db=options.get('db'),
+            socket_timeout=settings.REDIS_MAINTENANCE_SOCKET_TIMEOUT,
+        )
+        self.refresh_script = self.client.register_script(
+            REFRESH_SUGGESTIONS_SCRIPT
+        )
+        self.suggest_script = self.client.register_script(
+            SUGGEST_FOR_MANY_SCRIPT
+        )
+        self.trim_script = self.client.register_script(TRIM_SCRIPT)
+        self.scripts_loaded = False
+
+    def get_product_key(self, id):
+        """
+        Возвращает ключ для хранения данных о покупках продукта с заданным id.
+        Args:
+            id (int): Id продукта
+        Returns:
+            str: Ключ для хранения данных о покупках продукта
+        """
+        return f'product:{id}:purchased_with'
+
+    def get_suggestions_key(self, id):
+        """
+        Возвращает ключ готового списка рекомендаций продукта.
+        Args:
+            id (int): Id продукта
+        Returns:
+            str: Ключ списка рекомендаций продукта
+        """
+        return f'product:{id}:suggestions'
+
+    def _refresh(self, pipe, product_ids, prefix=''):
+        """
+        Добавляет в пакет пересчет списков рекомендаций заданных продуктов.
+        Args:
+            pipe (Pipeline): Пакет команд redis
+            product_ids (iterable): Id продуктов
+            prefix (str): Префикс ключей, STAGING_PREFIX при загрузке
+        Returns:
+            None
+        """
+        for product_id in product_ids:
+            self.refresh_script(
+                keys=[
+                    prefix + self.get_product_key(product_id),
+                    prefix + self.get_suggestions_key(product_id),
+                ],
+                args=[settings.RECOMMENDER_TOP_N],
+                client=pipe,
+            )
+
+    def products_bought(self, product_ids):
+        self.products_bought_many([product_ids])
+
+    def products_bought_many(self, orders):
+        if not self.scripts_loaded:
+            # загрузить скрипт один раз на процесс
+            self.client.script_load(REFRESH_SUGGESTIONS_SCRIPT)
+            self.scripts_loaded = True
+        # приросты всех заказов складываются заранее, на каждую пару
+        # отправляется один ZINCRBY, а весь пакет стоит один round trip
+        # вместо n * (n - 1) на заказ
+        increments = self.count_pairs(orders)
+        refreshed = {product_id for product_id, _ in increments}
+        with self.client.pipeline(transaction=False) as pipe:
+            for (product_id, with_id), amount in increments.items():
+                pipe.zincrby(
+                    self.get_product_key(product_id), amount, with_id
+                )
+            # пересчитать только списки продуктов из этих заказов,
+            # EVALSHA без предварительного SCRIPT EXISTS сохраняет
+            # пакету ровно один round trip
+            for product_id in refreshed:
+                pipe.evalsha(
+                    self.refresh_script.sha,
+                    2,
+                    self.get_product_key(product_id),
+                    self.get_suggestions_key(product_id),
+                    settings.RECOMMENDER_TOP_N,
+                )
+            results = pipe.execute(raise_on_error=False)
+        errors = [result for result in results if isinstance(result, Exception)]
+        for error in errors:
+            if not isinstance(error, redis.exceptions.NoScriptError):
+                raise error
+        if errors:
+            # сервер не знает скрипт (перезапуск или SCRIPT FLUSH),
+            # списки пересчитываются с его загрузкой
+            self.refresh_suggestions(refreshed)
+
+    def suggest_for(self, product_ids, max_results):
+        if len(product_ids) == 1:
+            # только 1 продукт, прочитать начало готового списка
+            entries = self.client.lrange(
+                self.get_suggestions_key(product_ids[0]),
+                0,
+                max_results - 1,
+            )
+            suggestions = [entry.split(b':')[0] for entry in entries]
+        else:
+            # несколько продуктов, готовые списки объединяются скриптом
+            # на сервере за один вызов и без общего временного ключа,
+            # исходные продукты исключаются из результата
+            keys = [self.get_suggestions_key(id) for id in product_ids]
+            suggestions = self.suggest_script(
+                keys=keys, args=[max_results, *product_ids]
+            )
+        return [int(id) for id in suggestions]
+
+    def suggest_for_each(self, product_ids, max_results):
+        # начала готовых списков всех продуктов читаются одним пакетом
+        with self.client.pipeline(transaction=False) as pipe:
+            for product_id in product_ids:
+                pipe.lrange(
+                    self.get_suggestions_key(product_id), 0, max_results - 1
+                )
+            results = pipe.execute()
+        return {
+            product_id: [int(entry.split(b':')[0]) for entry in entries]
+            for product_id, entries in zip(product_ids, results)
+        }
+
+    def refresh_suggestions(self, product_ids):
+        with self.client.pipeline(transaction=False) as pipe:
+            self._refresh(pipe, product_ids)
+            pipe.execute()
+
+    def load_purchases(self, scores, batch_size=500, mode=COUNT_MODE):
+        # оценки загружаются в ключи с префиксом STAGING_PREFIX пакетами
+        # по batch_size продуктов за round trip, списки рекомендаций
+        # пересчитываются в тех же пакетах; рабочие ключи подменяются
+        # одной транзакцией, поэтому до нее читатели видят старые оценки,
+        # а сбой загрузки их не трогает
+        self._unlink_keys(STAGING_PREFIX + self.get_product_key('*'))
+        self._unlink_keys(STAGING_PREFIX + self.get_suggestions_key('*'))
+        loaded = []
+        now = time.time()
+        pipe = self.maintenance_client.pipeline(transaction=False)
+        for product_id, neighbours in scores:
+            if neighbours:
+                pipe.zadd(
+                    STAGING_PREFIX + self.get_product_key(product_id),
+                    neighbours,
+                )
+                self._refresh(pipe, [product_id], prefix=STAGING_PREFIX)
+                loaded.append(product_id)
+            if len(pipe) >= batch_size * 2:
+                pipe.execute()
+        pipe.execute()
+        self._swap_staging(loaded, now, mode)
+        return len(loaded)
+
+    def get_mode(self):
+        mode = self.client.get(MODE_KEY)
+        return mode.decode() if mode else COUNT_MODE
+
+    def _swap_staging(self, product_ids, now, mode):
+        """
+        Подменяет рабочие ключи загруженными одной транзакцией MULTI/EXEC.
+        Ключи продуктов, которых нет среди загруженных, удаляются.
+        Args:
+            product_ids (list): Id загруженных продуктов
+            now (float): Время загрузки (unix time)
+            mode (str): Режим загруженных оценок
+        Returns:
+            None
+        """
+        keys = {
+            key
+            for product_id in product_ids
+            for key in (
+                self.get_product_key(product_id),
+                self.get_suggestions_key(product_id),
+            )
+        }
+        stale = [
+            key
+            for pattern in (
+                self.get_product_key('*'),
+                self.get_suggestions_key('*'),
+            )
+            for key in self.maintenance_client.scan_iter(
+                match=pattern, count=1000
+            )
+            if key.decode() not in keys
+        ]
+        with self.maintenance_client.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.rename(STAGING_PREFIX + key, key)
+            if stale:
+                pipe.unlink(*stale)
+            # загруженные оценки уже учитывают возраст заказов
+            pipe.unlink(PRODUCT_DECAYED_AT_KEY)
+            pipe.set(DECAYED_AT_KEY, now)
+            pipe.set(MODE_KEY, mode)
+            pipe.execute()
+
+    def get_decayed_at(self):
+        return self.client.get(DECAYED_AT_KEY)
+
+    def set_decayed_at(self, now):
+        self.client.set(DECAYED_AT_KEY, now)
+
+    def trim_purchases(self, batch_size=500):
+        # затухание считается скриптом для каждого продукта от его
+        # собственного времени затухания, которое скрипт записывает
+        # вместе с оценками: после сбоя на середине повторный запуск
+        # не затухает уже обработанные продукты повторно
+        now = time.time()
+        half_life = settings.RECOMMENDER_DECAY_HALF_LIFE or 0
+        decayed_at = self.get_decayed_at()
+        args = [
+            now,
+            half_life * 24 * 60 * 60,
+            '' if decayed_at is None else decayed_at,
+            settings.RECOMMENDER_MIN_SCORE,
+            settings.RECOMMENDER_MAX_NEIGHBOURS or 0,
+        ]
+        trimmed = 0
+        # SCAN может вернуть ключ повторно
+        keys = set(
+            self.maintenance_client.scan_iter(
+                match=self.get_product_key('*'), count=1000
+            )
+        )
+        pipe = self.maintenance_client.pipeline(transaction=False)
+        for key in keys:
+            product_id = key.decode().split(':')[1]
+            self.trim_script(
+                keys=[key, PRODUCT_DECAYED_AT_KEY],
+                args=[product_id, *args],
+                client=pipe,
+            )
+            self._refresh(pipe, [product_id])
+            trimmed += 1
+            if trimmed % batch_size == 0:
+                pipe.execute()
+        pipe.execute()
+        # время по умолчанию для продуктов, появившихся после затухания
+        self.set_decayed_at(now)
+        return trimmed
+
+    def _unlink_keys(self, pattern):
+        """
+        Удаляет ключи по шаблону пакетами, а не отдельным DELETE на ключ.
+        Args:
+            pattern (str): Шаблон ключей для SCAN
+        Returns:
+            None
+        """
+        with self.maintenance_client.pipeline(transaction=False) as pipe:
+            for key in self.maintenance_client.scan_iter(
+                match=pattern, count=1000
+            ):
+                pipe.unlink(key)
+            pipe.execute()
+
+    def clear_purchases(self):
+        self._unlink_keys(self.get_product_key('*'))
+        self._unlink_keys(self.get_suggestions_key('*'))
+        self.maintenance_client.unlink(PRODUCT_DECAYED_AT_KEY, MODE_KEY)
@@ -0,0 +1,213 @@
+import sqlite3
+import threading
+import time
+from itertools import islice
+
+from django.conf import settings
+
+from .base import COUNT_MODE, BaseRecommenderBackend
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS purchased_with (
+    product_id INTEGER NOT NULL,
+    with_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (product_id, with_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS purchased_with_rank
+    ON purchased_with (product_id, score DESC, with_id);
+CREATE TABLE IF NOT EXISTS recommender_state (
+    name TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+# лучшие RECOMMENDER_TOP_N соседей каждого продукта в порядке ранга,
+# тот же порядок, что у готовых списков в Redis
+RANKED = """
+SELECT product_id, with_id, score, ROW_NUMBER() OVER (
+    PARTITION BY product_id
+    ORDER BY score DESC, CAST(with_id AS TEXT) DESC
+) AS rank
+FROM purchased_with
+"""
+
+
+class SQLiteRecommenderBackend(BaseRecommenderBackend):
+    """
+    Хранилище оценок в файле SQLite.
+
+    Оценки лежат в таблице purchased_with, индекс по (product_id, score)
+    играет роль готового списка рекомендаций: top-N продукта читается
+    коротким проходом по индексу. Подходит для небольших установок
+    без Redis.
+    Options:
+        NAME: Путь к файлу базы, по умолчанию BASE_DIR / 'recommender.sqlite3'
+    """
+    errors = (sqlite3.Error,)
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.name = str(
+            options.get('NAME', settings.BASE_DIR / 'recommender.sqlite3')
+        )
+        # у каждого потока свое подключение
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        """
+        Возвращает подключение текущего потока, создавая схему при первом
+        подключении.
+        Returns:
+            sqlite3.Connection: Подключение к базе
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.name, timeout=5)
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+        return connection
+
+    def products_bought(self, product_ids):
+        self.products_bought_many([product_ids])
+
+    def products_bought_many(self, orders):
+        increments = self.count_pairs(orders)
+        with self.connection as connection:
+            connection.executemany(
+                'INSERT INTO purchased_with (product_id, with_id, score) '
+                'VALUES (?, ?, ?) '
+                'ON CONFLICT (product_id, with_id) '
+                'DO UPDATE SET score = score + excluded.score',
+                [
+                    (product_id, with_id, amount)
+                    for (product_id, with_id), amount in increments.items()
+                ],
+            )
+
+    def suggest_for(self, product_ids, max_results):
+        if not product_ids:
+            return []
+        placeholders = ', '.join('?' * len(product_ids))
+        rows = self.connection.execute(
+            f'SELECT with_id FROM ({RANKED} '
+            f'WHERE product_id IN ({placeholders})) '
+            f'WHERE rank <= ? AND with_id NOT IN ({placeholders}) '
+            'GROUP BY with_id '
+            'ORDER BY SUM(score) DESC, CAST(with_id AS TEXT) DESC '
+            'LIMIT ?',
+            [
+                *product_ids,
+                settings.RECOMMENDER_TOP_N,
+                *product_ids,
+                max_results,
+            ],
+        )
+        return [with_id for with_id, in rows]
+
+    def suggest_for_each(self, product_ids, max_results):
+        suggestions = {product_id: [] for product_id in product_ids}
+        if not product_ids:
+            return suggestions
+        placeholders = ', '.join('?' * len(product_ids))
+        # ранг считается сразу для всех продуктов одним запросом
+        rows = self.connection.execute(
+            f'SELECT product_id, with_id FROM ({RANKED} '
+            f'WHERE product_id IN ({placeholders})) '
+            'WHERE rank <= ? ORDER BY product_id, rank',
+            [
+                *product_ids,
+                min(max_results, settings.RECOMMENDER_TOP_N),
+            ],
+        )
+        for product_id, with_id in rows:
+            suggestions[product_id].append(with_id)
+        return suggestions
+
+    def refresh_suggestions(self, product_ids):
+        # списки рекомендаций - это индекс, он всегда актуален
+        pass
+
+    def load_purchases(self, scores, batch_size=500, mode=COUNT_MODE):
+        rows = (
+            (int(product_id), int(with_id), score)
+            for product_id, neighbours in scores
+            for with_id, score in neighbours.items()
+        )
+        loaded = set()
+        with self.connection as connection:
+            connection.execute('DELETE FROM purchased_with')
+            while batch := list(islice(rows, batch_size)):
+                connection.executemany(
+                    'INSERT INTO purchased_with (product_id, with_id, score) '
+                    'VALUES (?, ?, ?)',
+                    batch,
+                )
+                loaded.update(product_id for product_id, _, _ in batch)
+            self._set_decayed_at(connection, time.time())
+            connection.execute(
+                'INSERT OR REPLACE INTO recommender_state (name, value) '
+                "VALUES ('mode', ?)",
+                [mode],
+            )
+        return len(loaded)
+
+    def get_mode(self):
+        row = self.connection.execute(
+            "SELECT value FROM recommender_state WHERE name = 'mode'"
+        ).fetchone()
+        return row[0] if row else COUNT_MODE
+
+    def get_decayed_at(self):
+        row = self.connection.execute(
+            "SELECT value FROM recommender_state WHERE name = 'decayed_at'"
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_decayed_at(self, now):
+        with self.connection as connection:
+            self._set_decayed_at(connection, now)
+
+    def _set_decayed_at(self, connection, now):
+        connection.execute(
+            'INSERT OR REPLACE INTO recommender_state (name, value) '
+            "VALUES ('decayed_at', ?)",
+            [now],
+        )
+
+    def trim_purchases(self, batch_size=500):
+        now = time.time()
+        factor = self.get_decay_factor(now)
+        max_neighbours = settings.RECOMMENDER_MAX_NEIGHBOURS
+        with self.connection as connection:
+            if factor < 1:
+                connection.execute(
+                    'UPDATE purchased_with SET score = score * ?', [factor]
+                )
+            connection.execute(
+                'DELETE FROM purchased_with WHERE score < ?',
+                [settings.RECOMMENDER_MIN_SCORE],
+            )
+            if max_neighbours:
+                connection.execute(
+                    'DELETE FROM purchased_with '
+                    'WHERE (product_id, with_id) IN ('
+                    f'SELECT product_id, with_id FROM ({RANKED}) '
+                    'WHERE rank > ?)',
+                    [max_neighbours],
+                )
+            trimmed, = connection.execute(
+                'SELECT COUNT(DISTINCT product_id) FROM purchased_with'
+            ).fetchone()
+            # в той же транзакции, что и затухание оценок
+            self._set_decayed_at(connection, now)
+        return trimmed
+
+    def clear_purchases(self):
+        with self.connection as connection:
+            connection.execute('DELETE FROM purchased_with')
+            connection.execute(
+                "DELETE FROM recommender_state WHERE name = 'mode'"
+            )
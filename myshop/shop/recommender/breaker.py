@@ -0,0 +1,119 @@
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+
+# метрики рекомендаций
+REQUESTS = Counter(
+    'recommender_requests_total',
+    'Recommender backend calls by operation and outcome.',
+    ['operation', 'outcome'],
+)
+LATENCY = Histogram(
+    'recommender_latency_seconds',
+    'Recommender backend call latency.',
+    ['operation'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+BREAKER_STATE = Gauge(
+    'recommender_circuit_state',
+    'Circuit breaker state: 0 closed, 1 open, 2 half-open.',
+    ['backend'],
+)
+
+
+class CircuitOpenError(Exception):
+    """
+    Вызов отклонен, потому что предохранитель разомкнут.
+    """
+
+
+class CircuitBreaker:
+    """
+    Предохранитель вызовов хранилища рекомендаций.
+
+    После failure_threshold ошибок подряд предохранитель размыкается и
+    сразу отклоняет вызовы. Через reset_timeout секунд пропускается один
+    пробный вызов: успех замыкает предохранитель, ошибка снова размыкает.
+    Attributes:
+        name (str): Имя для метрик
+        failure_threshold (int): Число ошибок подряд до размыкания
+        reset_timeout (float): Время до пробного вызова в секундах
+    """
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.state = self.CLOSED
+        self.lock = threading.Lock()
+        BREAKER_STATE.labels(name).set(self.state)
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(state)
+
+    def allow(self):
+        """
+        Проверяет, можно ли выполнить вызов.
+        Returns:
+            bool: True, если вызов разрешен
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if (
+                self.state == self.OPEN
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                # пропустить один пробный вызов
+                self._set_state(self.HALF_OPEN)
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state != self.CLOSED:
+                self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if (
+                self.state == self.HALF_OPEN
+                or self.failures >= self.failure_threshold
+            ):
+                self.opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def call(self, func, *args, errors=(Exception,)):
+        """
+        Вызывает func через предохранитель.
+        Args:
+            func (callable): Вызываемая функция
+            errors (tuple): Исключения, которые считаются отказом хранилища
+        Returns:
+            Результат func
+        Raises:
+            CircuitOpenError: Предохранитель разомкнут
+        """
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+        try:
+            result = func(*args)
+        except errors:
+            self.record_failure()
+            raise
+        except Exception:
+            # хранилище ответило, ошибка не в подключении
+            self.record_success()
+            raise
+        self.record_success()
+        return result
@@ -0,0 +1,60 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+
+from orders.models import Order, OrderItem
+from .recommender import Recommender
+from .recommender.breaker import CircuitOpenError
+
+
+@shared_task
+def trim_recommendations():
+    """
+    Периодическая задача затухания и обрезки оценок совместных покупок.
+    """
+    return Recommender().trim_purchases()
+
+
+@shared_task
+def ingest_purchases(batch_size=None):
+    """
+    Периодическая задача учета оплаченных заказов в рекомендациях.
+
+    Очередь - оплаченные заказы с recommendations_synced=False. Заказы
+    берутся пачками по RECOMMENDER_INGEST_BATCH_SIZE, приросты оценок
+    всей пачки записываются в хранилище одним пакетом, после чего заказы
+    помечаются учтенными. Если хранилище недоступно, заказы остаются
+    в очереди до следующего запуска.
+    Args:
+        batch_size (int, optional): Число заказов в одной пачке
+    Returns:
+        int: Число учтенных заказов
+    """
+    batch_size = batch_size or settings.RECOMMENDER_INGEST_BATCH_SIZE
+    recommender = Recommender()
+    ingested = 0
+    while True:
+        with transaction.atomic():
+            # параллельные задачи пропускают заказы, занятые другой задачей
+            order_ids = list(
+                Order.objects.select_for_update(skip_locked=True)
+                .filter(paid=True, recommendations_synced=False)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not order_ids:
+                return ingested
+            orders = {order_id: [] for order_id in order_ids}
+            items = OrderItem.objects.filter(
+                order_id__in=order_ids
+            ).values_list('order_id', 'product_id')
+            for order_id, product_id in items:
+                orders[order_id].append(product_id)
+            try:
+                recommender.products_bought_many(orders.values())
+            except (CircuitOpenError, *recommender.backend.errors):
+                return ingested
+            Order.objects.filter(id__in=order_ids).update(
+                recommendations_synced=True
+            )
+        ingested += len(order_ids)
@@ -1,3 +1,488 @@
-from django.test import TestCase
+import tempfile
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import redis
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from orders.models import Order, OrderItem
+
+from .management.commands.rebuild_recommendations import (
+    Command as RebuildCommand,
+)
+from .models import Category, Product
+from .recommender import Recommender
+from .recommender.breaker import CircuitBreaker
+from .recommender.backends.memory import MemoryRecommenderBackend
+from .recommender.backends.redis import RedisRecommenderBackend
+from .recommender.backends.sqlite import SQLiteRecommenderBackend
+from .tasks import ingest_purchases
+
+
+class RecommenderBackendTests:
+    """
+    Общие тесты, которые должно проходить каждое хранилище оценок.
+    """
+
+    def get_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.backend = self.get_backend()
+        self.backend.clear_purchases()
+        self.addCleanup(self.backend.clear_purchases)
+
+    def buy(self, *orders):
+        for product_ids in orders:
+            self.backend.products_bought(list(product_ids))
+
+    def test_suggest_for_one_product(self):
+        self.buy([1, 2, 3], [1, 3], [3, 4])
+        self.assertEqual(self.backend.suggest_for([1], 5), [3, 2])
+        # при равных оценках первым идет больший id в строковом сравнении
+        self.assertEqual(self.backend.suggest_for([3], 5), [1, 4, 2])
+
+    def test_max_results(self):
+        self.buy([1, 2, 3], [1, 3], [3, 4])
+        self.assertEqual(self.backend.suggest_for([3], 1), [1])
+
+    def test_suggest_for_many_products_sums_scores(self):
+        self.buy([1, 2, 3], [1, 3], [2, 4], [2, 4])
+        self.assertEqual(self.backend.suggest_for([1, 2], 5), [3, 4])
+
+    def test_products_bought_many_coalesces_orders(self):
+        self.backend.products_bought_many([[1, 2, 3], [1, 3], [3, 4, 4]])
+        self.assertEqual(self.backend.suggest_for([1], 5), [3, 2])
+        self.assertEqual(self.backend.suggest_for([3], 5), [1, 4, 2])
+
+    def test_suggest_for_each_product(self):
+        self.buy([1, 2, 3], [1, 3], [3, 4])
+        self.assertEqual(
+            self.backend.suggest_for_each([1, 3, 9], 2),
+            {1: [3, 2], 3: [1, 4], 9: []},
+        )
+
+    def test_unknown_product(self):
+        self.buy([1, 2])
+        self.assertEqual(self.backend.suggest_for([9], 5), [])
+        self.assertEqual(self.backend.suggest_for([8, 9], 5), [])
+
+    @override_settings(RECOMMENDER_TOP_N=1)
+    def test_suggestions_use_top_n_neighbours(self):
+        self.backend.load_purchases([(1, {2: 5, 3: 4}), (4, {3: 2})])
+        self.assertEqual(self.backend.suggest_for([1, 4], 5), [2, 3])
+
+    def test_load_purchases_replaces_scores(self):
+        self.buy([3, 4])
+        loaded = self.backend.load_purchases(
+            [(1, {2: 0.5, 3: 1.5}), (2, {1: 0.5}), (5, {})]
+        )
+        self.assertEqual(loaded, 2)
+        self.assertEqual(self.backend.suggest_for([1], 5), [3, 2])
+        self.assertEqual(self.backend.suggest_for([3], 5), [])
+
+    @override_settings(RECOMMENDER_MAX_NEIGHBOURS=1)
+    def test_trim_keeps_best_neighbours(self):
+        self.buy([1, 2], [1, 2], [1, 3])
+        self.backend.trim_purchases()
+        self.assertEqual(self.backend.suggest_for([1], 5), [2])
+
+    @override_settings(
+        RECOMMENDER_DECAY_HALF_LIFE=1, RECOMMENDER_MIN_SCORE=0.3
+    )
+    def test_trim_decays_scores(self):
+        self.backend.load_purchases([(1, {2: 1, 3: 0.5})])
+        self.backend.set_decayed_at(time.time() - 24 * 60 * 60)
+        self.backend.trim_purchases()
+        # 1 -> 0.5 остается, 0.5 -> 0.25 ниже порога
+        self.assertEqual(self.backend.suggest_for([1], 5), [2])
+
+    def test_clear_purchases(self):
+        self.buy([1, 2])
+        self.backend.clear_purchases()
+        self.assertEqual(self.backend.suggest_for([1], 5), [])
+
+    def test_load_purchases_keeps_mode(self):
+        self.assertEqual(self.backend.get_mode(), 'count')
+        self.backend.load_purchases([(1, {2: 0.5})], mode='cosine')
+        self.assertEqual(self.backend.get_mode(), 'cosine')
+        self.backend.clear_purchases()
+        self.assertEqual(self.backend.get_mode(), 'count')
+
+
+class MemoryRecommenderBackendTests(RecommenderBackendTests, SimpleTestCase):
+
+    def get_backend(self):
+        return MemoryRecommenderBackend()
+
+
+class SQLiteRecommenderBackendTests(RecommenderBackendTests, SimpleTestCase):
+
+    def get_backend(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return SQLiteRecommenderBackend(NAME=f'{directory.name}/test.sqlite3')
+
+
+class RedisRecommenderBackendTests(RecommenderBackendTests, SimpleTestCase):
+    # отдельная база redis, чтобы не трогать рабочие данные
+    redis_db = 15
+
+    def get_backend(self):
+        backend = RedisRecommenderBackend(db=self.redis_db)
+        try:
+            backend.client.ping()
+        except redis.ConnectionError:
+            self.skipTest(
+                f'Redis is not available at '
+                f'{settings.REDIS_HOST}:{settings.REDIS_PORT}'
+            )
+        return backend
+
+    def test_maintenance_uses_longer_timeout(self):
+        options = (
+            self.backend.maintenance_client.connection_pool.connection_kwargs
+        )
+        self.assertEqual(
+            options['socket_timeout'],
+            settings.REDIS_MAINTENANCE_SOCKET_TIMEOUT,
+        )
+        self.assertEqual(
+            self.backend.client.connection_pool.connection_kwargs[
+                'socket_timeout'
+            ],
+            settings.REDIS_SOCKET_TIMEOUT,
+        )
+
+    @override_settings(RECOMMENDER_DECAY_HALF_LIFE=1)
+    def test_trim_retried_after_failure_decays_once(self):
+        self.backend.load_purchases([(1, {2: 1}), (2, {1: 1})])
+        self.backend.set_decayed_at(time.time() - 24 * 60 * 60)
+        execute = redis.client.Pipeline.execute
+        calls = []
+
+        def fail_second_batch(pipe, *args, **kwargs):
+            calls.append(pipe)
+            if len(calls) == 2:
+                raise redis.TimeoutError
+            return execute(pipe, *args, **kwargs)
+
+        with mock.patch.object(
+            redis.client.Pipeline, 'execute', fail_second_batch
+        ):
+            with self.assertRaises(redis.TimeoutError):
+                self.backend.trim_purchases(batch_size=1)
+        self.backend.trim_purchases()
+        # продукт, обработанный до сбоя, затух один раз, а не дважды
+        for product_id, with_id in [(1, 2), (2, 1)]:
+            self.assertAlmostEqual(
+                self.backend.client.zscore(
+                    self.backend.get_product_key(product_id), with_id
+                ),
+                0.5,
+                places=3,
+            )
+
+    def test_failed_load_keeps_scores(self):
+        self.backend.load_purchases([(1, {2: 1})])
+
+        def scores():
+            yield 1, {3: 1}
+            raise redis.TimeoutError
+
+        with self.assertRaises(redis.TimeoutError):
+            self.backend.load_purchases(scores(), batch_size=1)
+        self.assertEqual(self.backend.suggest_for([1], 5), [2])
+
+    def test_load_removes_products_not_loaded(self):
+        self.backend.load_purchases([(1, {2: 1}), (2, {1: 1})])
+        self.backend.load_purchases([(1, {3: 1})])
+        self.assertEqual(self.backend.suggest_for([1], 5), [3])
+        self.assertEqual(self.backend.suggest_for([2], 5), [])
+        self.assertEqual(
+            list(self.backend.client.scan_iter(match='staging:*')), []
+        )
+
+
+@override_settings(
+    RECOMMENDER_BACKEND=(
+        'shop.recommender.backends.memory.MemoryRecommenderBackend'
+    )
+)
+class RecommenderTests(TestCase):
+
+    def setUp(self):
+        # хранилище в памяти общее для всех тестов класса
+        Recommender().clear_purchases()
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.products = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('10.00'),
+            )
+            for i in range(4)
+        ]
+
+    def test_suggest_products_for_returns_products_in_rank_order(self):
+        recommender = Recommender()
+        first, second, third, fourth = self.products
+        recommender.products_bought([first, second, third])
+        recommender.products_bought([first, third])
+        recommender.products_bought([first, fourth])
+        recommender.products_bought([first, fourth])
+        recommender.products_bought([first, fourth])
+        self.assertEqual(
+            recommender.suggest_products_for([first], 3),
+            [fourth, third, second],
+        )
+        self.assertEqual(
+            recommender.suggest_products_for([first, second], 3),
+            [fourth, third],
+        )
+
+    def test_suggest_products_for_each_uses_one_query(self):
+        recommender = Recommender()
+        first, second, third, fourth = self.products
+        recommender.products_bought([first, second, third])
+        recommender.products_bought([first, third])
+        with self.assertNumQueries(1):
+            suggestions = recommender.suggest_products_for_each(
+                [first, second, fourth], 2
+            )
+        self.assertEqual(
+            suggestions,
+            {
+                first.id: [third, second],
+                second.id: [third, first],
+                fourth.id: [],
+            },
+        )
+
+
+class FailingBackend(MemoryRecommenderBackend):
+    errors = (ConnectionError,)
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.calls = 0
+        self.failing = False
+
+    def suggest_for(self, product_ids, max_results):
+        self.calls += 1
+        if self.failing:
+            raise ConnectionError('backend is down')
+        return super().suggest_for(product_ids, max_results)
+
+    def products_bought(self, product_ids):
+        if self.failing:
+            raise ConnectionError('backend is down')
+        super().products_bought(product_ids)
+
+
+@override_settings(
+    RECOMMENDER_BREAKER_THRESHOLD=2,
+    RECOMMENDER_BREAKER_RESET_TIMEOUT=60,
+)
+class RecommenderResilienceTests(TestCase):
+
+    def setUp(self):
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.first, self.second = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('10.00'),
+            )
+            for i in range(2)
+        ]
+        self.backend = FailingBackend()
+        self.recommender = Recommender(self.backend)
+
+    def test_falls_back_to_last_known_suggestions(self):
+        self.recommender.products_bought([self.first, self.second])
+        self.assertEqual(
+            self.recommender.suggest_products_for([self.first]),
+            [self.second],
+        )
+        self.backend.failing = True
+        self.assertEqual(
+            self.recommender.suggest_products_for([self.first]),
+            [self.second],
+        )
+
+    def test_open_breaker_skips_backend(self):
+        self.backend.failing = True
+        for _ in range(5):
+            self.assertEqual(
+                self.recommender.suggest_products_for([self.second]), []
+            )
+        # после двух ошибок подряд хранилище больше не вызывается
+        self.assertEqual(self.backend.calls, 2)
+        self.assertEqual(self.backend.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_breaker_closes_after_success(self):
+        self.backend.failing = True
+        self.recommender.suggest_products_for([self.first])
+        self.recommender.suggest_products_for([self.first])
+        self.backend.failing = False
+        self.backend.breaker.reset_timeout = 0
+        self.recommender.suggest_products_for([self.first])
+        self.assertEqual(self.backend.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_products_bought_does_not_raise(self):
+        self.backend.failing = True
+        self.assertFalse(
+            self.recommender.products_bought([self.first, self.second])
+        )
+
+
+@override_settings(
+    RECOMMENDER_BACKEND=(
+        'shop.recommender.backends.memory.MemoryRecommenderBackend'
+    )
+)
+class IngestPurchasesTests(TestCase):
+
+    def setUp(self):
+        Recommender().clear_purchases()
+        category = Category.objects.create(name='Tea', slug='tea')
+        self.products = [
+            Product.objects.create(
+                category=category,
+                name=f'Tea {i}',
+                slug=f'tea-{i}',
+                price=Decimal('10.00'),
+            )
+            for i in range(3)
+        ]
+
+    def create_order(self, products, paid=True):
+        order = Order.objects.create(
+            first_name='Ivan',
+            last_name='Ivanov',
+            email='ivan@example.com',
+            address='Lenina 1',
+            postal_code='101000',
+            city='Moscow',
+            paid=paid,
+        )
+        for product in products:
+            OrderItem.objects.create(
+                order=order, product=product, price=product.price
+            )
+        return order
+
+    def test_ingests_paid_orders_in_batches(self):
+        first, second, third = self.products
+        self.create_order([first, second])
+        self.create_order([first, third])
+        self.create_order([first, third])
+        unpaid = self.create_order([second, third], paid=False)
+        self.assertEqual(ingest_purchases(batch_size=2), 3)
+        self.assertEqual(
+            Recommender().suggest_products_for([first]), [third, second]
+        )
+        self.assertFalse(
+            Order.objects.filter(
+                paid=True, recommendations_synced=False
+            ).exists()
+        )
+        unpaid.refresh_from_db()
+        self.assertFalse(unpaid.recommendations_synced)
+        # учтенные заказы не учитываются повторно
+        self.assertEqual(ingest_purchases(), 0)
+
+    def test_orders_stay_queued_when_backend_fails(self):
+        backend = Recommender().backend
+        order = self.create_order(self.products[:2])
+        with mock.patch.object(
+            backend, 'errors', (ConnectionError,)
+        ), mock.patch.object(
+            backend,
+            'products_bought_many',
+            side_effect=ConnectionError('backend is down'),
+        ):
+            self.assertEqual(ingest_purchases(), 0)
+        order.refresh_from_db()
+        self.assertFalse(order.recommendations_synced)
+
+    def test_rebuild_marks_only_orders_it_read(self):
+        first, second, third = self.products
+        read = self.create_order([first, second])
+        late = []
+        read_order_items = RebuildCommand.read_order_items
+
+        def read_then_pay(command, chunk_size):
+            items = read_order_items(command, chunk_size)
+            # заказ оплачен после чтения позиций
+            late.append(self.create_order([first, third]))
+            return items
+
+        with mock.patch.object(
+            RebuildCommand, 'read_order_items', read_then_pay
+        ):
+            call_command('rebuild_recommendations', stdout=StringIO())
+        read.refresh_from_db()
+        late[0].refresh_from_db()
+        self.assertTrue(read.recommendations_synced)
+        self.assertFalse(late[0].recommendations_synced)
+        self.assertEqual(ingest_purchases(), 1)
+
+    @override_settings(RECOMMENDER_MIN_SCORE=0.5)
+    def test_normalized_scores_are_not_mixed_with_counts(self):
+        first, second, third = self.products
+        Recommender().load_purchases(
+            [(first.id, {second.id: 0.2, third.id: 0.1})], mode='cosine'
+        )
+        self.create_order([first, third])
+        self.create_order([first, third])
+        # заказ учтен, но счетчики не прибавлены к косинусным оценкам
+        self.assertEqual(ingest_purchases(), 2)
+        self.assertEqual(Recommender().trim_purchases(), 0)
+        self.assertEqual(
+            Recommender().backend.suggest_for([first.id], 5),
+            [second.id, third.id],
+        )
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTests(TestCase):
+
+    def test_anonymous_request_is_denied(self):
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_wrong_token_is_denied(self):
+        response = self.client.get(
+            reverse('metrics'), headers={'Authorization': 'Bearer wrong'}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_token_grants_access(self):
+        response = self.client.get(
+            reverse('metrics'), headers={'Authorization': 'Bearer secret'}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_empty_token_is_not_accepted(self):
+        response = self.client.get(
+            reverse('metrics'), headers={'Authorization': 'Bearer '}
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_user_has_access(self):
+        self.client.force_login(
+            User.objects.create_user('staff', password='x', is_staff=True)
+        )
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
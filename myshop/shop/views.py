@@ -1,4 +1,10 @@
+import hmac
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 from django.shortcuts import render, get_object_or_404
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from .models import Category, Product
 from cart.forms import CartAddProductForm
 from .recommender import Recommender
@@ -30,6 +36,12 @@ def product_list(request, category_slug=None):
         # Фильтровать продукты по выбранной категории
         products = products.filter(category=category)
 
+    # Рекомендации для всех продуктов страницы одним вызовом хранилища
+    products = list(products)
+    recommended = Recommender().suggest_products_for_each(products)
+    for product in products:
+        product.recommended_products = recommended[product.id]
+
     return render(
         request,
         'shop/product/list.html',
@@ -77,3 +89,26 @@ def product_detail(request, id, slug):
             'recommended_products': recommended_products,
         },
     )
+
+
+def metrics(request):
+    """
+    Возвращает метрики процесса в формате Prometheus, в том числе
+    состояние предохранителя и задержки хранилища рекомендаций.
+    Доступны сотрудникам и по заголовку Authorization: Bearer
+    со значением METRICS_TOKEN.
+    Args:
+        request (object): Объект запроса
+    Returns:
+        HttpResponse: Метрики в текстовом формате Prometheus
+    Raises:
+        PermissionDenied: Если у запроса нет доступа к метрикам
+    """
+    if not request.user.is_staff:
+        token = settings.METRICS_TOKEN
+        header = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(
+            header.encode(), f'Bearer {token}'.encode()
+        ):
+            raise PermissionDenied
+    return HttpResponse(generate_latest(), content_type=CONTENT_TYPE_LATEST)